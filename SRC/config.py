@@ -38,4 +38,54 @@ DIR_SERIE_A_ANTERIOR = os.path.join(DIR_REM_ANTERIOR, "SERIE_A")
 DIR_SERIE_P_ACTUAL = os.path.join(DIR_REM_ACTUAL, "SERIE_P")
 DIR_SERIE_P_ANTERIOR = os.path.join(DIR_REM_ANTERIOR, "SERIE_P")
 
+# Motor de lectura de libros REM: "openpyxl" o "xml" (lector directo zip/XML, más rápido)
+REM_ENGINE = os.environ.get("METAS_REM_ENGINE", "openpyxl")
+
+# Cubo REM: cada libro .xlsm convertido una vez a Parquet en formato largo, particionado por año y serie
+# (METAS_CUBE=0 vuelve a leer los Excel con la caché de extracción)
+CUBE_DIR = os.path.join(DATOS_DIR, "CUBO_REM") if os.environ.get("METAS_CUBE", "1") != "0" else None
+# Caché persistente de extracción REM, solo para la lectura directa de los Excel (METAS_CACHE=0 la desactiva)
+CACHE_DIR = os.path.join(DATOS_DIR, "CACHE")
+EXTRACTION_CACHE = os.path.join(CACHE_DIR, "extraccion_rem.sqlite") if os.environ.get("METAS_CACHE", "1") != "0" and CUBE_DIR is None else None
+# Agregados parciales por archivo REM (centro, año, mes) para el modo --incremental
+PARTIALS_STORE = os.path.join(CACHE_DIR, "parciales_metas.sqlite") if os.environ.get("METAS_CACHE", "1") != "0" else None
+# Manifiesto de archivos REM de la última ejecución (para detectar nuevos, modificados y eliminados)
+MANIFEST_FILE = os.path.join(CACHE_DIR, "manifiesto_rem.json") if os.environ.get("METAS_CACHE", "1") != "0" else None
+# Validar además por hash de contenido (archivos re-descargados con otra fecha de modificación)
+CACHE_HASH_CONTENT = os.environ.get("METAS_CACHE_HASH", "0") == "1"
+
+# Lectura de libros REM en paralelo: procesos y tiempo máximo por archivo (segundos)
+EXTRACTION_WORKERS = int(os.environ.get("METAS_EXTRACTION_WORKERS", min(8, os.cpu_count() or 1)))
+EXTRACTION_TIMEOUT = float(os.environ.get("METAS_EXTRACTION_TIMEOUT", 300))
+
+# Procesos para calcular metas en paralelo (METAS_WORKERS=1 las ejecuta en secuencia)
+METAS_WORKERS = int(os.environ.get("METAS_WORKERS", min(7, os.cpu_count() or 1)))
+# Contexto compartido con esos procesos como archivos Arrow mapeados en memoria (METAS_SHARED_CONTEXT=0: copia serializada)
+SHARED_CONTEXT = os.environ.get("METAS_SHARED_CONTEXT", "1") != "0"
+
+# Registro: nivel general, niveles por componente (METAS_LOG_LEVELS="scan=DEBUG,meta_3=DEBUG") y nivel de la consola
+# El detalle por celda y por archivo de las metas se registra en DEBUG
+LOG_LEVEL = os.environ.get("METAS_LOG_LEVEL", "INFO").strip().upper()
+LOG_LEVELS = {
+    component.strip(): level.strip().upper()
+    for component, level in (item.split("=", 1) for item in os.environ.get("METAS_LOG_LEVELS", "").split(",") if "=" in item)
+}
+CONSOLE_LOG_LEVEL = os.environ.get("METAS_CONSOLE_LEVEL", "INFO").strip().upper()
+
+# Perfilador de la ejecución completa: "cprofile" o "pyinstrument" (vacío = solo el perfil JSON por etapa)
+PROFILE_MODE = os.environ.get("METAS_PROFILE", "").strip().lower()
+
+# Exportación opcional de los resultados de cada meta a DATOS/reporte_<meta>_preliminar.csv (el consolidado no los necesita)
+EXPORT_CSV = os.environ.get("METAS_EXPORT_CSV", "0") == "1"
+
+# Histórico de resultados: Parquet particionado por año y mes de corte (METAS_HISTORY=0 lo desactiva)
+HISTORY_DIR = os.path.join(DATOS_DIR, "RENDIMIENTO", "HISTORICO") if os.environ.get("METAS_HISTORY", "1") != "0" else None
+
 PIV_FILE = os.path.join(DATOS_DIR, "PIV", "PIV_2024_09_DSM_SI_ACEPTADOS.parquet")
+# Filas por lote al recorrer el PIV: la memoria de la agregación depende del lote y no del tamaño del PIV
+PIV_BATCH_SIZE = int(os.environ.get("METAS_PIV_BATCH_SIZE", 256 * 1024))
+# Fecha de referencia de las edades del PIV para los denominadores (METAS_AGE_REFERENCE=2026-12-31);
+# vacío = EDAD_EN_FECHA_CORTE, la edad a la fecha de corte FONASA
+AGE_REFERENCE_DATE = datetime.strptime(os.environ["METAS_AGE_REFERENCE"], "%Y-%m-%d").date() if os.environ.get("METAS_AGE_REFERENCE") else None
+# Extractos FONASA Detalle_<centro>.txt desde los que se puede construir el PIV (main_consolidado.py --construir-piv)
+PIV_DETALLE_DIR = os.path.join(DATOS_DIR, "PIV", "DETALLE")
@@ -1,132 +1,360 @@
 import sys
 import os
-import csv
+import time
+import argparse
 import openpyxl
-import subprocess
-from datetime import datetime
+import pyarrow as pa
+from datetime import datetime, date
 
 # Add project root to path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.dirname(current_dir))
 sys.path.append(os.path.join(project_root, 'SRC'))
 
-from modules.utils import normalize_path, load_center_names
+from modules.utils import normalize_path
+from modules.context import new_run_context, context_rem_files, context_piv_histogram
+from modules.extraction import merge_requests, extract_rem, ingest_rem
+from modules.scheduler import run_dag
+from modules.shared import shared_context
+from modules.partials import pending_entries, purge_partials
+from modules.manifest import build_manifest, load_manifest, save_manifest, diff_manifest
+from modules.cache import open_cache, cache_purge
+from modules.cube import purge_parts
+from modules.profiling import span, write_profile, profiler
+from modules.results import concat_results, consolidate, export_csv
+from modules.history import append_history
+from modules.piv_builder import build_piv, find_sources
+from modules.piv import find_piv_files
+from modules.snapshots import scan_snapshots, snapshot_cuts, snapshot_histogram, population_drift, cut_label
+from modules.logs import get_logger, run_id, audit_file
+from metas import meta_1_dsm, meta_2_pap, meta_3_bucal, meta_4_dm2, meta_5_hta, meta_6_lactancia, meta_7_resp
 
-from config import DATOS_DIR
+from config import DATOS_DIR, DIR_SERIE_A_ACTUAL, DIR_SERIE_A_ANTERIOR, DIR_SERIE_P_ACTUAL, METAS_WORKERS, MANIFEST_FILE, EXTRACTION_CACHE, CUBE_DIR
+from config import REM_ENGINE, EXTRACTION_WORKERS, PROFILE_MODE, EXPORT_CSV, HISTORY_DIR, PIV_DETALLE_DIR, SHARED_CONTEXT
 
-def run_meta_scripts():
-    """Ejecuta todos los scripts de cálculo de metas"""
+log = get_logger("main")
+
+# Carpetas REM que se escanean una vez por ejecución
+DIRS_REM = [DIR_SERIE_A_ACTUAL, DIR_SERIE_A_ANTERIOR, DIR_SERIE_P_ACTUAL]
+
+# Metas agrupadas por la serie REM que consumen
+METAS_SERIE_A = [meta_1_dsm, meta_3_bucal, meta_6_lactancia]
+METAS_SERIE_P = [meta_2_pap, meta_4_dm2, meta_5_hta, meta_7_resp]
+
+# Metas con denominadores desde el PIV (denominadores_piv), para el análisis por cortes
+METAS_PIV = [meta_2_pap, meta_3_bucal, meta_4_dm2, meta_5_hta, meta_7_resp]
+
+# Grafo de ejecución: cada meta depende solo de las etapas compartidas que usa
+METAS = {
+    'meta_1': (meta_1_dsm.calcular_meta_1, ['rem_serie_a']),
+    'meta_2': (meta_2_pap.calcular_meta_2, ['piv', 'rem_serie_p']),
+    'meta_3': (meta_3_bucal.calcular_meta_3, ['piv', 'rem_serie_a']),
+    'meta_4': (meta_4_dm2.calcular_meta_4, ['piv', 'rem_serie_p']),
+    'meta_5': (meta_5_hta.calcular_meta_5, ['piv', 'rem_serie_p']),
+    'meta_6': (meta_6_lactancia.calcular_meta_6, ['rem_serie_a']),
+    'meta_7': (meta_7_resp.calcular_meta_7, ['piv', 'rem_serie_p']),
+}
+
+def preparar_piv(context):
+    """Histograma de población PIV: se lee el PIV completo solo si cambió desde la última ejecución"""
+    log.info("=== Preparando histograma de población PIV ===")
+    return context_piv_histogram(context)
+
+def escanear_rem(context):
+    """Escaneo único de las carpetas REM y comparación con el manifiesto de la ejecución anterior"""
+    log.info("=== Escaneando carpetas REM ===")
+    entries = []
+    for root_dir in DIRS_REM:
+        entries += context_rem_files(context, root_dir)
+    manifest = build_manifest(entries)
+    previous = load_manifest(MANIFEST_FILE)
+    diff = diff_manifest(previous, manifest)
+    if previous is not None:
+        log.info(f"Manifiesto REM: {len(diff['added'])} nuevos, {len(diff['changed'])} modificados, {len(diff['removed'])} eliminados")
+    else:
+        diff = None
+    context['manifest_diff'] = diff
+    context['manifest_current'] = manifest
+
+    if diff and diff['removed']:
+        # Los archivos eliminados no deben seguir aportando a los agregados ni ocupar la caché
+        purge_partials(diff['removed'])
+        if EXTRACTION_CACHE and os.path.exists(EXTRACTION_CACHE):
+            conn = open_cache(EXTRACTION_CACHE)
+            try:
+                cache_purge(conn, diff['removed'])
+                conn.commit()
+            finally:
+                conn.close()
+        if CUBE_DIR:
+            purge_parts(CUBE_DIR, [dict(previous[path], path=path) for path in diff['removed']])
+    return diff
+
+def construir_cubo(context):
+    """Incorpora al cubo REM (Parquet) los libros nuevos o modificados de todas las carpetas REM"""
+    if not CUBE_DIR:
+        return 0
+    log.info("=== Actualizando cubo REM ===")
+    entries = []
+    for root_dir in DIRS_REM:
+        entries += context_rem_files(context, root_dir)
+    return ingest_rem(entries, context['quarantine'])
+
+def guardar_manifiesto(context):
+    """Guarda el manifiesto del escaneo al terminar la ejecución (base para la próxima comparación)"""
+    if MANIFEST_FILE and context.get('manifest_current') is not None:
+        try:
+            save_manifest(MANIFEST_FILE, context['manifest_current'])
+        except OSError as e:
+            log.warning(f"No se pudo guardar el manifiesto REM: {e}")
+
+def extraer_serie_a(context):
+    """Extracción única de los REM Serie A (año actual y anterior) para todas las metas A"""
+    log.info("=== Extrayendo datos REM Serie A (una lectura por archivo) ===")
+    mapping_a = context_rem_files(context, DIR_SERIE_A_ACTUAL) + context_rem_files(context, DIR_SERIE_A_ANTERIOR)
+    if context['incremental']:
+        # Solo los meses nuevos o modificados: el resto se toma de los agregados parciales
+        diff = context.get('manifest_diff')
+        if diff is not None:
+            modificados = set(diff['added']) | set(diff['changed'])
+            mapping_a = [entry for entry in mapping_a if entry['path'] in modificados]
+        else:
+            # Sin manifiesto anterior: se compara contra los agregados guardados
+            pendientes = {}
+            for m in METAS_SERIE_A:
+                for entry in pending_entries(m.META_ID, m.seleccionar_archivos(mapping_a)):
+                    pendientes[entry['path']] = entry
+            mapping_a = list(pendientes.values())
+        log.info(f"Modo incremental: {len(mapping_a)} archivos REM A nuevos o modificados")
+    extract_rem(mapping_a, merge_requests(*[m.REM_REQUESTS for m in METAS_SERIE_A]), context['rem'], context['quarantine'])
+
+def extraer_serie_p(context):
+    """Extracción única de los REM Serie P para todas las metas P"""
+    log.info("=== Extrayendo datos REM Serie P (una lectura por archivo) ===")
+    mapping_p = context_rem_files(context, DIR_SERIE_P_ACTUAL)
+    extract_rem(mapping_p, merge_requests(*[m.REM_REQUESTS for m in METAS_SERIE_P]), context['rem'], context['quarantine'])
+
+def construir_piv(carpeta=PIV_DETALLE_DIR):
+    """Construye el PIV Parquet en DATOS/PIV desde los extractos FONASA Detalle_*.txt (reemplaza el paso manual en R)"""
+    log.info("=== Construyendo PIV desde extractos Detalle ===")
+    extractos = find_sources(carpeta)
+    if not extractos:
+        sys.exit(f"ERROR CRITICO: No se encontraron extractos Detalle_*.txt en: {carpeta}. La ejecución no puede continuar.")
+    with span('construir_piv'):
+        path_piv, _ = build_piv(extractos, os.path.join(DATOS_DIR, "PIV"), workers=EXTRACTION_WORKERS)
+    return path_piv
+
+def run_meta_scripts(on_reporte=None, incremental=False, meta_ids=None, piv_file=None):
+    """
+    Ejecuta las etapas compartidas y luego las metas en paralelo (METAS_WORKERS procesos).
+    on_reporte(meta, reporte, context) se llama a medida que cada meta termina.
+    Con incremental=True las metas de la Serie A solo leen los meses nuevos o modificados.
+    meta_ids limita la ejecución a esas metas y a las etapas que usan (None = todas).
+    piv_file fija el PIV a usar (None = el más reciente de DATOS/PIV).
+    """
+    meta_ids = list(METAS) if meta_ids is None else list(meta_ids)
+    desconocidas = [meta for meta in meta_ids if meta not in METAS]
+    if desconocidas:
+        raise ValueError(f"Metas desconocidas: {desconocidas}. Disponibles: {list(METAS)}")
     
     # Buscar archivo PIV más reciente y válido
-    piv_dir = os.path.join(DATOS_DIR, "PIV")
-    piv_files = [f for f in os.listdir(piv_dir) if f.startswith("PIV_") and f.endswith(".parquet")]
-    if not piv_files:
-        sys.exit(f"ERROR CRITICO: No se encontró ningún archivo PIV válido en: {piv_dir}. La ejecución no puede continuar.")
-    # Selecciona el archivo más reciente por nombre
-    piv_files.sort(reverse=True)
-    piv_file = os.path.join(piv_dir, piv_files[0])
-    print(f"Usando archivo PIV: {piv_file}")
+    if piv_file is None:
+        piv_dir = os.path.join(DATOS_DIR, "PIV")
+        piv_files = [f for f in os.listdir(piv_dir) if f.startswith("PIV_") and f.endswith(".parquet")]
+        if not piv_files:
+            sys.exit(f"ERROR CRITICO: No se encontró ningún archivo PIV válido en: {piv_dir}. La ejecución no puede continuar.")
+        # Selecciona el archivo más reciente por nombre
+        piv_files.sort(reverse=True)
+        piv_file = os.path.join(piv_dir, piv_files[0])
+    log.info(f"Usando archivo PIV: {piv_file}")
     if not os.path.exists(piv_file):
         sys.exit(f"ERROR CRITICO: No se encontró el archivo PIV seleccionado en: {piv_file}. La ejecución no puede continuar.")
-        
-    scripts = [
-        "SRC/metas/meta_1_dsm.py",
-        "SRC/metas/meta_2_pap.py",
-        "SRC/metas/meta_3_bucal.py",
-        "SRC/metas/meta_4_dm2.py",
-        "SRC/metas/meta_5_hta.py",
-        "SRC/metas/meta_6_lactancia.py",
-        "SRC/metas/meta_7_resp.py"
-    ]
+
+    # Contexto compartido: logger, nombres de centros, listados REM, extracción y PIV se cargan una vez
+    context = new_run_context(piv_file, incremental)
+
+    nodes = {
+        'piv': {'func': preparar_piv, 'deps': [], 'stage': True},
+        'manifiesto': {'func': escanear_rem, 'deps': [], 'stage': True},
+        'cubo': {'func': construir_cubo, 'deps': ['manifiesto'], 'stage': True},
+        'rem_serie_a': {'func': extraer_serie_a, 'deps': ['cubo'], 'stage': True},
+        'rem_serie_p': {'func': extraer_serie_p, 'deps': ['cubo'], 'stage': True},
+    }
+    for meta in meta_ids:
+        calcular, deps = METAS[meta]
+        nodes[meta] = {'func': calcular, 'deps': deps}
+    # Solo las etapas que alguna meta pedida necesita (directa o indirectamente)
+    necesarias = set(meta_ids)
+    pendientes = list(meta_ids)
+    while pendientes:
+        for dep in nodes[pendientes.pop()]['deps']:
+            if dep not in necesarias:
+                necesarias.add(dep)
+                pendientes.append(dep)
+    nodes = {name: node for name, node in nodes.items() if name in necesarias}
     
-    print("=== Ejecutando Scripts de Metas ===")
-    for script in scripts:
-        script_path = normalize_path(script)
-        if os.path.exists(script_path):
-            print(f"Ejecutando {script}...")
-            # Remove try/except to allow failure to stop execution as requested
-            # "SI FALTA ALGUNO ESTE SE DETIENE"
-            subprocess.run([sys.executable, script_path], check=True)
-        else:
-            print(f"Script no encontrado: {script_path}")
-            # If a script is missing, should we stop too? Probably yes.
-            sys.exit(f"Error Fatal: Script no encontrado {script_path}")
+    log.info(f"=== Ejecutando Cálculos de Metas ({METAS_WORKERS} procesos) ===")
+    # Sin try/except: una falla detiene la ejecución completa
+    # "SI FALTA ALGUNO ESTE SE DETIENE"
+    # Los procesos reciben el histograma PIV, la extracción REM y los centros como archivos Arrow
+    # mapeados en memoria (no una copia serializada del contexto por meta)
+    with shared_context() as publicador:
+        share = publicador.snapshot if SHARED_CONTEXT else None
+        for name, result in run_dag(nodes, context, METAS_WORKERS, share):
+            if name in METAS:
+                log.info(f"Finalizada {name}")
+                if on_reporte is not None:
+                    on_reporte(name, result, context)
             
-    print("=== Ejecución Finalizada ===")
+    if len(meta_ids) == len(METAS):
+        # Con un subconjunto de metas no se guarda: las demás aún no vieron los cambios del manifiesto
+        guardar_manifiesto(context)
+    log.info(f"Archivos REM extraídos: {len(context['rem'])}, en cuarentena: {len(context['quarantine'])}")
+    log.info("=== Ejecución Finalizada ===")
+    return context
+
+def ejecutar_metas(meta_ids=None, incremental=False, exportar_csv=False, piv_file=None):
+    """
+    Ejecuta las metas (todas por defecto) y devuelve (tabla Arrow de resultados, contexto).
+    La tabla sigue el orden de METAS, sin importar qué proceso terminó primero.
+    Con exportar_csv=True cada meta deja además su DATOS/reporte_<meta>_preliminar.csv.
+    """
+    resultados = {}
+
+    def recibir_resultado(meta, tabla, context):
+        if tabla is None:
+            log.warning(f"{meta} no generó reporte.")
+            return
+        resultados[meta] = tabla
+        if exportar_csv:
+            export_csv(tabla, meta)
+
+    context = run_meta_scripts(recibir_resultado, incremental, meta_ids, piv_file)
+    return concat_results([resultados.get(meta) for meta in METAS]), context
+
+def compute(meta_ids=None, incremental=False):
+    """
+    API de cálculo para notebooks y la actualización BI: tabla Arrow con los resultados
+    por centro de las metas indicadas (p. ej. compute(['meta_2', 'meta_5'])), sin archivos intermedios.
+    """
+    return ejecutar_metas(meta_ids, incremental)[0]
+
+def consolidar_reportes(incremental=False, exportar_csv=False, piv_file=None):
+    inicio = time.perf_counter()
+    log.info(f"Ejecución {run_id()} (registro: {audit_file()})")
 
-def consolidar_reportes():
     # 1. Ejecutar Cálculos
-    run_meta_scripts()
-    
-    print("\n=== Generando Reporte Consolidado de Rendimiento ===")
-    
-    map_nombres = load_center_names()
-    
+    resultados, context = ejecutar_metas(None, incremental, exportar_csv, piv_file)
+
+    # 2. Brechas, casos faltantes y estado sobre la tabla completa
+    fecha_corte = date.today()
+    with span('consolidar'):
+        consolidado = consolidate(resultados, context['center_names'], fecha_corte.strftime("%Y-%m-%d"))
+    with span('exportar_excel'):
+        path_excel = exportar_consolidado(consolidado, context['quarantine'])
+    with span('historico'):
+        guardar_historico(consolidado, fecha_corte)
+    guardar_perfil(path_excel, context, time.perf_counter() - inicio)
+    return path_excel
+
+def denominadores_por_corte(fuentes=None):
+    """
+    Denominadores PIV de todas las metas para varios cortes FONASA en una sola lectura (archivos PIV
+    y/o carpetas; por defecto todos los PIV_*.parquet de DATOS/PIV), agrupados por corte y centro,
+    más las altas y bajas por centro entre cortes consecutivos (por ID_PCTE).
+    Devuelve (denominadores, deriva) como tablas Arrow.
+    """
+    fuentes = fuentes or find_piv_files()
+    if not fuentes:
+        sys.exit(f"ERROR CRITICO: No se encontraron archivos PIV en: {normalize_path('DATOS/PIV')}")
+    hist, miembros = scan_snapshots(fuentes)
+
+    filas = {'Corte': [], 'Meta_ID': [], 'COD_CENTRO': [], 'Denominador': []}
+    for anio, mes in snapshot_cuts(hist):
+        piv_hist = snapshot_histogram(hist, anio, mes)
+        for meta in METAS_PIV:
+            for meta_id, denominadores in meta.denominadores_piv(piv_hist).items():
+                for centro in sorted(denominadores):
+                    filas['Corte'].append(cut_label(anio, mes))
+                    filas['Meta_ID'].append(meta_id)
+                    filas['COD_CENTRO'].append(centro)
+                    filas['Denominador'].append(denominadores[centro])
+    denominadores = pa.table({
+        'Corte': pa.array(filas['Corte'], pa.string()),
+        'Meta_ID': pa.array(filas['Meta_ID'], pa.string()),
+        'COD_CENTRO': pa.array(filas['COD_CENTRO'], pa.string()),
+        'Denominador': pa.array(filas['Denominador'], pa.int64()),
+    })
+    with span('deriva'):
+        deriva = population_drift(miembros)
+    return denominadores, deriva
+
+def analizar_cortes(fuentes=None):
+    """Excel de cortes PIV (hojas Denominadores y Altas_Bajas) en DATOS/RENDIMIENTO"""
+    log.info("=== Analizando cortes PIV ===")
+    with span('cortes_piv'):
+        denominadores, deriva = denominadores_por_corte(fuentes)
+
     output_dir = normalize_path("DATOS/RENDIMIENTO")
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    path_excel = os.path.join(output_dir, f"Cortes_PIV_{datetime.now().strftime('%Y-%m-%d')}.xlsx")
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for nombre, tabla in [("Denominadores", denominadores), ("Altas_Bajas", deriva)]:
+        ws = wb.create_sheet(nombre)
+        ws.append(tabla.column_names)
+        for fila in zip(*[columna.to_pylist() for columna in tabla.columns]):
+            ws.append(list(fila))
+    try:
+        wb.save(path_excel)
+        log.info(f"Archivo generado: {path_excel}")
+    except OSError as e:
+        log.error(f"Error guardando Excel: {e}")
+    return path_excel
 
-    # Buscar archivos de reporte preliminar de metas
-    report_dir = normalize_path("DATOS")
-    report_files = [f for f in os.listdir(report_dir) if f.startswith("reporte_meta_") and f.endswith("_preliminar.csv")]
-    if not report_files:
-        print("No se encontraron archivos de reporte preliminar de metas.")
-        return
+def guardar_historico(consolidado, fecha_corte):
+    """Agrega los resultados al histórico Parquet (DATOS/RENDIMIENTO/HISTORICO); una nueva ejecución del mes reemplaza sus filas"""
+    if not HISTORY_DIR or consolidado.num_rows == 0:
+        return None
+    try:
+        path_historico = append_history(HISTORY_DIR, consolidado, fecha_corte, run_id())
+        log.info(f"Histórico actualizado: {path_historico}")
+        return path_historico
+    except OSError as e:
+        log.warning(f"No se pudo actualizar el histórico de resultados: {e}")
+        return None
 
-    consolidado = []
+def guardar_perfil(path_excel, context, segundos):
+    """Perfil JSON de la ejecución (tiempos por etapa, archivos, bytes, caché, memoria) junto al Excel consolidado"""
+    path_perfil = os.path.splitext(path_excel)[0] + "_perfil.json"
+    try:
+        write_profile(
+            path_perfil,
+            run_id=run_id(),
+            total_seconds=round(segundos, 4),
+            incremental=context['incremental'],
+            rem_engine=REM_ENGINE,
+            cube=bool(CUBE_DIR),
+            metas_workers=METAS_WORKERS,
+            extraction_workers=EXTRACTION_WORKERS,
+            piv_file=context['piv_file'],
+            rem_files=len(context['rem']),
+            quarantined=len(context['quarantine']),
+        )
+        log.info(f"Perfil de ejecución: {path_perfil}")
+    except OSError as e:
+        log.warning(f"No se pudo guardar el perfil de ejecución: {e}")
 
-    for filename in report_files:
-        csv_path = os.path.join(report_dir, filename)
-        if os.path.exists(csv_path):
-            try:
-                with open(csv_path, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        # Leer datos del CSV (Source of Truth)
-                        meta_id = row.get('Meta_ID', 'Desconocido')
-                        indicador = row.get('Indicador', row.get('Nombre_Indicador', ''))
-                        
-                        try:
-                            num = float(row.get('Numerador', 0))
-                            den = float(row.get('Denominador', 0))
-                            cump = float(row.get('Cumplimiento', row.get('Cumplimiento_Actual', 0)))
-                            meta_fijada = float(row.get('Meta_Fijada', 0))
-                            meta_nacional = float(row.get('Meta_Nacional', 0))
-                        except ValueError:
-                            continue
-
-                        centro = row.get('Centro', 'Desconocido')
-                        nombre_centro = map_nombres.get(centro, 'Desconocido')
-                        if nombre_centro == 'Desconocido' and centro[-1].isalpha():
-                             nombre_centro = map_nombres.get(centro[:-1], 'Desconocido')
-                        
-                        # Cálculos finales
-                        brecha_fijada = meta_fijada - cump
-                        brecha_nacional = meta_nacional - cump
-                        
-                        target_num = den * (meta_fijada / 100.0)
-                        falta_para_meta = max(0, target_num - num)
-                        
-                        consolidado.append({
-                            'Meta_ID': meta_id,
-                            'Nombre_Indicador': indicador,
-                            'COD_CENTRO': centro,
-                            'Nombre_Centro': nombre_centro,
-                            'Numerador_Actual': num,
-                            'Denominador_Actual': den,
-                            'Cumplimiento_Actual_%': round(cump, 2),
-                            'Meta_Fijada_%': meta_fijada,
-                            'Meta_Nacional_%': meta_nacional,
-                            'Brecha_vs_Fijada_%': round(brecha_fijada, 2),
-                            'Brecha_vs_Nacional_%': round(brecha_nacional, 2),
-                            'Casos_Faltantes_Meta_Fijada': round(falta_para_meta, 0),
-                            'Estado': 'Cumplido' if cump >= meta_fijada else 'Pendiente'
-                        })
-            except Exception as e:
-                print(f"Error leyendo {csv_path}: {e}")
+def exportar_consolidado(consolidado, cuarentena):
+    """Escribe el Excel consolidado (hoja Consolidado y, si hay, hoja Cuarentena) en DATOS/RENDIMIENTO"""
+    log.info("=== Generando Reporte Consolidado de Rendimiento ===")
+    
+    output_dir = normalize_path("DATOS/RENDIMIENTO")
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
                 
-    if not consolidado:
-        print("No se generaron datos para el reporte.")
+    if consolidado.num_rows == 0:
+        log.warning("No se generaron datos para el reporte.")
     
     # Exportar Excel
     fecha_hoy = datetime.now().strftime("%Y-%m-%d")
@@ -138,21 +366,44 @@ def consolidar_reportes():
         ws = wb.active
         ws.title = "Consolidado"
         
-        headers = ['Fecha_Corte', 'Meta_ID', 'Nombre_Indicador', 'COD_CENTRO', 'Nombre_Centro', 'Numerador_Actual', 'Denominador_Actual', 
-                   'Cumplimiento_Actual_%', 'Meta_Fijada_%', 'Meta_Nacional_%', 'Brecha_vs_Fijada_%', 
-                   'Brecha_vs_Nacional_%', 'Casos_Faltantes_Meta_Fijada', 'Estado']
-        ws.append(headers)
+        ws.append(consolidado.column_names)
+        for fila in zip(*[columna.to_pylist() for columna in consolidado.columns]):
+            ws.append(list(fila))
         
-        fecha_corte = datetime.now().strftime("%Y-%m-%d")
-        
-        for item in consolidado:
-            item['Fecha_Corte'] = fecha_corte
-            ws.append([item.get(h, '') for h in headers])
+        # Archivos REM que no se pudieron leer (corruptos, bloqueados o sin respuesta)
+        if cuarentena:
+            ws_cuarentena = wb.create_sheet("Cuarentena")
+            ws_cuarentena.append(['COD_CENTRO', 'Año', 'Mes', 'Archivo', 'Ruta', 'Motivo'])
+            for item in cuarentena:
+                ws_cuarentena.append([item['code'], item['year'], item['month'], item['filename'], item['path'], item['motivo']])
+            log.warning(f"{len(cuarentena)} archivos REM en cuarentena (ver hoja Cuarentena).")
             
-        print(f"Archivo generado: {path_excel}")
+        log.info(f"Archivo generado: {path_excel}")
         wb.save(path_excel)
     except Exception as e:
-        print(f"Error guardando Excel: {e}")
+        log.error(f"Error guardando Excel: {e}")
+    return path_excel
 
 if __name__ == "__main__":
-    consolidar_reportes()
+    parser = argparse.ArgumentParser(description="Cálculo y consolidado de Metas Sanitarias")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reutiliza los agregados parciales por centro y mes; solo lee los REM nuevos o modificados")
+    parser.add_argument("--construir-piv", action="store_true",
+                        help="Construye antes el PIV desde los extractos Detalle_*.txt de DATOS/PIV/DETALLE")
+    parser.add_argument("--csv", action="store_true", default=EXPORT_CSV,
+                        help="Exporta además los resultados de cada meta a DATOS/reporte_<meta>_preliminar.csv (o METAS_EXPORT_CSV=1)")
+    parser.add_argument("--cortes", nargs="*", metavar="PIV",
+                        help="Solo análisis por cortes: denominadores PIV y altas/bajas por centro de los PIV o carpetas "
+                             "indicados (sin argumentos, todos los PIV_*.parquet de DATOS/PIV)")
+    args = parser.parse_args()
+    # METAS_PROFILE=cprofile|pyinstrument: perfil completo del proceso principal en DATOS/RENDIMIENTO
+    salida_perfil = normalize_path("DATOS/RENDIMIENTO")
+    os.makedirs(salida_perfil, exist_ok=True)
+    base_perfil = os.path.join(salida_perfil, f"Perfil_{PROFILE_MODE or 'ejecucion'}_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}")
+    with profiler(PROFILE_MODE, base_perfil):
+        # El PIV recién construido se usa en esta ejecución aunque otro PIV_* ordene después por nombre
+        piv_file = construir_piv() if args.construir_piv else None
+        if args.cortes is not None:
+            analizar_cortes(args.cortes)
+        else:
+            consolidar_reportes(args.incremental, args.csv, piv_file)
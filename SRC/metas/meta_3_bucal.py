@@ -1,59 +1,128 @@
 import sys
 import os
-import csv
-import openpyxl
 
 # Add project root to path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.dirname(current_dir))
 sys.path.append(os.path.join(project_root, 'SRC'))
 
-from modules.dataloaders import scan_rem_files, load_piv_data
+from modules.context import new_run_context, context_rem_files, context_piv_histogram
+from modules.piv import count_by_center
+from modules.ranges import stack_rows, stack_ranges, as_count
+from modules.partials import file_contributions
+from modules.labels import label_rows
 from modules.utils import normalize_path
-from config import DIR_SERIE_A_ACTUAL, PIV_FILE
+from modules.results import results_table, export_csv
+from modules.logs import get_logger
+from config import DIR_SERIE_A_ACTUAL, AGNO_ACTUAL
 
-def calcular_meta_3():
-    print("=== Calculando Meta 3: Salud Bucal ===")
+log = get_logger("meta_3")
+
+# Meta 3A: CERO (0-9 años)
+# Num: REM A03, Sección D.7. "Pauta CERO" -> Fila "TOTAL" -> Suma Col 5 a 24 (0 a 9 años)
+SHEET_3A = "A03"
+COLS_IDX_3A = range(5, 25) # 5 to 24 inclusive (<1 to 9 years, M+F)
+MAX_ROW_3A = 300
+LABEL_SECCION_3A = "PAUTA CERO"
+LABEL_TOTAL_3A = "TOTAL"
+
+# Meta 3B: Libre de Caries (6 años)
+# Num: REM A09, Sección C. S48 + T48
+SHEET_3B = "A09"
+RANGE_3B = "S48:T48"
+
+# Identificador de la meta en el almacén de agregados parciales
+META_ID = "meta_3"
+
+# Celdas y filas que la etapa de extracción debe leer para esta meta
+REM_REQUESTS = [
+    {'sheet': SHEET_3A, 'max_row': MAX_ROW_3A, 'labels': [LABEL_SECCION_3A, LABEL_TOTAL_3A]},
+    {'sheet': SHEET_3B, 'ranges': [RANGE_3B]},
+]
+
+def seleccionar_archivos(mapping):
+    """Archivos REM que aportan a la meta: todo el año actual"""
+    return [entry for entry in mapping if entry['year'] == AGNO_ACTUAL]
+
+def aportes_archivos(rem, entries):
+    """Aporte de cada archivo REM A (centro, mes) a los numeradores 3A y 3B"""
+    aportes = {entry['path']: {'num_3a': 0, 'num_3b': 0} for entry in entries}
+    # Meta 3A (A03): fila TOTAL de cada archivo
+    filas_total = {}
+    for entry in entries:
+        hojas = rem[entry['path']]
+        if SHEET_3A in hojas:
+            # Primera fila TOTAL después del inicio de la sección PAUTA CERO
+            target_row = None
+            rows = hojas[SHEET_3A]['rows']
+            filas_seccion = label_rows(hojas[SHEET_3A], LABEL_SECCION_3A, max_row=MAX_ROW_3A)
+            if filas_seccion:
+                for r in label_rows(hojas[SHEET_3A], LABEL_TOTAL_3A, max_row=MAX_ROW_3A):
+                    if r > filas_seccion[0] and r not in filas_seccion:
+                        target_row = r
+                        break
+            if target_row and rows[target_row - 1]:
+                filas_total[entry['path']] = [target_row]
+            else:
+                log.warning(f"No se encontró fila TOTAL en sección PAUTA CERO en {entry['path']}")
+        else:
+            log.warning(f"Hoja {SHEET_3A} no encontrada en {entry['path']}")
+        if SHEET_3B not in hojas:
+            log.warning(f"Hoja {SHEET_3B} no encontrada en {entry['path']}")
+
+    # Columnas 5 a 24 de las filas TOTAL de todos los archivos en un solo arreglo (una fila por archivo)
+    bloque, _ = stack_rows(rem, SHEET_3A, filas_total, COLS_IDX_3A[0], COLS_IDX_3A[-1])
+    for (file_path, (target_row,)), val_3a in zip(filas_total.items(), bloque.sum(axis=1)):
+        log.debug("Meta 3A fila %s columnas %s-%s en %s: %g", target_row, COLS_IDX_3A[0], COLS_IDX_3A[-1], file_path, val_3a)
+        aportes[file_path]['num_3a'] += as_count(val_3a)
+
+    # Meta 3B (A09): S48:T48 de todos los archivos a la vez
+    bloques, archivos = stack_ranges(rem, entries, SHEET_3B, RANGE_3B)
+    for entry, val_3b in zip(archivos, bloques.sum(axis=(1, 2))):
+        log.debug("Meta 3B %s en %s: %g", RANGE_3B, entry['filename'], val_3b)
+        aportes[entry['path']]['num_3b'] += as_count(val_3b)
+    return aportes
+
+def denominadores_piv(piv_hist):
+    """Denominadores PIV por centro: 0-9 años para 3A, 6 años para 3B"""
+    return {'Meta 3A': count_by_center(piv_hist, 0, 9), 'Meta 3B': count_by_center(piv_hist, 6, 6)}
+
+def calcular_meta_3(context=None):
+    log.info("=== Calculando Meta 3: Salud Bucal ===")
+    if context is None:
+        context = new_run_context()
     
     # 1. Configuración
     DATA_DIR_A = DIR_SERIE_A_ACTUAL
     
-    # Meta 3A: CERO (0-9 años)
-    # Num: REM A03, Sección D.7. "Pauta CERO" -> Fila "TOTAL" -> Suma Col 5 a 24 (0 a 9 años)
-    SHEET_3A = "A03"
-    COLS_IDX_3A = range(5, 25) # 5 to 24 inclusive (<1 to 9 years, M+F)
-    
-    # Meta 3B: Libre de Caries (6 años)
-    # Num: REM A09, Sección C. S48 + T48
-    SHEET_3B = "A09"
-    CELLS_3B = ["S48", "T48"]
-    
     # Buscar archivo PIV más reciente
-    piv_dir = normalize_path("DATOS/PIV")
-    piv_files = [f for f in os.listdir(piv_dir) if f.startswith("PIV_") and f.endswith(".parquet")]
-    if not piv_files:
-        print(f"ERROR: No se encontró ningún archivo PIV válido en: {piv_dir}")
+    piv_file = context['piv_file']
+    if piv_file is None:
+        log.error(f"No se encontró ningún archivo PIV válido en: {normalize_path('DATOS/PIV')}")
         return
-    piv_files.sort(reverse=True)
-    piv_file = os.path.join(piv_dir, piv_files[0])
-    print(f"Usando archivo PIV: {piv_file}")
+    log.info(f"Usando archivo PIV: {piv_file}")
 
-    # Validar encabezados del parquet
-    import pyarrow.parquet as pq
+    # Población PIV agregada por centro, edad y sexo (histograma precalculado por archivo PIV)
     try:
-        table = pq.read_table(piv_file)
-        expected_cols = {'COD_CENTRO', 'EDAD_EN_FECHA_CORTE', 'ACEPTADO_RECHAZADO', 'GENERO', 'GENERO_NORMALIZADO'}
-        parquet_cols = set(table.schema.names)
-        if not expected_cols.issubset(parquet_cols):
-            print(f"ERROR: El archivo PIV no es compatible por encabezados. Esperado: {expected_cols}, encontrado: {parquet_cols}")
-            return
-        piv_data = table.to_pylist()
+        piv_hist = context_piv_histogram(context)
     except Exception as e:
-        print(f"ERROR al leer el archivo PIV: {e}")
+        log.error(f"Error al leer el archivo PIV: {e}")
         return
 
-    mapping_a = scan_rem_files(DATA_DIR_A)
-    print(f"Archivos REM A para meta 3: {[f['filename'] for f in mapping_a]}")
+    # 2. Denominadores (PIV): 0-9 años para 3A, 6 años para 3B
+    denominadores = denominadores_piv(piv_hist)
+    den_3a = denominadores['Meta 3A']
+    den_3b = denominadores['Meta 3B']
+
+    # 3. Numeradores (REM A03 / A09)
+    num_3a = {}
+    num_3b = {}
+
+    mapping_a = context_rem_files(context, DATA_DIR_A)
+    log.debug(f"Archivos REM A para meta 3: {[f['filename'] for f in mapping_a]}")
+
+    mapping_a = seleccionar_archivos(mapping_a)
+    aportes = file_contributions(META_ID, mapping_a, REM_REQUESTS, aportes_archivos, context)
 
     for entry in mapping_a:
         code = entry['code']
@@ -61,87 +130,14 @@ def calcular_meta_3():
         if code[-1].isalpha() and code[:-1].isdigit():
             real_code = code[:-1]
         file_path = entry['path']
-        year = entry['year']
-        print(f"Procesando REM A: {file_path} (Centro: {real_code})")
-        if year != 2026: continue
+        log.debug("Procesando REM A: %s (Centro: %s)", file_path, real_code)
         if real_code not in num_3a:
             num_3a[real_code] = 0
             num_3b[real_code] = 0
-        if not os.path.exists(file_path):
-            print(f"Archivo no existe: {file_path}")
+        if file_path not in aportes:
             continue
-        try:
-            wb = openpyxl.load_workbook(file_path, data_only=True, read_only=True)
-            # Meta 3A (A03)
-            if SHEET_3A in wb.sheetnames:
-                ws = wb[SHEET_3A]
-                target_row = None
-                found_section = False
-                for i, row in enumerate(ws.iter_rows(min_row=1, max_row=300, values_only=True), 1):
-                    content = " ".join([str(c) for c in row[:5] if c])
-                    if "PAUTA CERO" in content:
-                        found_section = True
-                        continue
-                    if found_section and "TOTAL" in content:
-                        target_row = row
-                        break
-                if target_row:
-                    val_3a = 0
-                    for idx in COLS_IDX_3A:
-                        if idx < len(target_row):
-                            v = target_row[idx]
-                            print(f"Meta 3A columna {idx}: {v}")
-                            if v and isinstance(v, (int, float)):
-                                val_3a += v
-                    num_3a[real_code] += val_3a
-                else:
-                    print(f"No se encontró fila TOTAL en sección PAUTA CERO en {file_path}")
-            else:
-                print(f"Hoja {SHEET_3A} no encontrada en {file_path}")
-            # Meta 3B (A09)
-            if SHEET_3B in wb.sheetnames:
-                ws = wb[SHEET_3B]
-                val_3b = 0
-                for cell in CELLS_3B:
-                    v = ws[cell].value
-                    print(f"Meta 3B celda {cell}: {v}")
-                    if v and isinstance(v, (int, float)):
-                        val_3b += v
-                num_3b[real_code] += val_3b
-            else:
-                print(f"Hoja {SHEET_3B} no encontrada en {file_path}")
-            wb.close()
-        except Exception as e:
-            print(f"Error procesando {file_path}: {e}")
-                     
-                     if found_section and "TOTAL" in content:
-                         target_row = row
-                         break
-                     
-                     # Safety break/Reset if we go too far (e.g. next section)
-                     # Assuming TOTAL is close (within 10 rows)
-                 
-                 if target_row:
-                     val_3a = 0
-                     for idx in COLS_IDX_3A:
-                         if idx < len(target_row):
-                             v = target_row[idx]
-                             if v and isinstance(v, (int, float)):
-                                 val_3a += v
-                     num_3a[real_code] += val_3a
-                     
-             # Meta 3B (A09)
-             if SHEET_3B in wb.sheetnames:
-                 ws = wb[SHEET_3B]
-                 val_3b = 0
-                 for cell in CELLS_3B:
-                     v = ws[cell].value
-                     if v and isinstance(v, (int, float)):
-                         val_3b += v
-                 num_3b[real_code] += val_3b
-                 
-             wb.close()
-        except: pass
+        num_3a[real_code] += aportes[file_path]['num_3a']
+        num_3b[real_code] += aportes[file_path]['num_3b']
 
     # Reporte
     all_centers = set(den_3a.keys()) | set(num_3a.keys())
@@ -167,16 +163,8 @@ def calcular_meta_3():
             'Numerador': n3b, 'Denominador': d3b, 'Cumplimiento': c3b,
             'Meta_Fijada': 21.0, 'Meta_Nacional': 21.0
         })
-        
-    output_path = normalize_path(r"DATOS\reporte_meta_3_preliminar.csv")
-    try:
-        with open(output_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=['Centro', 'Meta_ID', 'Indicador', 'Numerador', 'Denominador', 'Cumplimiento', 'Meta_Fijada', 'Meta_Nacional'])
-            writer.writeheader()
-            for r in reporte:
-                writer.writerow(r)
-        print(f"Reporte guardado en {output_path}")
-    except: pass
+
+    return results_table(reporte)
 
 if __name__ == "__main__":
-    calcular_meta_3()
+    export_csv(calcular_meta_3(), META_ID)
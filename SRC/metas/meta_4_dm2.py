@@ -1,30 +1,60 @@
 import sys
 import os
-import csv
-import openpyxl
-import pyarrow.parquet as pq
 
 # Add project root to path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.dirname(current_dir))
 sys.path.append(os.path.join(project_root, 'SRC'))
 
-from modules.dataloaders import scan_rem_files, load_piv_data
+from modules.context import new_run_context, context_rem_files, context_piv_histogram
+from modules.piv import count_by_center
+from modules.extraction import merge_requests, extract_rem
+from modules.labels import label_rows
+from modules.ranges import stack_rows, sum_by_file, as_count
 from modules.utils import normalize_path
-from config import DIR_SERIE_P_ACTUAL, PIV_FILE
+from modules.results import results_table, export_csv
+from modules.logs import get_logger
+from config import DIR_SERIE_P_ACTUAL
 
-def calcular_meta_4():
-    print("=== Calculando Meta 4: Diabetes Mellitus Tipo 2 (DM2) ===")
+log = get_logger("meta_4")
+
+META_ID = "meta_4"
+
+SHEET = "P4"
+MAX_ROW = 100
+
+# Etiquetas (columnas A-E) que ubican las filas de la meta en P4
+LABELS_4A_NUM = ["HbA1C<7%", "HbA1C<8%"]
+LABEL_4B_NUM = "evaluación vigente del pie"
+LABEL_4B_DEN = "Diabetes Mellitus tipo 2"
+FILAS_4B_NUM = 4 # Riesgo bajo, moderado, alto y máximo
+FILAS_4B_DEN = range(10, 26) # Sección A
+
+# Prevalencia estimada de DM2 en personas de 15 años y más (denominador 4A)
+PREVALENCIA_DM2 = 0.123
+
+# Filas que la etapa de extracción debe leer para esta meta (búsqueda por etiquetas)
+REM_REQUESTS = [
+    {'sheet': SHEET, 'max_row': MAX_ROW, 'labels': LABELS_4A_NUM + [LABEL_4B_NUM, LABEL_4B_DEN]},
+]
+
+def denominadores_piv(piv_hist):
+    """Denominador PIV estimado de 4A por centro: población de 15 años y más por la prevalencia DM2 (4B sale del REM)"""
+    poblacion_15_mas = count_by_center(piv_hist, min_age=15)
+    return {'Meta 4A': {k: round(v * PREVALENCIA_DM2) for k, v in poblacion_15_mas.items()}}
+
+def calcular_meta_4(context=None):
+    log.info("=== Calculando Meta 4: Diabetes Mellitus Tipo 2 (DM2) ===")
+    if context is None:
+        context = new_run_context()
     
     # Configuración
     DATA_DIR = DIR_SERIE_P_ACTUAL
     
     # 4A: Cobertura Efectiva
     # Num: REM P04, Sección B. C36 + C37 (Compensados)
-    # Den: Personas 15+ con DM2 Estimadas (Prev 12.3%)
-    PREVALENCIA_DM2 = 0.123 
+    # Den: Personas 15+ con DM2 Estimadas (PREVALENCIA_DM2)
     
-    SHEET = "P4"
     CELLS_4A_NUM = ["C36", "C37"]
     
     # 4B: Pie Diabético
@@ -34,52 +64,34 @@ def calcular_meta_4():
     CELLS_4B_DEN = ["C17"]
     
     # Buscar archivo PIV más reciente
-    piv_dir = normalize_path("DATOS/PIV")
-    piv_files = [f for f in os.listdir(piv_dir) if f.startswith("PIV_") and f.endswith(".parquet")]
-    if not piv_files:
-        print(f"ERROR: No se encontró ningún archivo PIV válido en: {piv_dir}")
+    piv_file = context['piv_file']
+    if piv_file is None:
+        log.error(f"No se encontró ningún archivo PIV válido en: {normalize_path('DATOS/PIV')}")
         return
-    piv_files.sort(reverse=True)
-    piv_file = os.path.join(piv_dir, piv_files[0])
-    print(f"Usando archivo PIV: {piv_file}")
+    log.info(f"Usando archivo PIV: {piv_file}")
 
-    # Validar encabezados del parquet
-    import pyarrow.parquet as pq
+    # Población PIV agregada por centro, edad y sexo (histograma precalculado por archivo PIV)
     try:
-        table = pq.read_table(piv_file)
-        expected_cols = {'COD_CENTRO', 'EDAD_EN_FECHA_CORTE', 'ACEPTADO_RECHAZADO', 'GENERO', 'GENERO_NORMALIZADO'}
-        parquet_cols = set(table.schema.names)
-        if not expected_cols.issubset(parquet_cols):
-            print(f"ERROR: El archivo PIV no es compatible por encabezados. Esperado: {expected_cols}, encontrado: {parquet_cols}")
-            return
-        piv_data = table.to_pylist()
+        piv_hist = context_piv_histogram(context)
     except Exception as e:
-        print(f"ERROR al leer el archivo PIV: {e}")
+        log.error(f"Error al leer el archivo PIV: {e}")
         return
 
-    mapping = scan_rem_files(DATA_DIR)
+    mapping = context_rem_files(context, DATA_DIR)
 
     # 1. Denominadores 4A (Estimados)
-    poblacion_15_mas = {}
-    
-    for row in piv_data:
-        centro = row.get('COD_CENTRO', '')
-        edad = row.get('EDAD_EN_FECHA_CORTE')
-        if edad is None: edad = -1
-        estado = row.get('ACEPTADO_RECHAZADO', '')
-        
-        if estado == 'ACEPTADO' and edad >= 15:
-            if centro not in poblacion_15_mas:
-                 poblacion_15_mas[centro] = 0
-            poblacion_15_mas[centro] += 1
-            
-    denominadores_4a = {k: round(v * PREVALENCIA_DM2) for k, v in poblacion_15_mas.items()}
+    denominadores_4a = denominadores_piv(piv_hist)['Meta 4A']
     
     # 2. Numeradores y Denominadores REM
     numeradores_4a = {}
     numeradores_4b = {}
     denominadores_4b = {}
+    filas_4a = {}
+    filas_4b = {}
+    codigos = {}
     
+    rem = extract_rem(mapping, merge_requests(REM_REQUESTS), context['rem'], context['quarantine'])
+
     for entry in mapping:
         raw_code = entry['code']
         real_code = raw_code
@@ -93,65 +105,41 @@ def calcular_meta_4():
             numeradores_4b[real_code] = 0
             denominadores_4b[real_code] = 0
             
-        if not os.path.exists(file_path): continue
+        if file_path not in rem: continue
         
-        try:
-            wb = openpyxl.load_workbook(file_path, data_only=True, read_only=True)
-            if SHEET in wb.sheetnames:
-                sheet = wb[SHEET]
-                
-                # 4A Num (Compensados)
-                # Search for rows containing "HbA1C"
-                # Logic: C36 + C37 in user request -> Corresponds to <7% and <8%
-                # Dump showed them at Rows 30 and 31.
-                
-                rows_4a = []
-                for row in sheet.iter_rows(min_row=1, max_row=100, values_only=True):
-                    row_str = " ".join([str(c) for c in row[:5] if c])
-                    if "HbA1C<7%" in row_str or "HbA1C<8%" in row_str:
-                        # Value is usually in Column C (Index 2)
-                        # Check if it has a value
-                        if len(row) > 2 and isinstance(row[2], (int, float)):
-                            numeradores_4a[real_code] += row[2]
-
-                # 4B Num (Pie Vigente)
-                # C61+C62+C63+C64 in user request.
-                # Need to find "evaluación vigente del pie"
-                # Dump Row 61: "Con evaluación vigente del pie..." -> Riesgo bajo
-                # Row 62: Riesgo moderado
-                # Row 63: Riesgo alto
-                # Row 64: Riesgo máximo
-                # So we sum the 4 rows starting from "evaluación vigente del pie"
-                
-                found_pie = False
-                pie_rows_count = 0
-                for row in sheet.iter_rows(min_row=1, max_row=100, values_only=True):
-                    row_str = " ".join([str(c) for c in row[:5] if c])
-                    if "evaluación vigente del pie" in row_str:
-                         found_pie = True
-                    
-                    if found_pie and pie_rows_count < 4:
-                         if len(row) > 2 and isinstance(row[2], (int, float)):
-                             numeradores_4b[real_code] += row[2]
-                         pie_rows_count += 1
-                         
-                # 4B Den (Bajo Control)
-                # C17 from user.
-                # Dump Row 17: "Diabetes Mellitus tipo 2" in Section A (Row 17)
-                # Value at Col C (Index 2): 1300.
-                # Dynamic search: "Diabetes Mellitus tipo 2" in Section A.
-                # Section A starts around Row 8.
-                for row in sheet.iter_rows(min_row=10, max_row=25, values_only=True): # Narrow range for Sec A
-                    row_str = " ".join([str(c) for c in row[:5] if c])
-                    if "Diabetes Mellitus tipo 2" in row_str:
-                         if len(row) > 2 and isinstance(row[2], (int, float)):
-                             denominadores_4b[real_code] += row[2]
-                             break # Only one row in Section A
+        if SHEET in rem[file_path]:
+            hoja = rem[file_path][SHEET]
+            rows = hoja['rows']
             
-            wb.close()
-        except:
-            pass
+            # 4A Num (Compensados)
+            # Filas "HbA1C<7%" y "HbA1C<8%" (C36 + C37 en la solicitud; filas 30 y 31 en el dump)
+            # Value is usually in Column C (Index 2)
+            filas_4a[file_path] = sorted(set().union(*[label_rows(hoja, label, max_row=MAX_ROW) for label in LABELS_4A_NUM]))
+            codigos[file_path] = real_code
+
+            # 4B Num (Pie Vigente)
+            # C61+C62+C63+C64 in user request.
+            # Se suman las 4 filas desde "evaluación vigente del pie" (riesgo bajo, moderado, alto y máximo)
+            filas_pie = label_rows(hoja, LABEL_4B_NUM, max_row=MAX_ROW)
+            if filas_pie:
+                filas_4b[file_path] = range(filas_pie[0], min(filas_pie[0] + FILAS_4B_NUM, MAX_ROW + 1))
+                     
+            # 4B Den (Bajo Control)
+            # C17 from user.
+            # "Diabetes Mellitus tipo 2" en la Sección A (filas 10 a 25), Col C (Index 2)
+            for r in label_rows(hoja, LABEL_4B_DEN):
+                if r not in FILAS_4B_DEN:
+                    continue
+                row = rows[r - 1]
+                if len(row) > 2 and isinstance(row[2], (int, float)):
+                    denominadores_4b[real_code] += row[2]
+                    break # Only one row in Section A
 
+    # Columna C (Index 2) de las filas 4A y 4B de todos los archivos, cada una en un solo arreglo
+    for filas, numeradores in [(filas_4a, numeradores_4a), (filas_4b, numeradores_4b)]:
+        bloque, archivo = stack_rows(rem, SHEET, filas, 2, 2)
+        for file_path, total in zip(filas, sum_by_file(bloque[:, 0], archivo, len(filas))):
+            numeradores[codigos[file_path]] += as_count(total)
             
     # Reporte
     all_centers = set(denominadores_4a.keys()) | set(numeradores_4a.keys())
@@ -179,27 +167,8 @@ def calcular_meta_4():
             'Numerador': num_4b, 'Denominador': den_4b, 'Cumplimiento': cump_4b,
             'Meta_Fijada': 90.0, 'Meta_Nacional': 90.0
         })
-    
-    # Output
-    output_path = normalize_path(r"DATOS\reporte_meta_4a_preliminar.csv")
-    try:
-        with open(output_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=['Centro', 'Meta_ID', 'Indicador', 'Numerador', 'Denominador', 'Cumplimiento', 'Meta_Fijada', 'Meta_Nacional'])
-            writer.writeheader()
-            for r in reporte:
-                writer.writerow({
-                    'Centro': r['Centro'],
-                    'Meta_ID': r['Meta_ID'],
-                    'Indicador': r['Indicador'],
-                    'Numerador': r['Numerador'],
-                    'Denominador': r['Denominador'],
-                    'Cumplimiento': r['Cumplimiento'],
-                    'Meta_Fijada': r['Meta_Fijada'],
-                    'Meta_Nacional': r['Meta_Nacional']
-                })
-        print(f"Reporte guardado en {output_path}")
-    except Exception as e:
-        print(e)
+
+    return results_table(reporte)
 
 if __name__ == "__main__":
-    calcular_meta_4()
+    export_csv(calcular_meta_4(), META_ID)
@@ -1,19 +1,21 @@
 import sys
 import os
-import csv
-import openpyxl
-import pyarrow.parquet as pq
 
 # Add project root to path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.dirname(current_dir))
 sys.path.append(os.path.join(project_root, 'SRC'))
 
-from modules.dataloaders import scan_rem_files, load_piv_data
+from modules.context import new_run_context, context_rem_files, context_piv_histogram
+from modules.piv import weighted_by_center
+from modules.extraction import merge_requests, extract_rem
+from modules.labels import label_rows
+from modules.ranges import stack_rows, sum_by_file, as_count
 from modules.utils import normalize_path
+from modules.results import results_table, export_csv
+from modules.logs import get_logger
 from config import (
     DIR_SERIE_P_ACTUAL, 
-    PIV_FILE, 
     PREVALENCIA_HTA_15_24, 
     PREVALENCIA_HTA_25_44, 
     PREVALENCIA_HTA_45_64, 
@@ -21,78 +23,68 @@ from config import (
     AGNO_ACTUAL
 )
 
-def calcular_meta_5():
-    print("=== Calculando Meta 5: Hipertensión Arterial (HTA) ===")
-    
-    # Meta 5: Cobertura Efectiva HTA (P4 Sección B)
-    # Num: C34 + C35 (Personas 15-79 <140/90 + 80+ <150/90)
-    SHEET = "P4"
-    CELLS = ["C34", "C35"]
-    
-    # Buscar archivo PIV más reciente
-    piv_dir = normalize_path("DATOS/PIV")
-    piv_files = [f for f in os.listdir(piv_dir) if f.startswith("PIV_") and f.endswith(".parquet")]
-    if not piv_files:
-        print(f"ERROR: No se encontró ningún archivo PIV válido en: {piv_dir}")
-        return
-    piv_files.sort(reverse=True)
-    piv_file = os.path.join(piv_dir, piv_files[0])
-    print(f"Usando archivo PIV: {piv_file}")
+log = get_logger("meta_5")
 
-    # Validar encabezados del parquet
-    import pyarrow.parquet as pq
-    try:
-        table = pq.read_table(piv_file)
-        expected_cols = {'COD_CENTRO', 'EDAD_EN_FECHA_CORTE', 'ACEPTADO_RECHAZADO', 'GENERO', 'GENERO_NORMALIZADO'}
-        parquet_cols = set(table.schema.names)
-        if not expected_cols.issubset(parquet_cols):
-            print(f"ERROR: El archivo PIV no es compatible por encabezados. Esperado: {expected_cols}, encontrado: {parquet_cols}")
-            return
-        piv_data = table.to_pylist()
-    except Exception as e:
-        print(f"ERROR al leer el archivo PIV: {e}")
-        return
+META_ID = "meta_5"
 
-    mapping = scan_rem_files(DIR_SERIE_P_ACTUAL)
+# Meta 5: Cobertura Efectiva HTA (P4 Sección B)
+# Num: C34 + C35 (Personas 15-79 <140/90 + 80+ <150/90)
+SHEET = "P4"
+CELLS = ["C34", "C35"]
+MAX_ROW = 100
+LABELS_NUM = ["PA < 140/90", "PA < 150/90"]
 
-    # 1. Denominadores Estimados (PIV Estratificado)
+# Filas que la etapa de extracción debe leer para esta meta (búsqueda por etiquetas)
+REM_REQUESTS = [
+    {'sheet': SHEET, 'max_row': MAX_ROW, 'labels': LABELS_NUM},
+]
+
+def denominadores_piv(piv_hist):
+    """Denominador PIV estimado por centro: población por tramo de edad por la prevalencia HTA del tramo"""
     # Res. Exenta 650:
     # 15-24: 0.7%
     # 25-44: 10.6%
     # 45-64: 45.1%
     # 65+:   73.3%
+    denominadores = weighted_by_center(piv_hist, [
+        (15, 24, PREVALENCIA_HTA_15_24),
+        (25, 44, PREVALENCIA_HTA_25_44),
+        (45, 64, PREVALENCIA_HTA_45_64),
+        (65, None, PREVALENCIA_HTA_65_MAS),
+    ])
+    return {'Meta 5': {k: round(v) for k, v in denominadores.items()}}
+
+def calcular_meta_5(context=None):
+    log.info("=== Calculando Meta 5: Hipertensión Arterial (HTA) ===")
+    if context is None:
+        context = new_run_context()
     
-    denominadores = {}
-    
-    for row in piv_data:
-        centro = row.get('COD_CENTRO', '')
-        edad = row.get('EDAD_EN_FECHA_CORTE')
-        if edad is None: edad = -1
-        estado = row.get('ACEPTADO_RECHAZADO', '')
-        
-        if estado == 'ACEPTADO':
-            if centro not in denominadores:
-                denominadores[centro] = 0
-            
-            factor = 0.0
-            if 15 <= edad <= 24:
-                factor = PREVALENCIA_HTA_15_24
-            elif 25 <= edad <= 44:
-                factor = PREVALENCIA_HTA_25_44
-            elif 45 <= edad <= 64:
-                factor = PREVALENCIA_HTA_45_64
-            elif edad >= 65:
-                factor = PREVALENCIA_HTA_65_MAS
-                
-            if factor > 0:
-                denominadores[centro] += (1 * factor)
-                
-    # Redondear denominadores
-    denominadores = {k: round(v) for k, v in denominadores.items()}
+    # Buscar archivo PIV más reciente
+    piv_file = context['piv_file']
+    if piv_file is None:
+        log.error(f"No se encontró ningún archivo PIV válido en: {normalize_path('DATOS/PIV')}")
+        return
+    log.info(f"Usando archivo PIV: {piv_file}")
+
+    # Población PIV agregada por centro, edad y sexo (histograma precalculado por archivo PIV)
+    try:
+        piv_hist = context_piv_histogram(context)
+    except Exception as e:
+        log.error(f"Error al leer el archivo PIV: {e}")
+        return
+
+    mapping = context_rem_files(context, DIR_SERIE_P_ACTUAL)
+
+    # 1. Denominadores Estimados (PIV Estratificado, Res. Exenta 650)
+    denominadores = denominadores_piv(piv_hist)['Meta 5']
     
     # 2. Numeradores (REM)
     numeradores = {}
+    filas = {}
+    codigos = {}
     
+    rem = extract_rem(mapping, merge_requests(REM_REQUESTS), context['rem'], context['quarantine'])
+
     for entry in mapping:
         # Normalize to base code
         raw_code = entry['code']
@@ -106,34 +98,21 @@ def calcular_meta_5():
         if real_code not in numeradores:
             numeradores[real_code] = 0
             
-        if not os.path.exists(file_path): continue
+        if file_path not in rem: continue
         
-        try:
-            wb = openpyxl.load_workbook(file_path, data_only=True, read_only=True)
-            if SHEET in wb.sheetnames:
-                sheet = wb[SHEET]
-                # Dynamic Search for C34+C35 equivalents
-                # "PA < 140/90 mmHg" (usually Row 28/29)
-                # "PA < 150/90 mmHg"
-                
-                rows_found = 0
-                for row in sheet.iter_rows(min_row=1, max_row=100, values_only=True):
-                    row_str = " ".join([str(c) for c in row[:5] if c])
-                    
-                    if "PA < 140/90" in row_str or "PA < 150/90" in row_str:
-                        # Value usually in Col C (Index 2)
-                        if len(row) > 2 and isinstance(row[2], (int, float)):
-                            numeradores[real_code] += row[2]
-                            rows_found += 1
-                            
-                    # Optimization: break if we found both?
-                    # Careful if there are duplicates (e.g. by age group breakdown rows).
-                    # But the "Total" rows are usually unique in the "Metas de Compensación" section.
-                    # We continue scanning to be safe or break if we are sure.
-                    # Given the dump, they appear sequentially.
-                    
-            wb.close()
-        except: pass
+        if SHEET in rem[file_path]:
+            # Dynamic Search for C34+C35 equivalents
+            # "PA < 140/90 mmHg" (usually Row 28/29)
+            # "PA < 150/90 mmHg"
+            
+            hoja = rem[file_path][SHEET]
+            filas[file_path] = sorted(set().union(*[label_rows(hoja, label, max_row=MAX_ROW) for label in LABELS_NUM]))
+            codigos[file_path] = real_code
+
+    # Value usually in Col C (Index 2): columna de las filas encontradas en todos los archivos, en un solo arreglo
+    bloque, archivo = stack_rows(rem, SHEET, filas, 2, 2)
+    for file_path, total in zip(filas, sum_by_file(bloque[:, 0], archivo, len(filas))):
+        numeradores[codigos[file_path]] += as_count(total)
 
     # Reporte
     all_centers = set(denominadores.keys()) | set(numeradores.keys())
@@ -156,39 +135,19 @@ def calcular_meta_5():
             'Indicador': 'Cobertura HTA',
             'Numerador': num, 
             'Denominador': den, 
-            'Cumplimiento_Actual': cump,
+            'Cumplimiento': cump,
             'Meta_Fijada': 40.0,
             'Meta_Nacional': 45.0
         })
         
-    print("\n=== RESULTADOS GLOBALES META 5 (HTA) ===")
-    print(f"Numerador: {total_num}")
-    print(f"Denominador (Est. por Factores): {total_den}")
+    log.info("=== RESULTADOS GLOBALES META 5 (HTA) ===")
+    log.info(f"Numerador: {total_num}")
+    log.info(f"Denominador (Est. por Factores): {total_den}")
     if total_den > 0:
-        print(f"Cumplimiento: {total_num/total_den*100:.2f}%")
-    print("Meta Fijada: 40.0%")
-        
-    # Guardar reporte
-    output_path = normalize_path(r"DATOS\reporte_meta_5_preliminar.csv")
-    try:
-        with open(output_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=['Centro', 'Meta_ID', 'Indicador', 'Numerador', 'Denominador', 'Cumplimiento', 'Meta_Fijada', 'Meta_Nacional'])
-            writer.writeheader()
-            for r in reporte:
-                # Map internal dict keys to CSV headers if needed
-                writer.writerow({
-                    'Centro': r['Centro'],
-                    'Meta_ID': r['Meta_ID'],
-                    'Indicador': r['Indicador'],
-                    'Numerador': r['Numerador'],
-                    'Denominador': r['Denominador'],
-                    'Cumplimiento': r['Cumplimiento_Actual'],
-                    'Meta_Fijada': r['Meta_Fijada'],
-                    'Meta_Nacional': r['Meta_Nacional']
-                })
-        print(f"Reporte guardado en {output_path}")
-    except Exception as e:
-        print(f"Error escribiendo reporte: {e}")
+        log.info(f"Cumplimiento: {total_num/total_den*100:.2f}%")
+    log.info("Meta Fijada: 40.0%")
+
+    return results_table(reporte)
 
 if __name__ == "__main__":
-    calcular_meta_5()
+    export_csv(calcular_meta_5(), META_ID)
@@ -1,28 +1,68 @@
 import sys
 import os
-import csv
-import openpyxl
 
 # Add project root to path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.dirname(current_dir))
 sys.path.append(os.path.join(project_root, 'SRC'))
 
-from modules.dataloaders import scan_rem_files
-from modules.utils import normalize_path
+from modules.context import new_run_context, context_rem_files
+from modules.ranges import stack_ranges, as_count
+from modules.partials import file_contributions
+from modules.results import results_table, export_csv
+from modules.logs import get_logger
 from config import DIR_SERIE_A_ACTUAL, AGNO_ACTUAL
 
-def calcular_meta_6():
-    print("=== Calculando Meta 6: Lactancia Materna Exclusiva (LME) ===")
+log = get_logger("meta_6")
+
+# Configuración
+# LME: Numerador y Denominador del mismo año calendario (Ene-Dic 2026)
+
+SHEET = "A03"
+COL = 'H'
+ROW_NUM = 61 # LME al 6to mes
+ROWS_DEN = [61, 62, 63] # LME + Fórmula + Mixta
+
+# Identificador de la meta en el almacén de agregados parciales
+META_ID = "meta_6"
+
+# Columna H61:H63 (LME, fórmula y mixta) como arreglo
+RANGE = f"{COL}{ROWS_DEN[0]}:{COL}{ROWS_DEN[-1]}"
+
+# Rango que la etapa de extracción debe leer para esta meta
+REM_REQUESTS = [
+    {'sheet': SHEET, 'ranges': [RANGE]},
+]
+
+def seleccionar_archivos(mapping):
+    """Archivos REM que aportan a la meta: todo el año actual"""
+    return [entry for entry in mapping if entry['year'] == AGNO_ACTUAL]
+
+def aportes_archivos(rem, entries):
+    """Aporte de cada archivo REM (centro, mes) al numerador y denominador"""
+    aportes = {entry['path']: {'num': 0, 'den': 0} for entry in entries}
+    # H61:H63 de todos los archivos a la vez: arreglo (archivos x filas x 1)
+    bloques, archivos = stack_ranges(rem, entries, SHEET, RANGE)
     
-    # Configuración
-    # LME: Numerador y Denominador del mismo año calendario (Ene-Dic 2026)
+    # Numerador
+    nums = bloques[:, ROW_NUM - ROWS_DEN[0]].sum(axis=1)
+        
+    # Denominador
+    dens = bloques.sum(axis=(1, 2))
+    for entry, num, den_local in zip(archivos, nums, dens):
+        aportes[entry['path']] = {'num': as_count(num), 'den': as_count(den_local)}
+    return aportes
+
+def calcular_meta_6(context=None):
+    log.info("=== Calculando Meta 6: Lactancia Materna Exclusiva (LME) ===")
+    if context is None:
+        context = new_run_context()
     
-    COL = 'H'
-    ROW_NUM = 61 # LME al 6to mes
-    ROWS_DEN = [61, 62, 63] # LME + Fórmula + Mixta
+    mapping = context_rem_files(context, DIR_SERIE_A_ACTUAL)
     
-    mapping = scan_rem_files(DIR_SERIE_A_ACTUAL)
+    # Filtro Año: Todo 2026
+    mapping = seleccionar_archivos(mapping)
+    aportes = file_contributions(META_ID, mapping, REM_REQUESTS, aportes_archivos, context)
 
     numeradores = {}
     denominadores = {}
@@ -30,37 +70,15 @@ def calcular_meta_6():
     for entry in mapping:
         code = entry['code'] # Already normalized
         file_path = entry['path']
-        year = entry['year']
-        
-        # Filtro Año: Todo 2026
-        if year != AGNO_ACTUAL: continue
         
         if code not in numeradores:
             numeradores[code] = 0
             denominadores[code] = 0
             
-        if not os.path.exists(file_path): continue
+        if file_path not in aportes: continue
         
-        try:
-             wb = openpyxl.load_workbook(file_path, data_only=True, read_only=True)
-             if "A03" in wb.sheetnames:
-                 sheet = wb["A03"]
-                 
-                 # Numerador
-                 val_num = sheet[f"{COL}{ROW_NUM}"].value
-                 if val_num and isinstance(val_num, (int, float)):
-                     numeradores[code] += val_num
-                     
-                 # Denominador
-                 den_local = 0
-                 for r in ROWS_DEN:
-                     val = sheet[f"{COL}{r}"].value
-                     if val and isinstance(val, (int, float)):
-                         den_local += val
-                 denominadores[code] += den_local
-                 
-             wb.close()
-        except: pass
+        numeradores[code] += aportes[file_path]['num']
+        denominadores[code] += aportes[file_path]['den']
         
     # Reporte
     reporte = []
@@ -76,16 +94,8 @@ def calcular_meta_6():
             'Numerador': num, 'Denominador': den, 'Cumplimiento': cump,
             'Meta_Fijada': 64.0, 'Meta_Nacional': 60.0
         })
-        
-    output_path = normalize_path(r"DATOS\reporte_meta_6_preliminar.csv")
-    try:
-        with open(output_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=['Centro', 'Meta_ID', 'Indicador', 'Numerador', 'Denominador', 'Cumplimiento', 'Meta_Fijada', 'Meta_Nacional'])
-            writer.writeheader()
-            for r in reporte:
-                writer.writerow(r)
-        print(f"Reporte guardado en {output_path}")
-    except: pass
+
+    return results_table(reporte)
 
 if __name__ == "__main__":
-    calcular_meta_6()
+    export_csv(calcular_meta_6(), META_ID)
@@ -1,139 +1,117 @@
 import sys
 import os
-import csv
-import openpyxl
+import numpy as np
 
 # Add project root to path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.dirname(current_dir))
 sys.path.append(os.path.join(project_root, 'SRC'))
 
-from modules.dataloaders import scan_rem_files, load_piv_data
-from config import DIR_SERIE_P_ACTUAL, PIV_FILE, PREVALENCIA_ASMA, PREVALENCIA_EPOC
+from modules.context import new_run_context, context_rem_files, context_piv_histogram
+from modules.piv import weighted_by_center
+from modules.extraction import merge_requests, extract_rem
+from modules.labels import label_rows
+from modules.ranges import stack_rows, sum_by_file, as_count
+from config import DIR_SERIE_P_ACTUAL, PREVALENCIA_ASMA, PREVALENCIA_EPOC
 from modules.utils import normalize_path
+from modules.results import results_table, export_csv
+from modules.logs import get_logger
 
-def to_num(val):
-    if val is None: return 0
-    if isinstance(val, (int, float)): return val
-    try:
-        return float(val)
-    except:
-        return 0
+log = get_logger("meta_7")
 
-def calcular_meta_7():
-    print("=== Calculando Meta 7: Enfermedades Respiratorias (Asma/EPOC) ===")
-    
-    SHEET_TARGET = "P3"
+META_ID = "meta_7"
+
+SHEET_TARGET = "P3"
+MAX_ROW = 300
+
+# Etiquetas (columnas A-E): todas deben aparecer en la fila
+LABELS_ASMA = ["Asma", "Controlado"]
+LABELS_EPOC = ["EPOC", "Control", "Adecuado"]
+
+# Filas que la etapa de extracción debe leer para esta meta (búsqueda por etiquetas)
+REM_REQUESTS = [
+    {'sheet': SHEET_TARGET, 'max_row': MAX_ROW, 'labels': LABELS_ASMA + LABELS_EPOC},
+]
+
+def denominadores_piv(piv_hist):
+    """Denominador PIV estimado por centro: Asma 5+ y EPOC 40+ (prevalencias aditivas)"""
+    denominadores = weighted_by_center(piv_hist, [
+        (5, None, PREVALENCIA_ASMA),
+        (40, None, PREVALENCIA_EPOC),
+    ])
+    return {'Meta 7': {k: round(v) for k, v in denominadores.items()}}
+
+def calcular_meta_7(context=None):
+    log.info("=== Calculando Meta 7: Enfermedades Respiratorias (Asma/EPOC) ===")
+    if context is None:
+        context = new_run_context()
     
     # Buscar archivo PIV más reciente
-    piv_dir = normalize_path("DATOS/PIV")
-    piv_files = [f for f in os.listdir(piv_dir) if f.startswith("PIV_") and f.endswith(".parquet")]
-    if not piv_files:
-        print(f"ERROR: No se encontró ningún archivo PIV válido en: {piv_dir}")
+    piv_file = context['piv_file']
+    if piv_file is None:
+        log.error(f"No se encontró ningún archivo PIV válido en: {normalize_path('DATOS/PIV')}")
         return
-    piv_files.sort(reverse=True)
-    piv_file = os.path.join(piv_dir, piv_files[0])
-    print(f"Usando archivo PIV: {piv_file}")
+    log.info(f"Usando archivo PIV: {piv_file}")
 
-    # Validar encabezados del parquet
-    import pyarrow.parquet as pq
+    # Población PIV agregada por centro, edad y sexo (histograma precalculado por archivo PIV)
     try:
-        table = pq.read_table(piv_file)
-        expected_cols = {'COD_CENTRO', 'EDAD_EN_FECHA_CORTE', 'ACEPTADO_RECHAZADO', 'GENERO', 'GENERO_NORMALIZADO'}
-        parquet_cols = set(table.schema.names)
-        if not expected_cols.issubset(parquet_cols):
-            print(f"ERROR: El archivo PIV no es compatible por encabezados. Esperado: {expected_cols}, encontrado: {parquet_cols}")
-            return
-        piv_data = table.to_pylist()
+        piv_hist = context_piv_histogram(context)
     except Exception as e:
-        print(f"ERROR al leer el archivo PIV: {e}")
+        log.error(f"Error al leer el archivo PIV: {e}")
         return
 
-    mapping = scan_rem_files(DIR_SERIE_P_ACTUAL)
+    mapping = context_rem_files(context, DIR_SERIE_P_ACTUAL)
 
     # 1. Denominadores Estimados (PIV)
-    denominadores = {}
-    
-    for row in piv_data:
-        centro = row.get('COD_CENTRO', '')
-        edad = row.get('EDAD_EN_FECHA_CORTE')
-        if edad is None: edad = -1
-        estado = row.get('ACEPTADO_RECHAZADO', '')
-        
-        if estado == 'ACEPTADO':
-            if centro not in denominadores:
-                denominadores[centro] = 0
-            
-            # Asma 5+
-            if edad >= 5:
-                denominadores[centro] += (1 * PREVALENCIA_ASMA)
-                
-            # EPOC 40+
-            if edad >= 40:
-                denominadores[centro] += (1 * PREVALENCIA_EPOC)
-                
-    # Redondear
-    denominadores = {k: round(v) for k, v in denominadores.items()}
+    denominadores = denominadores_piv(piv_hist)['Meta 7']
     
     # 2. Numeradores (REM P3)
     numeradores = {}
     
+    rem = extract_rem(mapping, merge_requests(REM_REQUESTS), context['rem'], context['quarantine'])
+
+    # Filas ASMA/EPOC de cada archivo
+    codigos = {}
+    filas = {}
+    es_asma = []
+    es_epoc = []
     for entry in mapping:
         code = entry['code']
         file_path = entry['path']
+        codigos[file_path] = code
         
         if code not in numeradores:
             numeradores[code] = 0
             
-        if not os.path.exists(file_path): continue
+        if file_path not in rem: continue
+        
+        if SHEET_TARGET in rem[file_path]:
+            hoja = rem[file_path][SHEET_TARGET]
+            filas_asma = label_rows(hoja, *LABELS_ASMA, max_row=MAX_ROW)
+            filas_epoc = label_rows(hoja, *LABELS_EPOC, max_row=MAX_ROW)
+            rows = hoja['rows']
+            seleccion = [r for r in sorted(set(filas_asma) | set(filas_epoc)) if rows[r - 1] and len(rows[r - 1]) >= 10]
+            if not seleccion: continue
+            filas[file_path] = seleccion
+            es_asma += [r in filas_asma for r in seleccion]
+            es_epoc += [r in filas_epoc for r in seleccion]
+
+    if filas:
+        # Todas las filas ASMA/EPOC de todos los archivos en un solo arreglo (filas x columnas);
+        # los números escritos como texto en el REM P3 se leen como números
+        bloque, archivo = stack_rows(rem, SHEET_TARGET, filas, numeric_text=True)
+        es_asma = np.array(es_asma, dtype=bool)
+        es_epoc = np.array(es_epoc, dtype=bool)
+        
+        # ASMA: Total (Index 2) menos 0-4 años Hombres/Mujeres (Index 5 y 6), sin negativos por fila
+        val_asma = np.where(es_asma, np.maximum(0, bloque[:, 2] - (bloque[:, 5] + bloque[:, 6])), 0)
         
-        try:
-             wb = openpyxl.load_workbook(file_path, data_only=True, read_only=True)
-             
-             if SHEET_TARGET in wb.sheetnames:
-                 ws = wb[SHEET_TARGET]
-                 
-                 for row in ws.iter_rows(min_row=1, max_row=300, values_only=True):
-                     if not row or len(row) < 10: continue
-                     
-                     row_str = " ".join([str(c) for c in row[:5] if c])
-                     
-                     val_asma = 0
-                     val_epoc = 0
-                     
-                     # ASMA
-                     if "Asma" in row_str and "Controlado" in row_str:
-                         # Total is at Index 2
-                         total = to_num(row[2])
-                         c5 = to_num(row[5]) # 0-4 Men
-                         c6 = to_num(row[6]) # 0-4 Women
-                         val_asma = total - (c5 + c6)
-                         numeradores[code] += max(0, val_asma)
-                         
-                     # EPOC
-                     if "EPOC" in row_str and "Control" in row_str and "Adecuado" in row_str:
-                         # Sum from Index 21 onwards (40-44 years starts here? Verify based on P3 structure dump)
-                         # Dump showed headers: 15-19 (Idx 3?), 20-24...
-                         # Dump Row 10: '0 a 4 años', '5 a 9 años', ...
-                         # Let's verify start index for 40+.
-                         # 0-4: 5,6
-                         # 5-9: 7,8
-                         # 10-14: 9,10
-                         # 15-19: 11,12
-                         # 20-24: 13,14
-                         # 25-29: 15,16
-                         # 30-34: 17,18
-                         # 35-39: 19,20
-                         # 40-44: 21,22 -> CORRECT. Start summing from 21.
-                         
-                         current_sum = 0
-                         for idx in range(21, len(row)):
-                             current_sum += to_num(row[idx])
-                         val_epoc = current_sum
-                         numeradores[code] += val_epoc
-                         
-             wb.close()
-        except: pass
+        # EPOC: desde Index 21 (40-44 años) hasta el final de la fila
+        # 0-4: 5,6 / 5-9: 7,8 / 10-14: 9,10 / 15-19: 11,12 / 20-24: 13,14
+        # 25-29: 15,16 / 30-34: 17,18 / 35-39: 19,20 / 40-44: 21,22 -> se suma desde 21
+        val_epoc = np.where(es_epoc, bloque[:, 21:].sum(axis=1), 0)
+        for file_path, total in zip(filas, sum_by_file(val_asma + val_epoc, archivo, len(filas))):
+            numeradores[codigos[file_path]] += as_count(total)
             
     # Reporte
     reporte = []
@@ -156,21 +134,13 @@ def calcular_meta_7():
             'Meta_Fijada': 16.77, 'Meta_Nacional': 15.0
         })
         
-    print("\n=== RESULTADOS GLOBALES META 7 ===")
-    print(f"Numerador Total: {total_num}")
-    print(f"Denominador Total (Est): {total_den}")
+    log.info("=== RESULTADOS GLOBALES META 7 ===")
+    log.info(f"Numerador Total: {total_num}")
+    log.info(f"Denominador Total (Est): {total_den}")
     if total_den > 0:
-         print(f"Cumplimiento: {total_num/total_den*100:.2f}%")
-         
-    output_path = normalize_path(r"DATOS\reporte_meta_7_preliminar.csv")
-    try:
-        with open(output_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=['Centro', 'Meta_ID', 'Indicador', 'Numerador', 'Denominador', 'Cumplimiento', 'Meta_Fijada', 'Meta_Nacional'])
-            writer.writeheader()
-            for r in reporte:
-                writer.writerow(r)
-        print(f"Reporte guardado en {output_path}")
-    except: pass
+         log.info(f"Cumplimiento: {total_num/total_den*100:.2f}%")
+
+    return results_table(reporte)
     
 if __name__ == "__main__":
-    calcular_meta_7()
+    export_csv(calcular_meta_7(), META_ID)
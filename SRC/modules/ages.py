@@ -0,0 +1,180 @@
+import os
+from datetime import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from .cache import file_fingerprint
+from .piv import validate_piv_schema, iter_accepted_batches, female_mask, fold_counts, count_rows, HIST_PREFIX
+from .profiling import span, count
+from .logs import get_logger
+from config import PIV_BATCH_SIZE
+
+log = get_logger("ages")
+
+# Columnas del PIV que usa el cálculo de edades a una fecha de referencia
+AGE_SOURCE_COLUMNS = ['COD_CENTRO', 'FECHA_NACIMIENTO', 'FECHA_CORTE', 'ACEPTADO_RECHAZADO', 'GENERO', 'GENERO_NORMALIZADO']
+
+# Histogramas por (PIV, fecha de referencia), en memoria del proceso
+_hist_cache = {}
+
+def _days(values):
+    # Fechas o timestamps Arrow -> días desde 1970-01-01 (int32) y máscara de fechas faltantes
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    values = values.cast(pa.date32())
+    missing = pc.is_null(values).to_numpy(zero_copy_only=False)
+    return pc.fill_null(values.cast(pa.int32()), 0).to_numpy(), missing
+
+def civil_from_days(days):
+    """
+    (year, month, day) NumPy int arrays of day counts since 1970-01-01, with
+    integer arithmetic only (proleptic Gregorian calendar, H. Hinnant's
+    days_from_civil inverse): no per-element calendar conversion.
+    """
+    z = days + 719468
+    era = np.floor_divide(z, 146097)
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    year = yoe + era * 400 + (month <= 2)
+    return year, month, day
+
+def _month_index_and_day(days):
+    # Meses desde el año 0 (año * 12 + mes - 1) y día del mes de cada día: el calendario se calcula
+    # una vez por día distinto del rango presente (decenas de miles) y se reparte por índice
+    if len(days) == 0:
+        return days, days
+    first = days.min()
+    year, month, day = civil_from_days(np.arange(first, days.max() + 1, dtype=np.int64))
+    index = days - first
+    return (year * 12 + month - 1).astype(np.int32)[index], day.astype(np.int32)[index]
+
+def age_in_months(birth, reference):
+    """
+    Completed months of age at `reference` (a date, or an Arrow array with one
+    reference per person, e.g. FECHA_CORTE) of an Arrow array of birth dates or
+    timestamps, computed over the whole column with NumPy integer arithmetic.
+    A month is completed on the day of the month of the birth. Null when a date
+    is missing or the birth is after the reference. Returns an int32 Arrow array.
+    """
+    born, invalid = _days(birth)
+    born_months, born_day = _month_index_and_day(born)
+    if isinstance(reference, (pa.Array, pa.ChunkedArray)):
+        ref, ref_missing = _days(reference)
+        ref_months, ref_day = _month_index_and_day(ref)
+        invalid = invalid | ref_missing
+    else:
+        # Una sola fecha de referencia: escalares, sin arreglo por persona
+        ref_months, ref_day = reference.year * 12 + reference.month - 1, reference.day
+    months = ref_months - born_months - (ref_day < born_day)
+    return pa.array(months.astype(np.int32), mask=invalid | (months < 0))
+
+def age_in_years(birth, reference):
+    """Completed years of age at `reference` (see age_in_months). Returns an int32 Arrow array."""
+    return pc.divide(age_in_months(birth, reference), pa.scalar(12, pa.int32()))
+
+def _fingerprint(piv_file):
+    fp = file_fingerprint(piv_file)
+    return f"{fp['size']}:{fp['mtime_ns']}"
+
+def load_age_histogram(piv_file, reference_date=None, batch_size=PIV_BATCH_SIZE):
+    """
+    Aggregates the ACEPTADO population of a PIV file into counts by
+    (COD_CENTRO, EDAD_MESES, EDAD_EN_FECHA_CORTE, MUJER) with ages computed at
+    reference_date (None = each person's FECHA_CORTE). EDAD_EN_FECHA_CORTE holds
+    the age in years at that date, so piv.count_by_center and
+    piv.weighted_by_center work on it unchanged. Missing ages are -1. The PIV is
+    read batch by batch (piv.iter_accepted_batches).
+    """
+    validate_piv_schema(piv_file)
+    keys = ['COD_CENTRO', 'EDAD_MESES', 'EDAD_EN_FECHA_CORTE', 'MUJER']
+    hist = None
+    with span('piv_read'):
+        for batch in iter_accepted_batches(piv_file, AGE_SOURCE_COLUMNS, batch_size):
+            reference = batch.column('FECHA_CORTE') if reference_date is None else reference_date
+            with span('ages'):
+                months = pc.fill_null(age_in_months(batch.column('FECHA_NACIMIENTO'), reference), -1)
+            years = pc.if_else(pc.less(months, 0), -1, pc.divide(months, 12)).cast(pa.int64())
+            base = pa.table({
+                'COD_CENTRO': batch.column('COD_CENTRO'),
+                'EDAD_MESES': months,
+                'EDAD_EN_FECHA_CORTE': years,
+                'MUJER': female_mask(batch),
+            })
+            hist = fold_counts(hist, count_rows(base, keys), keys)
+    if hist is None:
+        hist = pa.table({'COD_CENTRO': pa.array([], pa.string()), 'EDAD_MESES': pa.array([], pa.int32()),
+                         'EDAD_EN_FECHA_CORTE': pa.array([], pa.int64()), 'MUJER': pa.array([], pa.bool_()),
+                         'N': pa.array([], pa.int64())})
+    return hist
+
+def age_histogram_path(piv_file, reference_date):
+    """Path of the age histogram sidecar of a PIV file at a reference date (HIST_EDAD_<date>_ prefix)."""
+    piv_dir, name = os.path.split(piv_file)
+    label = reference_date.isoformat() if reference_date is not None else "CORTE"
+    return os.path.join(piv_dir, f"{HIST_PREFIX}EDAD_{label}_{name}")
+
+def get_age_histogram(piv_file, reference_date=None):
+    """
+    Returns the age histogram of a PIV file at a reference date (see
+    load_age_histogram), cached per (PIV fingerprint, reference date): in
+    memory for the process and as a small Parquet next to the PIV, so the PIV
+    is only read again when it changes.
+    """
+    if isinstance(reference_date, datetime):
+        reference_date = reference_date.date()
+    key = _fingerprint(piv_file)
+    cache_key = (piv_file, key, reference_date)
+    if cache_key in _hist_cache:
+        count('age_histogram_hits')
+        return _hist_cache[cache_key]
+
+    sidecar = age_histogram_path(piv_file, reference_date)
+    hist = None
+    if os.path.exists(sidecar):
+        try:
+            metadata = pq.read_schema(sidecar).metadata or {}
+            if metadata.get(b'piv_fingerprint') == key.encode():
+                count('age_histogram_hits')
+                hist = pq.read_table(sidecar)
+        except (OSError, pa.ArrowInvalid) as e:
+            log.warning(f"Histograma de edades ilegible, se recalcula: {e}")
+
+    if hist is None:
+        count('age_histogram_misses')
+        hist = load_age_histogram(piv_file, reference_date)
+        hist = hist.replace_schema_metadata({
+            b'piv_fingerprint': key.encode(),
+            b'piv_file': os.path.basename(piv_file).encode(),
+            b'reference_date': (reference_date.isoformat() if reference_date is not None else '').encode(),
+        })
+        try:
+            tmp_path = sidecar + ".tmp"
+            pq.write_table(hist, tmp_path)
+            os.replace(tmp_path, sidecar)
+            log.info(f"Histograma de edades generado: {sidecar}")
+        except OSError as e:
+            log.warning(f"No se pudo guardar el histograma de edades ({e}); se usa en memoria.")
+    _hist_cache[cache_key] = hist
+    return hist
+
+def count_by_center_months(hist, min_months=None, max_months=None, female_only=False):
+    """
+    Population by center with age in months within [min_months, max_months]
+    (inclusive, None = open), e.g. 12-23 months. Only centers with at least one
+    matching person are returned. Returns {cod_centro: count}.
+    """
+    edad = hist['EDAD_MESES']
+    mask = pc.greater_equal(edad, 0)
+    if min_months is not None:
+        mask = pc.and_(mask, pc.greater_equal(edad, min_months))
+    if max_months is not None:
+        mask = pc.and_(mask, pc.less_equal(edad, max_months))
+    if female_only:
+        mask = pc.and_(mask, hist['MUJER'])
+    sums = hist.filter(mask).group_by('COD_CENTRO').aggregate([('N', 'sum')])
+    return dict(zip(sums['COD_CENTRO'].to_pylist(), sums['N_sum'].to_pylist()))
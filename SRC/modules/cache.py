@@ -0,0 +1,152 @@
+import os
+import json
+import sqlite3
+import hashlib
+from .labels import build_label_index
+
+def file_fingerprint(file_path, hash_content=False):
+    """
+    Returns the fingerprint used to validate cached extractions:
+    {'size': ..., 'mtime_ns': ..., 'sha1': ... or None}.
+    The content hash is only computed when hash_content is True.
+    """
+    st = os.stat(file_path)
+    sha1 = None
+    if hash_content:
+        sha1 = content_hash(file_path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': sha1}
+
+def entry_fingerprint(entry, hash_content=False):
+    """
+    Fingerprint of a scanned REM file. Uses the size and mtime recorded by the
+    directory scan when present, so the file is not stat'ed again.
+    """
+    if 'size' not in entry or 'mtime_ns' not in entry:
+        return file_fingerprint(entry['path'], hash_content)
+    sha1 = content_hash(entry['path']) if hash_content else None
+    return {'size': entry['size'], 'mtime_ns': entry['mtime_ns'], 'sha1': sha1}
+
+def content_hash(file_path):
+    """SHA-1 of the file contents, read in 1 MB blocks."""
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def open_cache(cache_path):
+    """
+    Opens (creating it if needed) the SQLite extraction cache.
+    One row per (file, sheet) with the extracted cells, leading rows and label
+    index as JSON.
+    """
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    conn = sqlite3.connect(cache_path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS extraccion (
+            path TEXT NOT NULL,
+            sheet TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha1 TEXT,
+            present INTEGER NOT NULL,
+            cells TEXT NOT NULL,
+            max_row INTEGER NOT NULL,
+            rows TEXT NOT NULL,
+            labels TEXT NOT NULL DEFAULT '{}',
+            PRIMARY KEY (path, sheet)
+        )
+    """)
+    # Cachés creadas antes del índice de etiquetas
+    columns = [info[1] for info in conn.execute("PRAGMA table_info(extraccion)")]
+    if 'labels' not in columns:
+        conn.execute("ALTER TABLE extraccion ADD COLUMN labels TEXT NOT NULL DEFAULT '{}'")
+    return conn
+
+def cache_lookup(conn, file_path, fingerprint, plan, hash_content=False):
+    """
+    Returns the cached extraction of a file ({sheet: {'cells', 'rows'}}) when the
+    stored fingerprint matches and every sheet request of the plan is covered
+    (same or more cells, same or more leading rows, indexed labels). Returns None on a miss.
+    With hash_content, a file whose size/mtime changed but whose content hash
+    matches is still a hit (e.g. the same month downloaded again).
+    """
+    stored = {
+        sheet: (size, mtime_ns, sha1, present, cells, max_row, rows, labels)
+        for sheet, size, mtime_ns, sha1, present, cells, max_row, rows, labels in conn.execute(
+            "SELECT sheet, size, mtime_ns, sha1, present, cells, max_row, rows, labels FROM extraccion WHERE path = ?",
+            (file_path,)
+        )
+    }
+    if not stored or any(sheet not in stored for sheet in plan):
+        return None
+
+    size, mtime_ns, sha1 = next(iter(stored.values()))[:3]
+    if (size, mtime_ns) != (fingerprint['size'], fingerprint['mtime_ns']):
+        if not (hash_content and sha1 and size == fingerprint['size'] and sha1 == (fingerprint['sha1'] or content_hash(file_path))):
+            return None
+        conn.execute("UPDATE extraccion SET mtime_ns = ? WHERE path = ?", (fingerprint['mtime_ns'], file_path))
+
+    result = {}
+    for sheet, sheet_plan in plan.items():
+        _, _, _, present, cells, max_row, rows, labels = stored[sheet]
+        if not present:
+            continue
+        cells = json.loads(cells)
+        labels = json.loads(labels)
+        if not sheet_plan['cells'] <= cells.keys() or sheet_plan['max_row'] > max_row:
+            return None
+        if not sheet_plan.get('labels', set()) <= labels.keys():
+            return None
+        result[sheet] = {'cells': cells, 'rows': [tuple(r) for r in json.loads(rows)], 'labels': labels}
+    return result
+
+def cache_store(conn, file_path, fingerprint, plan, result, hash_content=False):
+    """
+    Stores the extraction of a file. Sheets requested by the plan but missing
+    from the workbook are recorded as absent so they are not looked up again.
+    Entries of the same file version are merged, so a narrower plan (a meta run
+    on its own) never shrinks what a previous full run cached.
+    """
+    sha1 = fingerprint['sha1']
+    if hash_content and sha1 is None:
+        sha1 = content_hash(file_path)
+    # Entries of an older version of the file are dropped
+    conn.execute(
+        "DELETE FROM extraccion WHERE path = ? AND (size != ? OR mtime_ns != ?)",
+        (file_path, fingerprint['size'], fingerprint['mtime_ns'])
+    )
+    for sheet, sheet_plan in plan.items():
+        data = result.get(sheet)
+        cells = data['cells'] if data else {}
+        rows = data['rows'] if data else []
+        labels = data['labels'] if data else {}
+        max_row = sheet_plan['max_row']
+        previous = conn.execute(
+            "SELECT cells, max_row, rows, labels FROM extraccion WHERE path = ? AND sheet = ? AND present = 1",
+            (file_path, sheet)
+        ).fetchone()
+        if data is not None and previous is not None:
+            cells = dict(json.loads(previous[0]), **cells)
+            patterns = set(json.loads(previous[3])) | set(labels)
+            if previous[1] > max_row:
+                max_row, rows = previous[1], json.loads(previous[2])
+            # El índice se rehace sobre las filas que quedan guardadas
+            labels = build_label_index(rows, patterns)
+        conn.execute(
+            "INSERT OR REPLACE INTO extraccion VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                file_path, sheet, fingerprint['size'], fingerprint['mtime_ns'], sha1,
+                1 if data is not None else 0,
+                json.dumps(cells, default=str),
+                max_row,
+                json.dumps(rows, default=str),
+                json.dumps(labels),
+            )
+        )
+
+def cache_purge(conn, paths):
+    """Drops the cached extractions of files that no longer exist."""
+    conn.executemany("DELETE FROM extraccion WHERE path = ?", [(path,) for path in paths])
@@ -0,0 +1,53 @@
+from .utils import load_center_names
+from .logs import get_logger
+from .dataloaders import scan_rem_files
+from .piv import find_latest_piv, get_piv_histogram
+from .ages import get_age_histogram
+from .shared import read_shared_table
+from config import AGE_REFERENCE_DATE
+
+def new_run_context(piv_file=None, incremental=False):
+    """
+    Creates the context shared by every meta of a run, so that the audit logger,
+    the center names, the REM file listings, the REM extraction and the PIV
+    histogram are loaded once per run instead of once per meta. `incremental`
+    lets the metas reuse the per-file partial aggregates of unchanged months.
+    Returns a dict:
+    {'logger', 'center_names', 'piv_file', 'piv_hist', 'piv_hist_file', 'incremental', 'manifest': {root_dir: [...]},
+     'manifest_diff': {'added', 'changed', 'removed'} or None, 'rem': {path: ...}, 'quarantine': [...]}
+    """
+    return {
+        'logger': get_logger('scan'),
+        'center_names': load_center_names(),
+        'piv_file': piv_file or find_latest_piv(),
+        'piv_hist': None,
+        # Histograma publicado para los procesos de trabajo (modules.shared), se lee con memory-map
+        'piv_hist_file': None,
+        'incremental': incremental,
+        'manifest': {},
+        'manifest_diff': None,
+        'rem': {},
+        'quarantine': [],
+    }
+
+def context_rem_files(context, root_dir):
+    """Returns scan_rem_files(root_dir), scanning each directory only once per run."""
+    if root_dir not in context['manifest']:
+        context['manifest'][root_dir] = scan_rem_files(root_dir, context['logger'], context['center_names'])
+    return context['manifest'][root_dir]
+
+def context_piv_histogram(context):
+    """
+    Returns the PIV population histogram of the run, loading it on first use
+    (in a worker process, memory-mapped from the file published by the main one).
+    With AGE_REFERENCE_DATE set, ages are computed at that date (ages.get_age_histogram)
+    instead of the precomputed EDAD_EN_FECHA_CORTE.
+    """
+    if context['piv_hist'] is None:
+        if context.get('piv_hist_file'):
+            context['piv_hist'] = read_shared_table(context['piv_hist_file'])
+        elif AGE_REFERENCE_DATE is not None:
+            context['piv_hist'] = get_age_histogram(context['piv_file'], AGE_REFERENCE_DATE)
+        else:
+            context['piv_hist'] = get_piv_histogram(context['piv_file'])
+    return context['piv_hist']
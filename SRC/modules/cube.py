@@ -0,0 +1,260 @@
+import os
+import hashlib
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from openpyxl.utils.cell import coordinate_to_tuple
+from .dataloaders import open_rem_workbook
+from .labels import row_label, index_labels
+from .cache import entry_fingerprint
+from .profiling import span, count
+
+# Columnas de cada archivo del cubo (year y serie van en la partición: year=2026/serie=A)
+CUBE_SCHEMA = pa.schema([
+    ('path', pa.string()),
+    ('center', pa.string()),
+    ('month', pa.int8()),
+    ('sheet', pa.string()),
+    ('row', pa.int32()),
+    ('col', pa.int16()),
+    ('value', pa.float64()),
+    ('kind', pa.int8()),
+    ('text', pa.string()),
+    ('label', pa.string()),
+])
+# Versión del formato de los archivos del cubo: los de otra versión se vuelven a generar
+CUBE_VERSION = b'3'
+# kind: tipo Python de la celda (números en value, texto, lógicos y fechas en text)
+KIND_NONE, KIND_INT, KIND_FLOAT, KIND_TEXT, KIND_BOOL, KIND_DATETIME = range(6)
+CUBE_PARTITIONING = ds.partitioning(pa.schema([('year', pa.int16()), ('serie', pa.string())]), flavor='hive')
+
+def encode_value(value):
+    """
+    (kind, value, text) of a cell value: numbers go to the float64 value column
+    and everything else to text, with the Python type kept in kind so
+    decode_value returns exactly what the workbook reader returned.
+    """
+    if value is None:
+        return KIND_NONE, None, None
+    if isinstance(value, bool):
+        return KIND_BOOL, None, str(value)
+    if isinstance(value, int):
+        return KIND_INT, float(value), None
+    if isinstance(value, float):
+        return KIND_FLOAT, value, None
+    if isinstance(value, datetime):
+        return KIND_DATETIME, None, value.isoformat()
+    return KIND_TEXT, None, str(value)
+
+def decode_value(kind, value, text):
+    """Inverse of encode_value."""
+    if kind == KIND_INT:
+        return int(value)
+    if kind == KIND_FLOAT:
+        return value
+    if kind == KIND_TEXT:
+        return text
+    if kind == KIND_BOOL:
+        return text == 'True'
+    if kind == KIND_DATETIME:
+        return datetime.fromisoformat(text)
+    return None
+
+def workbook_records(file_path, plan=None, engine="openpyxl"):
+    """
+    Reads every sheet of a REM workbook once and returns its long-format records
+    as a pyarrow Table (sheet, row, col, value, kind, text, label):
+    - one record per non-empty cell (see encode_value), with the label
+      (columns A-E) of its row;
+    - one record (col 0, no value) per labelled row without cells;
+    - one marker per sheet at row 0: col = row width, value = number of rows.
+    `plan` is ignored (same signature as extract_workbook, for extract_parallel).
+    """
+    sheets, rows_, cols, values, kinds, texts, labels = [], [], [], [], [], [], []
+    count('files_opened')
+    count('bytes_read', os.path.getsize(file_path))
+    with span('workbook'):
+        wb = open_rem_workbook(file_path, engine)
+        try:
+            for sheet_name in wb.sheetnames:
+                width = 0
+                n_rows = 0
+                with span('sheet'):
+                    for n_rows, row in enumerate(wb[sheet_name].iter_rows(values_only=True), start=1):
+                        width = max(width, len(row))
+                        label = row_label(row) or None
+                        stored = False
+                        for col, value in enumerate(row, start=1):
+                            if value is not None:
+                                kind, number, text = encode_value(value)
+                                sheets.append(sheet_name)
+                                rows_.append(n_rows)
+                                cols.append(col)
+                                values.append(number)
+                                kinds.append(kind)
+                                texts.append(text)
+                                labels.append(label)
+                                stored = True
+                        if label and not stored:
+                            sheets.append(sheet_name)
+                            rows_.append(n_rows)
+                            cols.append(0)
+                            values.append(None)
+                            kinds.append(KIND_NONE)
+                            texts.append(None)
+                            labels.append(label)
+                sheets.append(sheet_name)
+                rows_.append(0)
+                cols.append(width)
+                values.append(float(n_rows))
+                kinds.append(KIND_NONE)
+                texts.append(None)
+                labels.append(None)
+                count('sheets_parsed')
+                count('rows_iterated', n_rows)
+        finally:
+            wb.close()
+    return pa.table({
+        'sheet': pa.array(sheets, pa.string()),
+        'row': pa.array(rows_, pa.int32()),
+        'col': pa.array(cols, pa.int16()),
+        'value': pa.array(values, pa.float64()),
+        'kind': pa.array(kinds, pa.int8()),
+        'text': pa.array(texts, pa.string()),
+        'label': pa.array(labels, pa.string()),
+    })
+
+def part_path(cube_dir, entry):
+    """File of the cube that holds one REM workbook: year=Y/serie=S/<center>_<month>_<path hash>.parquet."""
+    year = entry.get('year')
+    serie = entry.get('serie')
+    path_hash = hashlib.sha1(entry['path'].encode('utf-8')).hexdigest()[:12]
+    return os.path.join(
+        cube_dir,
+        f"year={year if year is not None else '__HIVE_DEFAULT_PARTITION__'}",
+        f"serie={serie or '__HIVE_DEFAULT_PARTITION__'}",
+        f"{entry.get('code')}_{entry.get('month') or 0:02d}_{path_hash}.parquet"
+    )
+
+def _source_key(entry):
+    fp = entry_fingerprint(entry)
+    return f"{fp['size']}:{fp['mtime_ns']}".encode()
+
+def is_current(cube_dir, entry):
+    """
+    True when the cube holds the records of the current version of the file
+    (same size and mtime) written with the current cube format.
+    """
+    target = part_path(cube_dir, entry)
+    if not os.path.exists(target):
+        return False
+    try:
+        metadata = pq.read_schema(target).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return False
+    return metadata.get(b'cube_version') == CUBE_VERSION and metadata.get(b'source_fingerprint') == _source_key(entry)
+
+def write_part(cube_dir, entry, records):
+    """Writes the records of one workbook (workbook_records) to its cube file, tagged with the source fingerprint."""
+    n = records.num_rows
+    table = pa.table({
+        'path': pa.array([entry['path']] * n, pa.string()),
+        'center': pa.array([entry.get('code')] * n, pa.string()),
+        'month': pa.array([entry.get('month')] * n, pa.int8()),
+        'sheet': records['sheet'],
+        'row': records['row'],
+        'col': records['col'],
+        'value': records['value'],
+        'kind': records['kind'],
+        'text': records['text'],
+        'label': records['label'],
+    }, schema=CUBE_SCHEMA)
+    table = table.replace_schema_metadata({
+        b'source_path': entry['path'].encode('utf-8'),
+        b'source_fingerprint': _source_key(entry),
+        b'cube_version': CUBE_VERSION,
+    })
+    target = part_path(cube_dir, entry)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Prefijo '.': el dataset ignora el archivo temporal si una lectura coincide con la escritura
+    tmp_path = os.path.join(os.path.dirname(target), "." + os.path.basename(target) + ".tmp")
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, target)
+
+def purge_parts(cube_dir, entries):
+    """Deletes the cube files of REM workbooks that were removed."""
+    for entry in entries:
+        target = part_path(cube_dir, entry)
+        if os.path.exists(target):
+            os.remove(target)
+
+def scan_cube(cube_dir, filter=None, columns=None):
+    """
+    Reads the cube as one Arrow dataset (partitions year and serie included as
+    columns), applying an Arrow filter expression, e.g.
+    (pc.field('year') == 2026) & (pc.field('serie') == 'A') & (pc.field('sheet') == 'A03').
+    Returns a pyarrow Table.
+    """
+    if not os.path.exists(cube_dir):
+        return CUBE_SCHEMA.empty_table()
+    dataset = ds.dataset(cube_dir, format='parquet', partitioning=CUBE_PARTITIONING)
+    return dataset.to_table(filter=filter, columns=columns)
+
+def load_from_cube(cube_dir, entries, plan):
+    """
+    Resolves a sheet plan (see extraction.merge_requests) for the given REM files
+    from the cube, with a single filtered scan, in the same shape as
+    extract_workbook: {path: {sheet: {'cells', 'rows', 'labels'}}}.
+    Cell values come back with the type the workbook reader returned (see encode_value).
+    """
+    if not entries or not plan:
+        return {entry['path']: {} for entry in entries}
+
+    limits = {}
+    for sheet, sheet_plan in plan.items():
+        cell_rows = [coordinate_to_tuple(coord)[0] for coord in sheet_plan['cells']]
+        limits[sheet] = max([sheet_plan['max_row']] + cell_rows)
+    sheet_filter = None
+    for sheet, limit in limits.items():
+        expr = (pc.field('sheet') == sheet) & (pc.field('row') <= limit)
+        sheet_filter = expr if sheet_filter is None else sheet_filter | expr
+    row_filter = pc.field('path').isin([entry['path'] for entry in entries]) & sheet_filter
+    if all(entry.get('year') is not None for entry in entries):
+        # Solo se recorren las particiones de los años pedidos
+        row_filter = pc.field('year').isin(sorted({entry['year'] for entry in entries})) & row_filter
+    table = scan_cube(cube_dir, row_filter, ['path', 'sheet', 'row', 'col', 'value', 'kind', 'text', 'label']).to_pydict()
+
+    # {path: {sheet: {'marker': (width, n_rows), 'values': {(row, col): value}, 'labels': {row: label}}}}
+    found = {}
+    for path, sheet, row, col, value, kind, text, label in zip(table['path'], table['sheet'], table['row'], table['col'],
+                                                               table['value'], table['kind'], table['text'], table['label']):
+        data = found.setdefault(path, {}).setdefault(sheet, {'marker': (0, 0), 'values': {}, 'labels': {}})
+        if row == 0:
+            data['marker'] = (col, int(value))
+            continue
+        if label:
+            data['labels'][row] = label
+        if col:
+            data['values'][(row, col)] = decode_value(kind, value, text)
+
+    result = {}
+    for entry in entries:
+        sheets = found.get(entry['path'], {})
+        result[entry['path']] = {}
+        for sheet, sheet_plan in plan.items():
+            if sheet not in sheets:
+                continue
+            data = sheets[sheet]
+            width, n_rows = data['marker']
+            values = data['values']
+            cells = {coord: values.get(coordinate_to_tuple(coord)) for coord in sheet_plan['cells']}
+            rows = [
+                tuple(values.get((r, c)) for c in range(1, width + 1))
+                for r in range(1, min(sheet_plan['max_row'], n_rows) + 1)
+            ]
+            numbered = sorted((r, label) for r, label in data['labels'].items() if r <= len(rows))
+            labels = index_labels(numbered, sheet_plan.get('labels', ()))
+            result[entry['path']][sheet] = {'cells': cells, 'rows': rows, 'labels': labels}
+    return result
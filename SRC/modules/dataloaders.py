@@ -1,8 +1,42 @@
 import os
 import csv
+import posixpath
+import zipfile
+from datetime import datetime
+from xml.etree.ElementTree import iterparse
 import openpyxl
+from openpyxl.utils.cell import coordinate_to_tuple, range_boundaries
 import pyarrow.parquet as pq
 from .utils import normalize_path
+from .profiling import count
+from .logs import get_logger
+from config import PIV_BATCH_SIZE
+
+# Espacios de nombres OOXML usados por el lector directo de .xlsm
+XLSX_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+log = get_logger("dataloaders")
+
+# Columnas del PIV devueltas por load_piv_data / iter_piv_records
+PIV_RECORD_COLUMNS = ['COD_CENTRO', 'EDAD_EN_FECHA_CORTE', 'ACEPTADO_RECHAZADO', 'GENERO', 'GENERO_NORMALIZADO']
+
+# Grid of month names to int
+MONTH_MAP = {
+    'ENE': 1, 'JAN': 1, 'ENERO': 1, 'JANUARY': 1,
+    'FEB': 2, 'FEBRERO': 2, 'FEBRUARY': 2,
+    'MAR': 3, 'MARZO': 3, 'MARCH': 3,
+    'ABR': 4, 'APR': 4, 'ABRIL': 4, 'APRIL': 4,
+    'MAY': 5, 'MAYO': 5,
+    'JUN': 6, 'JUNIO': 6, 'JUNE': 6,
+    'JUL': 7, 'JULIO': 7, 'JULY': 7,
+    'AGO': 8, 'AUG': 8, 'AGOSTO': 8, 'AUGUST': 8,
+    'SEP': 9, 'SEPT': 9, 'SEPTIEMBRE': 9, 'SEPTEMBER': 9,
+    'OCT': 10, 'OCTUBRE': 10, 'OCTOBER': 10,
+    'NOV': 11, 'NOVIEMBRE': 11, 'NOVEMBER': 11,
+    'DIC': 12, 'DEC': 12, 'DICIEMBRE': 12, 'DECEMBER': 12
+}
 
 def extract_date_from_path(file_path):
     """
@@ -15,22 +49,6 @@ def extract_date_from_path(file_path):
     year = None
     month = None
     
-    # Grid of month names to int
-    MONTH_MAP = {
-        'ENE': 1, 'JAN': 1, 'ENERO': 1, 'JANUARY': 1,
-        'FEB': 2, 'FEBRERO': 2, 'FEBRUARY': 2,
-        'MAR': 3, 'MARZO': 3, 'MARCH': 3,
-        'ABR': 4, 'APR': 4, 'ABRIL': 4, 'APRIL': 4,
-        'MAY': 5, 'MAYO': 5,
-        'JUN': 6, 'JUNIO': 6, 'JUNE': 6,
-        'JUL': 7, 'JULIO': 7, 'JULY': 7,
-        'AGO': 8, 'AUG': 8, 'AGOSTO': 8, 'AUGUST': 8,
-        'SEP': 9, 'SEPT': 9, 'SEPTIEMBRE': 9, 'SEPTEMBER': 9,
-        'OCT': 10, 'OCTUBRE': 10, 'OCTOBER': 10,
-        'NOV': 11, 'NOVIEMBRE': 11, 'NOVEMBER': 11,
-        'DIC': 12, 'DEC': 12, 'DICIEMBRE': 12, 'DECEMBER': 12
-    }
-    
     for part in path_parts:
         part_upper = part.upper()
         
@@ -48,19 +66,47 @@ def extract_date_from_path(file_path):
                 
     return year, month
 
-def scan_rem_files(root_dir):
+def iter_files(root_dir):
+    """
+    Walks root_dir with os.scandir (same order as os.walk, top-down) and yields
+    the DirEntry of every file. The entries carry the stat data of the listing,
+    so no extra stat call per file is needed on Windows/network folders.
+    """
+    subdirs = []
+    with os.scandir(root_dir) as it:
+        for dir_entry in it:
+            if dir_entry.is_dir():
+                subdirs.append(dir_entry.path)
+            elif dir_entry.is_file():
+                yield dir_entry
+    for subdir in subdirs:
+        yield from iter_files(subdir)
+
+def serie_from_path(file_path):
+    """REM series of a file from its folders (SERIE_A -> 'A'), or None."""
+    for part in reversed(normalize_path(file_path).split(os.sep)):
+        if part.upper().startswith("SERIE_"):
+            return part.upper()[len("SERIE_"):]
+    return None
+
+def scan_rem_files(root_dir, logger=None, valid_centers_map=None):
     """
     Scans a directory for Excel files and extracts metadata.
+    The audit logger and the center names are created/loaded when not given
+    (a run context passes the ones it already has).
     Returns list of dicts:
-    [{'path': ..., 'year': ..., 'month': ..., 'filename': ..., 'code': ...}]
+    [{'path': ..., 'year': ..., 'month': ..., 'filename': ..., 'code': ...,
+      'serie': ..., 'size': ..., 'mtime_ns': ...}]
     """
     try:
-        from .utils import setup_audit_logger, load_center_names
-        logger = setup_audit_logger()
-        valid_centers_map = load_center_names()
+        from .utils import load_center_names
+        if logger is None:
+            logger = get_logger("scan")
+        if valid_centers_map is None:
+            valid_centers_map = load_center_names()
     except ImportError:
         # Fallback if circular import issues arise, though utils is imported at top
-        print("Error importing audit tools")
+        log.error("Error importing audit tools")
         return []
 
     mapping = []
@@ -83,48 +129,54 @@ def scan_rem_files(root_dir):
     # Let's collect the distinct expected codes from the map keys.
     expected_codes = set(valid_centers_map.keys())
 
-    for root, dirs, files in os.walk(abs_root):
-        for filename in files:
-            # STRICT FILTER: Only .xlsm
-            if not filename.lower().endswith('.xlsm'):
-                if filename.lower().endswith('.xlsx'):
-                     logger.warning(f"Archivo ignorado (extension incorrecta, se requiere .xlsm): {filename}")
-                continue
+    for dir_entry in iter_files(abs_root):
+        filename = dir_entry.name
+        # STRICT FILTER: Only .xlsm
+        if not filename.lower().endswith('.xlsm'):
+            if filename.lower().endswith('.xlsx'):
+                 logger.warning(f"Archivo ignorado (extension incorrecta, se requiere .xlsm): {filename}")
+            continue
 
-            full_path = os.path.join(root, filename)
-            
-            year, month = extract_date_from_path(full_path)
-            
-            # Check formatting of code (filename without extension)
-            raw_code = os.path.splitext(filename)[0].upper()
-            code = raw_code
-            
-            # Normalize: 121305A -> 121305
-            if code and code[-1].isalpha() and code[:-1].isdigit():
-                code = code[:-1]
-            
-            # VALIDATION: Check if code is in acceptable names
-            if code not in valid_centers_map and raw_code not in valid_centers_map:
-                logger.warning(f"Archivo ignorado (Centro NO autorizado/desconocido): {filename} (Codigo detectado: {code})")
-                continue
+        full_path = dir_entry.path
+        
+        year, month = extract_date_from_path(full_path)
+        
+        # Check formatting of code (filename without extension)
+        raw_code = os.path.splitext(filename)[0].upper()
+        code = raw_code
+        
+        # Normalize: 121305A -> 121305
+        if code and code[-1].isalpha() and code[:-1].isdigit():
+            code = code[:-1]
+        
+        # VALIDATION: Check if code is in acceptable names
+        if code not in valid_centers_map and raw_code not in valid_centers_map:
+            logger.warning(f"Archivo ignorado (Centro NO autorizado/desconocido): {filename} (Codigo detectado: {code})")
+            continue
 
-            # If valid, proceed
-            logger.info(f"Archivo validado y agregado: {filename} -> Centro: {valid_centers_map.get(code, valid_centers_map.get(raw_code))}")
-            
-            item = {
-                'path': full_path,
-                'year': year,
-                'month': month,
-                'filename': filename,
-                'code': code
-            }
-            mapping.append(item)
-            
-            # Mark as found (track both normalized and raw to be safe, but usually normalized is better for matching)
-            found_codes.add(code)
-            found_codes.add(raw_code)
+        # If valid, proceed
+        # Un registro por archivo: solo con el nivel DEBUG del componente scan
+        logger.debug("Archivo validado y agregado: %s -> Centro: %s", filename, valid_centers_map.get(code, valid_centers_map.get(raw_code)))
+        
+        st = dir_entry.stat()
+        count('files_scanned')
+        item = {
+            'path': full_path,
+            'year': year,
+            'month': month,
+            'filename': filename,
+            'code': code,
+            'serie': serie_from_path(full_path),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns
+        }
+        mapping.append(item)
+        
+        # Mark as found (track both normalized and raw to be safe, but usually normalized is better for matching)
+        found_codes.add(code)
+        found_codes.add(raw_code)
 
-    logger.info(f"Total de archivos validos encontrados: {len(mapping)}")
+    logger.info(f"Total de archivos validos encontrados: {len(mapping)}", extra={'data': {'root': abs_root, 'files': len(mapping)}})
     
     # COMPLETENESS CHECK
     # We need to ensure that for the *expected* centers, we found at least one file? 
@@ -202,46 +254,254 @@ def scan_rem_files(root_dir):
     if missing_names:
         msg = f"CRITICO: Faltan archivos para los siguientes centros: {list(missing_names)}"
         # Change to warning to allow partial execution as requested
-        print(f"[WARNING] {msg}")
-        # logger.warning(msg) # Assuming logger is configured elsewhere or using print for now based on context
+        logger.warning(msg)
     
     return mapping
 
-def get_rem_value(file_path, sheet_name, cell_coordinate):
+def compile_coordinates(coordinates):
+    """
+    Compiles Excel coordinates ('J26') to (row, col) tuples once per request.
+    Returns {row: [(coordinate, col), ...]} so a sheet pass can resolve them by row.
+    """
+    by_row = {}
+    for coord in coordinates:
+        row, col = coordinate_to_tuple(coord)
+        by_row.setdefault(row, []).append((coord, col))
+    return by_row
+
+def fetch_cells(sheet, coordinates, max_row=0):
+    """
+    Resolves a batch of cell coordinates on a read-only worksheet in a single
+    forward pass that stops at the highest requested row (random access with
+    sheet["J26"] re-streams the sheet XML from the top on every call).
+    When max_row is given, rows 1..max_row are also returned as value tuples.
+    Works with openpyxl worksheets and with XlsmReader sheets.
+    Returns ({coordinate: value}, [row_tuple, ...]).
+    """
+    by_row = compile_coordinates(coordinates)
+    values = {coord: None for cells in by_row.values() for coord, _ in cells}
+    rows = []
+    last_row = max([max_row] + list(by_row))
+    if not last_row:
+        return values, rows
+    
+    if max_row:
+        # Full rows are needed for the label searches
+        first_row, first_col, last_col = 1, None, None
+    else:
+        # Only the requested block: cells outside it are never decoded
+        cols = [col for cells in by_row.values() for _, col in cells]
+        first_row, first_col, last_col = min(by_row), min(cols), max(cols)
+    
+    rows_iter = sheet.iter_rows(min_row=first_row, max_row=last_row, min_col=first_col, max_col=last_col, values_only=True)
+    offset = first_col or 1
+    for row_idx, row in enumerate(rows_iter, first_row):
+        if row_idx <= max_row:
+            rows.append(row)
+        for coord, col in by_row.get(row_idx, ()):
+            if 0 <= col - offset < len(row):
+                values[coord] = row[col - offset]
+    return values, rows
+
+class XlsmSheet:
     """
-    Opens an Excel file and retrieves a value from a specific sheet and cell.
-    Returns 0 if cell is empty or invalid.
+    One worksheet of an XlsmReader. Streams its XML member with an incremental
+    parser and stops as soon as the requested rows have been read.
     """
-    if not os.path.exists(file_path):
-        print(f"File not found: {file_path}")
-        return 0
+    def __init__(self, reader, member):
+        self._reader = reader
+        self._member = member
+        self.max_column = None
+        # <dimension> comes first in the sheet XML; openpyxl pads rows to it
+        with reader._archive.open(member) as src:
+            for _, element in iterparse(src):
+                if element.tag == f"{{{XLSX_NS}}}dimension":
+                    self.max_column = range_boundaries(element.get('ref'))[2]
+                    break
+                if element.tag == f"{{{XLSX_NS}}}sheetData":
+                    break
+
+    def iter_rows(self, min_row=1, max_row=None, min_col=None, max_col=None, values_only=True):
+        """
+        Yields row value tuples like openpyxl's read-only iter_rows(values_only=True):
+        missing rows and cells are filled with None and rows are padded to the
+        sheet dimension.
+        """
+        min_col = min_col or 1
+        max_col = max_col or self.max_column
+        empty_row = (None,) * (max_col + 1 - min_col) if max_col else ()
         
-    try:
-        wb = openpyxl.load_workbook(file_path, data_only=True, read_only=True)
-        if sheet_name not in wb.sheetnames:
-            print(f"Sheet {sheet_name} not found in {file_path}")
-            wb.close()
-            return 0
-            
-        sheet = wb[sheet_name]
-        val = sheet[cell_coordinate].value
-        wb.close()
+        counter = min_row
+        idx = 0
+        row_tag = f"{{{XLSX_NS}}}row"
+        with self._reader._archive.open(self._member) as src:
+            for _, element in iterparse(src):
+                if element.tag != row_tag:
+                    continue
+                idx = int(float(element.get('r'))) if element.get('r') else idx + 1
+                if max_row is not None and idx > max_row:
+                    break
+                for _ in range(counter, idx):
+                    counter += 1
+                    yield empty_row
+                if counter <= idx:
+                    counter += 1
+                    yield self._parse_row(element, min_col, max_col)
+                element.clear()
         
-        if val and isinstance(val, (int, float)):
-            return val
-        return 0
-    except Exception as e:
-        print(f"Error reading {file_path}: {e}")
-        return 0
+        if max_row is not None and max_row < idx:
+            for _ in range(counter, max_row + 1):
+                yield empty_row
 
-def load_piv_data(parquet_path):
+    def _parse_row(self, element, min_col, max_col):
+        cells = []
+        col = 0
+        for cell in element:
+            ref = cell.get('r')
+            col = coordinate_to_tuple(ref)[1] if ref else col + 1
+            if col < min_col or (max_col and col > max_col):
+                continue
+            cells.append((col, self._cell_value(cell)))
+        if not cells and not max_col:
+            return ()
+        width = (max_col or cells[-1][0]) + 1 - min_col
+        row = [None] * width
+        for col, value in cells:
+            row[col - min_col] = value
+        return tuple(row)
+
+    def _cell_value(self, cell):
+        data_type = cell.get('t', 'n')
+        if data_type == 'inlineStr':
+            node = cell.find(f"{{{XLSX_NS}}}is")
+            return _string_item_text(node) if node is not None else None
+        value = cell.findtext(f"{{{XLSX_NS}}}v") or None
+        if value is None:
+            return None
+        if data_type == 'n':
+            # Same cast as openpyxl; date number formats are not applied (REM counts never use them)
+            if "." in value or "E" in value or "e" in value:
+                return float(value)
+            return int(value)
+        if data_type == 's':
+            return self._reader.shared_strings[int(value)]
+        if data_type == 'b':
+            return bool(int(value))
+        if data_type == 'd':
+            return datetime.fromisoformat(value.rstrip('Z'))
+        return value
+
+class XlsmReader:
     """
-    Loads the PIV Master Parquet file into a list of dictionaries using PyArrow.
+    Minimal streaming reader for REM .xlsm workbooks (engine "xml").
+    Opens the zip, resolves sheet names to their xl/worksheets/sheetN.xml member
+    through workbook.xml and its rels, and never builds styles or workbook objects.
+    Shared strings are loaded lazily, the first time a text cell is decoded.
+    Exposes the part of openpyxl's read-only API used here: sheetnames,
+    reader[sheet_name].iter_rows(...) and close().
+    """
+    def __init__(self, file_path):
+        self._archive = zipfile.ZipFile(file_path)
+        self._shared_strings = None
+        self._sheet_members = {}
+        self._strings_member = None
+        
+        workbook_member = self._office_document()
+        rels = self._relationships(workbook_member)
+        with self._archive.open(workbook_member) as src:
+            for _, element in iterparse(src):
+                if element.tag == f"{{{XLSX_NS}}}sheet":
+                    rel_id = element.get(f"{{{REL_NS}}}id")
+                    if rel_id in rels:
+                        self._sheet_members[element.get('name')] = rels[rel_id][1]
+        for rel_type, member in rels.values():
+            if rel_type.endswith("/sharedStrings"):
+                self._strings_member = member
+        self.sheetnames = list(self._sheet_members)
+
+    def __getitem__(self, sheet_name):
+        if sheet_name not in self._sheet_members:
+            raise KeyError(f"Worksheet {sheet_name} does not exist.")
+        return XlsmSheet(self, self._sheet_members[sheet_name])
+
+    @property
+    def shared_strings(self):
+        if self._shared_strings is None:
+            self._shared_strings = []
+            if self._strings_member:
+                with self._archive.open(self._strings_member) as src:
+                    for _, element in iterparse(src):
+                        if element.tag == f"{{{XLSX_NS}}}si":
+                            self._shared_strings.append(_string_item_text(element).replace('x005F_', ''))
+                            element.clear()
+        return self._shared_strings
+
+    def close(self):
+        self._archive.close()
+
+    def _office_document(self):
+        for rel_type, member in self._relationships("").values():
+            if rel_type.endswith("/officeDocument"):
+                return member
+        return "xl/workbook.xml"
+
+    def _relationships(self, part):
+        """Returns {rel_id: (type, member)} for a package part ('' for the package root)."""
+        folder, name = posixpath.split(part)
+        rels_member = posixpath.join(folder, "_rels", f"{name}.rels")
+        rels = {}
+        if rels_member not in self._archive.namelist():
+            return rels
+        with self._archive.open(rels_member) as src:
+            for _, element in iterparse(src):
+                if element.tag == f"{{{PKG_REL_NS}}}Relationship":
+                    target = element.get('Target')
+                    if target.startswith('/'):
+                        member = target.lstrip('/')
+                    else:
+                        member = posixpath.normpath(posixpath.join(folder, target))
+                    rels[element.get('Id')] = (element.get('Type'), member)
+        return rels
+
+def _string_item_text(element):
+    """Plain text of a shared/inline string item: <t> plus rich-text runs, without phonetic runs."""
+    parts = []
+    for child in element:
+        if child.tag == f"{{{XLSX_NS}}}t":
+            parts.append(child.text or "")
+        elif child.tag == f"{{{XLSX_NS}}}r":
+            parts.append(child.findtext(f"{{{XLSX_NS}}}t") or "")
+    return "".join(parts)
+
+def open_rem_workbook(file_path, engine="openpyxl"):
+    """
+    Opens a REM workbook for reading with the selected engine:
+    "openpyxl" (read-only, data_only) or "xml" (XlsmReader).
+    Both expose sheetnames, [sheet_name].iter_rows(...) and close().
+    """
+    if engine == "xml":
+        return XlsmReader(file_path)
+    if engine == "openpyxl":
+        return openpyxl.load_workbook(file_path, data_only=True, read_only=True)
+    raise ValueError(f"Motor de lectura REM desconocido: {engine}")
+
+def iter_piv_records(parquet_path, batch_size=PIV_BATCH_SIZE):
+    """
+    Streams the PIV Master Parquet file as lists of dictionaries, one list per
+    record batch of at most batch_size rows (ParquetFile.iter_batches), so only
+    one batch is held as Python objects at a time. For population counts use
+    modules.piv.get_piv_histogram instead.
     """
     abs_path = normalize_path(parquet_path)
     if not os.path.exists(abs_path):
         raise FileNotFoundError(f"PIV file not found: {abs_path}")
-    
-    table = pq.read_table(abs_path, columns=['COD_CENTRO', 'EDAD_EN_FECHA_CORTE', 'ACEPTADO_RECHAZADO', 'GENERO', 'GENERO_NORMALIZADO'])
-    # Convert to list of dicts for easier consumption without pandas
-    return table.to_pylist()
+    parquet = pq.ParquetFile(abs_path)
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=PIV_RECORD_COLUMNS):
+        yield batch.to_pylist()
+
+def load_piv_data(parquet_path):
+    """
+    Loads the PIV Master Parquet file into a list of dictionaries using PyArrow.
+    The whole file is materialized: prefer iter_piv_records for large PIVs.
+    """
+    return [record for records in iter_piv_records(parquet_path) for record in records]
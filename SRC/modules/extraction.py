@@ -0,0 +1,335 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from .dataloaders import fetch_cells, open_rem_workbook
+from .labels import normalize_label, row_label, index_labels
+from .ranges import range_coordinates, range_array
+from .cache import open_cache, entry_fingerprint, cache_lookup, cache_store
+from .cube import workbook_records, is_current, write_part, load_from_cube
+from .profiling import span, count, profiled_call, merge
+from .logs import get_logger
+from config import REM_ENGINE, EXTRACTION_CACHE, CACHE_HASH_CONTENT, EXTRACTION_WORKERS, EXTRACTION_TIMEOUT, CUBE_DIR
+
+log = get_logger("extraction")
+
+def merge_requests(*request_lists):
+    """
+    Merges the REM sheet requests declared by several metas into one plan.
+    Each request is a dict like
+    {'sheet': 'P4', 'cells': ['C17'], 'ranges': ['J23:M28'], 'max_row': 100, 'labels': ['HbA1C<7%']}:
+    'cells' are fixed coordinates, 'ranges' rectangular blocks returned as
+    NumPy arrays, 'max_row' asks for the first N rows of the sheet and
+    'labels' are the texts (columns A-E) whose rows the meta looks up within
+    those rows.
+    Returns {sheet: {'cells': set(...), 'ranges': set(...), 'max_row': int, 'labels': set(...)}}.
+    """
+    plan = {}
+    for requests in request_lists:
+        for req in requests:
+            sheet_plan = plan.setdefault(req['sheet'], {'cells': set(), 'ranges': set(), 'max_row': 0, 'labels': set()})
+            sheet_plan['cells'].update(req.get('cells', []))
+            for cell_range in req.get('ranges', []):
+                # Los rangos se leen como celdas (y se guardan así en la caché)
+                sheet_plan['ranges'].add(cell_range)
+                sheet_plan['cells'].update(range_coordinates(cell_range))
+            sheet_plan['max_row'] = max(sheet_plan['max_row'], req.get('max_row', 0))
+            sheet_plan['labels'].update(normalize_label(label) for label in req.get('labels', []))
+    return plan
+
+def extract_workbook(file_path, plan, engine=REM_ENGINE):
+    """
+    Opens a REM workbook exactly once and resolves every sheet request in the plan
+    with one forward pass per sheet. `engine` selects the reader ("openpyxl" or "xml").
+    Returns {sheet: {'cells': {coord: value}, 'rows': [row_tuple, ...], 'labels': {label: [row, ...]},
+    'ranges': {range: float64 array}}}.
+    'rows' starts at row 1 and 'labels' indexes them by the requested labels
+    (see modules.labels). Sheets not present in the workbook are omitted.
+    """
+    result = {}
+    count('files_opened')
+    count('bytes_read', os.path.getsize(file_path))
+    with span('workbook'):
+        wb = open_rem_workbook(file_path, engine)
+        try:
+            for sheet_name, sheet_plan in plan.items():
+                if sheet_name not in wb.sheetnames:
+                    continue
+                with span('sheet'):
+                    cells, rows = fetch_cells(wb[sheet_name], sheet_plan['cells'], sheet_plan['max_row'])
+                    numbered_labels = ((row_number, row_label(row)) for row_number, row in enumerate(rows, start=1))
+                    labels = index_labels(numbered_labels, sheet_plan.get('labels', ()))
+                count('sheets_parsed')
+                count('rows_iterated', len(rows))
+                result[sheet_name] = {'cells': cells, 'rows': rows, 'labels': labels}
+        finally:
+            wb.close()
+    return attach_ranges(result, plan)
+
+def attach_ranges(result, plan):
+    """Adds to every extracted sheet the float64 arrays of the ranges requested by the plan."""
+    for sheet_name, data in result.items():
+        ranges = plan.get(sheet_name, {}).get('ranges', ())
+        data['ranges'] = {cell_range: range_array(data['cells'], cell_range) for cell_range in ranges}
+    return result
+
+def extract_parallel(entries, plan, engine=REM_ENGINE, workers=EXTRACTION_WORKERS, timeout=EXTRACTION_TIMEOUT, func=extract_workbook):
+    """
+    Extracts the given REM files in a pool of `workers` processes, with at most
+    `workers` files in flight, and yields (entry, result, error) in completion
+    order. A file still running after `timeout` seconds is reported with a
+    TimeoutError: the hung workers are killed and the files that were in flight
+    with it are queued again on a fresh pool.
+    A worker that dies (e.g. a crash or out of memory in a native parser) breaks
+    the whole pool without telling which file caused it: the pool is replaced
+    and the files that were in flight are run again one at a time; only a file
+    that breaks the pool again while running alone is reported (BrokenProcessPool).
+    `func(path, plan, engine)` is the per-file reader (extract_workbook or workbook_records).
+    """
+    queue = [(entry, False) for entry in entries] # (entry, alone): alone = sin otros archivos en curso
+    while queue:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        running = {} # {future: (entry, alone, deadline)}
+        hung = False
+        broken = None
+        try:
+            while (queue or running) and not hung and broken is None:
+                while queue and len(running) < workers:
+                    entry, alone = queue[0]
+                    if running and (alone or any(isolated for _, isolated, _ in running.values())):
+                        break
+                    try:
+                        future = pool.submit(profiled_call, None, func, entry['path'], plan, engine)
+                    except BrokenProcessPool as e:
+                        broken = e
+                        break
+                    queue.pop(0)
+                    running[future] = (entry, alone, time.monotonic() + timeout)
+                if broken is not None:
+                    break
+
+                next_deadline = min(deadline for _, _, deadline in running.values())
+                finished, _ = wait(running, timeout=max(0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    try:
+                        result, measurements = future.result()
+                    except BrokenProcessPool as e:
+                        # Se resuelve abajo junto con los demás archivos en curso
+                        broken = e
+                        continue
+                    except Exception as e:
+                        entry, _, _ = running.pop(future)
+                        yield entry, None, e
+                        continue
+                    entry, _, _ = running.pop(future)
+                    # Contadores del proceso de lectura (libros, hojas, filas) se suman a los de la ejecución
+                    merge(measurements)
+                    yield entry, result, None
+                if broken is not None:
+                    break
+
+                now = time.monotonic()
+                for future, (entry, alone, deadline) in list(running.items()):
+                    if deadline <= now and not future.done():
+                        del running[future]
+                        hung = True
+                        yield entry, None, TimeoutError(f"sin respuesta después de {timeout:g} s")
+                if hung:
+                    queue = [(entry, alone) for entry, alone, _ in running.values()] + queue
+                    running = {}
+
+            if broken is not None:
+                # El ejecutor marca como fallidas todas las tareas pendientes del pool roto
+                wait(running, timeout=timeout)
+                suspects = []
+                for future, (entry, alone, _) in running.items():
+                    error = future.exception() if future.done() else broken
+                    if error is None:
+                        result, measurements = future.result()
+                        merge(measurements)
+                        yield entry, result, None
+                    elif not isinstance(error, BrokenProcessPool):
+                        yield entry, None, error
+                    elif alone:
+                        yield entry, None, error
+                    else:
+                        suspects.append((entry, True))
+                running = {}
+                if suspects:
+                    log.warning(f"Un proceso de lectura terminó inesperadamente; {len(suspects)} archivos se reintentan uno a uno")
+                queue = suspects + queue
+        finally:
+            if hung or broken is not None:
+                _kill_workers(pool)
+            pool.shutdown(wait=not hung, cancel_futures=True)
+
+def _kill_workers(pool):
+    """Kills the processes of a pool that has a hung task (shutdown alone would wait for it)."""
+    if hasattr(pool, 'kill_workers'): # Python 3.14+
+        pool.kill_workers()
+        return
+    for process in list((pool._processes or {}).values()):
+        process.kill()
+
+def ingest_rem(entries, quarantine=None, engine=REM_ENGINE, cube_dir=CUBE_DIR):
+    """
+    Converts REM workbooks into the REM cube (see modules.cube): every file
+    whose cube records are missing or were built from another version of the
+    file (size + mtime) is read once, all sheets, and written to its
+    year/serie partition. Reading runs in parallel like extract_rem, and
+    unreadable or timed-out files are added to `quarantine`.
+    Returns the number of files written.
+    """
+    if quarantine is None:
+        quarantine = []
+    quarantined = {item['path'] for item in quarantine}
+    stale = []
+    seen = set()
+    for entry in entries:
+        if entry['path'] in seen or entry['path'] in quarantined:
+            continue
+        seen.add(entry['path'])
+        if not is_current(cube_dir, entry):
+            stale.append(entry)
+    if not stale:
+        return 0
+
+    if EXTRACTION_WORKERS > 1 and len(stale) > 1:
+        results = extract_parallel(stale, None, engine, func=workbook_records)
+    else:
+        results = _extract_serial(stale, None, engine, func=workbook_records)
+    written = 0
+    for entry, records, error in results:
+        if error is not None:
+            _quarantine(quarantine, entry, error)
+            continue
+        write_part(cube_dir, entry, records)
+        written += 1
+    count('cube_files_ingested', written)
+    log.info(f"Cubo REM: {written} archivos incorporados")
+    return written
+
+def extract_rem(entries, plan, rem=None, quarantine=None, engine=REM_ENGINE, cache_path=EXTRACTION_CACHE, cube_dir=CUBE_DIR):
+    """
+    Extracts every REM file listed in `entries` (output of scan_rem_files).
+    Files already present in `rem` or in `quarantine` are not opened again.
+    With the REM cube enabled (cube_dir), new or changed files are first
+    ingested into the cube (ingest_rem) and every file is then resolved from
+    the cube with one Arrow scan, without opening the workbooks.
+    Otherwise, files whose fingerprint (path + size + mtime) matches the
+    persistent cache are served from it without opening the workbook.
+    cache_path=None disables the cache.
+    The size/mtime recorded by scan_rem_files are used as the fingerprint.
+    The remaining files are read in parallel (extract_parallel) when
+    EXTRACTION_WORKERS > 1, otherwise one after another in this process.
+    Missing, unreadable or timed-out files are added to `quarantine` as
+    {'path', 'filename', 'code', 'year', 'month', 'motivo'} and left out of `rem`.
+    Returns {path: extract_workbook(...)}.
+    """
+    if rem is None:
+        rem = {}
+    if quarantine is None:
+        quarantine = []
+    if cube_dir:
+        return _extract_from_cube(entries, plan, rem, quarantine, engine, cube_dir)
+    conn = open_cache(cache_path) if cache_path else None
+    opened = 0
+    hits = 0
+    fingerprints = {}
+    to_extract = []
+    quarantined = {item['path'] for item in quarantine}
+    try:
+        for entry in entries:
+            file_path = entry['path']
+            if file_path in rem or file_path in fingerprints or file_path in quarantined:
+                continue
+            # Las entradas del escaneo ya traen tamaño y fecha: no se vuelve a consultar el disco
+            if 'size' not in entry and not os.path.exists(file_path):
+                _quarantine(quarantine, entry, "Archivo no existe")
+                continue
+            if conn is not None:
+                try:
+                    fingerprints[file_path] = entry_fingerprint(entry)
+                except OSError as e:
+                    _quarantine(quarantine, entry, e)
+                    continue
+                cached = cache_lookup(conn, file_path, fingerprints[file_path], plan, CACHE_HASH_CONTENT)
+                if cached is not None:
+                    rem[file_path] = attach_ranges(cached, plan)
+                    hits += 1
+                    count('cache_hits')
+                    continue
+                count('cache_misses')
+            else:
+                fingerprints[file_path] = None
+            to_extract.append(entry)
+
+        if EXTRACTION_WORKERS > 1 and len(to_extract) > 1:
+            results = extract_parallel(to_extract, plan, engine)
+        else:
+            results = _extract_serial(to_extract, plan, engine)
+        for entry, result, error in results:
+            if error is not None:
+                _quarantine(quarantine, entry, error)
+                continue
+            file_path = entry['path']
+            rem[file_path] = result
+            opened += 1
+            if conn is not None:
+                cache_store(conn, file_path, fingerprints[file_path], plan, result, CACHE_HASH_CONTENT)
+                conn.commit()
+    finally:
+        if conn is not None:
+            conn.commit()
+            conn.close()
+    if opened or hits:
+        log.info(f"Extracción REM: {opened} archivos abiertos, {hits} desde caché")
+    return rem
+
+def _extract_from_cube(entries, plan, rem, quarantine, engine, cube_dir):
+    quarantined = {item['path'] for item in quarantine}
+    pending = []
+    seen = set()
+    for entry in entries:
+        file_path = entry['path']
+        if file_path in rem or file_path in seen or file_path in quarantined:
+            continue
+        seen.add(file_path)
+        if 'size' not in entry and not os.path.exists(file_path):
+            _quarantine(quarantine, entry, "Archivo no existe")
+            continue
+        pending.append(entry)
+    if not pending:
+        return rem
+
+    ingest_rem(pending, quarantine, engine, cube_dir)
+    quarantined = {item['path'] for item in quarantine}
+    pending = [entry for entry in pending if entry['path'] not in quarantined]
+    with span('cube_scan'):
+        loaded = load_from_cube(cube_dir, pending, plan)
+    count('cube_files_loaded', len(pending))
+    for file_path, result in loaded.items():
+        rem[file_path] = attach_ranges(result, plan)
+    log.info(f"Extracción REM: {len(pending)} archivos desde el cubo")
+    return rem
+
+def _extract_serial(entries, plan, engine, func=extract_workbook):
+    for entry in entries:
+        try:
+            yield entry, func(entry['path'], plan, engine), None
+        except Exception as e:
+            yield entry, None, e
+
+def _quarantine(quarantine, entry, reason):
+    """Records a file that could not be extracted, with the reason, in the run quarantine list."""
+    if isinstance(reason, Exception):
+        reason = f"{type(reason).__name__}: {reason}"
+    log.warning(f"Archivo en cuarentena: {entry['filename']} ({reason})", extra={'data': {'path': entry['path'], 'motivo': reason}})
+    quarantine.append({
+        'path': entry['path'],
+        'filename': entry['filename'],
+        'code': entry.get('code'),
+        'year': entry.get('year'),
+        'month': entry.get('month'),
+        'motivo': reason,
+    })
@@ -0,0 +1,96 @@
+import os
+from datetime import date
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from .profiling import count
+
+# Columnas de cada partición del histórico (year y month del corte van en la ruta: year=2026/month=10)
+HISTORY_SCHEMA = pa.schema([
+    ('Fecha_Corte', pa.date32()),
+    ('Meta_ID', pa.string()),
+    ('Nombre_Indicador', pa.string()),
+    ('COD_CENTRO', pa.string()),
+    ('Nombre_Centro', pa.string()),
+    ('Numerador', pa.float64()),
+    ('Denominador', pa.float64()),
+    ('Cumplimiento', pa.float64()),
+    ('Meta_Fijada', pa.float64()),
+    ('Meta_Nacional', pa.float64()),
+    ('Estado', pa.string()),
+    ('Run_ID', pa.string()),
+])
+HISTORY_PARTITIONING = ds.partitioning(pa.schema([('year', pa.int16()), ('month', pa.int8())]), flavor='hive')
+# Un archivo por mes de corte: cada ejecución del mes reemplaza sus filas (meta, centro)
+PARTITION_FILE = "resultados.parquet"
+
+def partition_path(history_dir, cut_date):
+    """File of the history that holds one cut month: year=Y/month=M/resultados.parquet."""
+    return os.path.join(history_dir, f"year={cut_date.year}", f"month={cut_date.month}", PARTITION_FILE)
+
+def history_rows(consolidado, cut_date, run_id):
+    """History rows (HISTORY_SCHEMA) of a consolidated table (modules.results.consolidate)."""
+    n = consolidado.num_rows
+    return pa.Table.from_arrays([
+        pa.array([cut_date] * n, pa.date32()),
+        consolidado.column('Meta_ID'),
+        consolidado.column('Nombre_Indicador'),
+        consolidado.column('COD_CENTRO'),
+        consolidado.column('Nombre_Centro'),
+        consolidado.column('Numerador_Actual'),
+        consolidado.column('Denominador_Actual'),
+        consolidado.column('Cumplimiento_Actual_%'),
+        consolidado.column('Meta_Fijada_%'),
+        consolidado.column('Meta_Nacional_%'),
+        consolidado.column('Estado'),
+        pa.array([run_id] * n, pa.string()),
+    ], schema=HISTORY_SCHEMA)
+
+def _row_keys(table):
+    return pc.binary_join_element_wise(table.column('Meta_ID'), table.column('COD_CENTRO'), '\x1f')
+
+def append_history(history_dir, consolidado, cut_date=None, run_id=None):
+    """
+    Adds the results of a run to the history, partitioned by cut year and month.
+    Rows of the same cut month and (meta, center) written by an earlier run are
+    replaced (a rerun does not duplicate them); rows of metas not in this run
+    are kept. The partition is rewritten atomically, sorted by meta and center.
+    Returns the path of the partition file.
+    """
+    cut_date = cut_date or date.today()
+    nuevas = history_rows(consolidado, cut_date, run_id)
+    target = partition_path(history_dir, cut_date)
+    if os.path.exists(target):
+        previas = pq.read_table(target, schema=HISTORY_SCHEMA)
+        conservadas = previas.filter(pc.invert(pc.is_in(_row_keys(previas), value_set=_row_keys(nuevas))))
+        count('history_rows_replaced', previas.num_rows - conservadas.num_rows)
+        nuevas = pa.concat_tables([conservadas, nuevas])
+    nuevas = nuevas.sort_by([('Meta_ID', 'ascending'), ('COD_CENTRO', 'ascending')])
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Prefijo '.': el dataset ignora el archivo temporal si una lectura coincide con la escritura
+    tmp_path = os.path.join(os.path.dirname(target), "." + PARTITION_FILE + ".tmp")
+    pq.write_table(nuevas, tmp_path, compression='zstd')
+    os.replace(tmp_path, target)
+    count('history_rows_written', nuevas.num_rows)
+    return target
+
+def scan_history(history_dir, filter=None, columns=None):
+    """
+    Reads the history as one Arrow dataset (partitions year and month included
+    as columns), applying an Arrow filter expression; partitions and row groups
+    outside the filter are skipped, e.g.
+    (pc.field('year') == 2026) & (pc.field('Meta_ID') == 'Meta 5') & (pc.field('COD_CENTRO') == '121305').
+    Returns a pyarrow Table.
+    """
+    if not os.path.exists(history_dir):
+        return HISTORY_SCHEMA.empty_table()
+    dataset = ds.dataset(history_dir, format='parquet', partitioning=HISTORY_PARTITIONING)
+    return dataset.to_table(filter=filter, columns=columns)
+
+def meta_trend(history_dir, meta_id, center, year=None):
+    """Month-by-month history of one meta at one center (optionally one year), sorted by cut date."""
+    condition = (pc.field('Meta_ID') == meta_id) & (pc.field('COD_CENTRO') == str(center))
+    if year is not None:
+        condition = condition & (pc.field('year') == year)
+    return scan_history(history_dir, condition).sort_by('Fecha_Corte')
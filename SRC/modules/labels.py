@@ -0,0 +1,57 @@
+import re
+import unicodedata
+
+# Columnas de etiquetas de los REM (A a E)
+LABEL_COLUMNS = 5
+
+def normalize_label(text):
+    """Normalizes a label for matching: no accents, case-folded, single spaces."""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+def row_label(row):
+    """
+    Label text of a row: the non-empty text cells of columns A to E joined by
+    spaces. Counts typed in those columns are not part of the label.
+    """
+    return " ".join([c for c in row[:LABEL_COLUMNS] if c and isinstance(c, str)])
+
+def build_label_index(rows, patterns):
+    """
+    Builds, in one pass over the rows, the index {normalized pattern: [row numbers]}
+    of the rows (1-based) whose label contains each pattern.
+    """
+    return index_labels(((row_number, row_label(row)) for row_number, row in enumerate(rows, start=1)), patterns)
+
+def index_labels(numbered_labels, patterns):
+    """
+    Same index as build_label_index, from (row number, label text) pairs
+    (e.g. the labels stored in the REM cube, without the full rows).
+    """
+    keys = sorted({normalize_label(p) for p in patterns})
+    index = {key: [] for key in keys}
+    if not keys:
+        return index
+    for row_number, label in numbered_labels:
+        label = normalize_label(label) if label else ""
+        if not label:
+            continue
+        for key in keys:
+            if key in label:
+                index[key].append(row_number)
+    return index
+
+def label_rows(sheet_data, *patterns, max_row=None):
+    """
+    Row numbers whose label contains every one of the given patterns, in order,
+    looked up in the label index of an extracted sheet.
+    """
+    found = None
+    for pattern in patterns:
+        matches = set(sheet_data['labels'][normalize_label(pattern)])
+        found = matches if found is None else found & matches
+    rows = sorted(found or [])
+    if max_row is not None:
+        rows = [r for r in rows if r <= max_row]
+    return rows
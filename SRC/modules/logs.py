@@ -0,0 +1,155 @@
+import os
+import sys
+import copy
+import json
+import uuid
+import queue
+import atexit
+import logging
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from config import LOG_LEVEL, LOG_LEVELS, CONSOLE_LOG_LEVEL
+
+# Logger raíz de la aplicación: cada componente usa metas.<componente> (metas.scan, metas.meta_3, ...)
+ROOT_LOGGER = "metas"
+
+# Cola y escritor en segundo plano del proceso actual (cada proceso de trabajo crea los suyos)
+_state = {'pid': None, 'queue': None, 'listener': None, 'handler': None}
+
+def run_id():
+    """
+    Id of the run, shared by the worker processes through the environment
+    (set by the first process that logs).
+    """
+    if "METAS_RUN_ID" not in os.environ:
+        os.environ["METAS_RUN_ID"] = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    return os.environ["METAS_RUN_ID"]
+
+def audit_file():
+    """JSON-lines audit file of the run (LOG/MET_SANIT_<run id>.jsonl), shared by its worker processes."""
+    if "METAS_LOG_FILE" not in os.environ:
+        # utils registra a través de este módulo: se importa aquí
+        from .utils import normalize_path
+        os.environ["METAS_LOG_FILE"] = os.path.join(normalize_path("LOG"), f"MET_SANIT_{run_id()}.jsonl")
+    return os.environ["METAS_LOG_FILE"]
+
+class JsonLinesFormatter(logging.Formatter):
+    """One compact JSON object per record: ts, run_id, pid, level, component, msg (+ data, exc)."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'run_id': run_id(),
+            'pid': record.process,
+            'level': record.levelname,
+            'component': record.name[len(ROOT_LOGGER) + 1:] or record.name,
+            'msg': record.getMessage(),
+        }
+        data = getattr(record, 'data', None)
+        if data:
+            entry['data'] = data
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class ConsoleFormatter(logging.Formatter):
+    """Plain message, as the former print output; warnings and errors carry their level."""
+
+    def format(self, record):
+        message = record.getMessage()
+        if record.levelno >= logging.WARNING:
+            message = f"[{record.levelname}] {message}"
+        if record.exc_text:
+            message = f"{message}\n{record.exc_text}"
+        return message
+
+class ConsoleHandler(logging.StreamHandler):
+    """Writes to the current sys.stdout (so redirecting stdout also redirects the console log)."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+class ProcessQueueHandler(QueueHandler):
+    """
+    QueueHandler that notices when it runs in a forked worker process (whose
+    inherited queue has no writer thread) and switches to a queue and writer
+    of that process.
+    """
+
+    def emit(self, record):
+        if _state['pid'] != os.getpid():
+            setup_logging()
+            _state['handler'].emit(record)
+            return
+        super().emit(record)
+
+    def prepare(self, record):
+        # Mensaje y traza se arman en el proceso que registra: el escritor en segundo plano solo los escribe
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def setup_logging():
+    """
+    Configures the logging of this process once: loggers metas.<component>
+    put their records on an in-memory queue (never blocking on disk or console)
+    and a background QueueListener writes them to the console (CONSOLE_LOG_LEVEL)
+    and to the JSON-lines audit file of the run. Logger levels come from
+    LOG_LEVEL, with per-component overrides in LOG_LEVELS.
+    """
+    if _state['pid'] == os.getpid():
+        return
+    _state['pid'] = os.getpid()
+    root = logging.getLogger(ROOT_LOGGER)
+    # Manejadores heredados del proceso padre (fork): su cola no tiene escritor en este proceso
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    log_path = audit_file()
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    file_handler = logging.FileHandler(log_path, encoding='utf-8', delay=True)
+    file_handler.setFormatter(JsonLinesFormatter())
+    console_handler = ConsoleHandler()
+    console_handler.setLevel(CONSOLE_LOG_LEVEL)
+    console_handler.setFormatter(ConsoleFormatter())
+
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    handler = ProcessQueueHandler(log_queue)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    for component, level in LOG_LEVELS.items():
+        logging.getLogger(f"{ROOT_LOGGER}.{component}").setLevel(level)
+    _state.update(queue=log_queue, listener=listener, handler=handler)
+
+def get_logger(component):
+    """Logger of a component (metas.<component>), with the run logging configured."""
+    setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{component}")
+
+def flush_logs():
+    """Waits until the background writer of this process has written every queued record."""
+    if _state['pid'] == os.getpid() and _state['listener'] is not None:
+        _state['queue'].join()
+
+def _stop():
+    if _state['pid'] == os.getpid() and _state['listener'] is not None:
+        _state['listener'].stop()
+        _state['listener'] = None
+
+atexit.register(_stop)
+if hasattr(os, 'register_at_fork'):
+    # La cola se vacía antes de crear un proceso de trabajo: el escritor no queda a mitad de una escritura
+    os.register_at_fork(before=flush_logs)
@@ -0,0 +1,49 @@
+import os
+import json
+from .logs import get_logger
+
+# Datos de cada archivo que se guardan en el manifiesto
+MANIFEST_FIELDS = ['code', 'year', 'month', 'serie', 'size', 'mtime_ns']
+
+def build_manifest(entries):
+    """
+    Builds the manifest of a REM scan (entries from scan_rem_files):
+    {path: {'code', 'year', 'month', 'serie', 'size', 'mtime_ns'}}.
+    """
+    return {entry['path']: {field: entry.get(field) for field in MANIFEST_FIELDS} for entry in entries}
+
+def load_manifest(manifest_path):
+    """Returns the manifest saved by the previous run, or None if there is none (or it is unreadable)."""
+    if not manifest_path or not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        get_logger("manifest").warning(f"Manifiesto REM ilegible, se ignora: {e}")
+        return None
+
+def save_manifest(manifest_path, manifest):
+    """Writes the manifest (tmp file + replace, so a failed run never leaves it half written)."""
+    manifest_dir = os.path.dirname(manifest_path)
+    if manifest_dir and not os.path.exists(manifest_dir):
+        os.makedirs(manifest_dir)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+def diff_manifest(previous, current):
+    """
+    Compares two manifests by path. A file is 'changed' when its size or
+    mtime differs. Returns {'added': [...], 'changed': [...], 'removed': [...]} (paths).
+    """
+    previous = previous or {}
+    added = [path for path in current if path not in previous]
+    changed = [
+        path for path, info in current.items()
+        if path in previous
+        and (info['size'], info['mtime_ns']) != (previous[path].get('size'), previous[path].get('mtime_ns'))
+    ]
+    removed = [path for path in previous if path not in current]
+    return {'added': added, 'changed': changed, 'removed': removed}
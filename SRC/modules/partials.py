@@ -0,0 +1,128 @@
+import os
+import json
+import sqlite3
+from .cache import entry_fingerprint
+from .extraction import merge_requests, extract_rem
+from .logs import get_logger
+from config import PARTIALS_STORE
+
+def open_partials(store_path):
+    """
+    Opens (creating it if needed) the store of partial aggregates: the
+    contribution of every REM file (center, year, month) to each meta,
+    validated by the file fingerprint.
+    """
+    store_dir = os.path.dirname(store_path)
+    if store_dir and not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    # Las metas que corren en paralelo escriben en el mismo archivo
+    conn = sqlite3.connect(store_path, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS parciales (
+            meta TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            code TEXT,
+            year INTEGER,
+            month INTEGER,
+            valores TEXT NOT NULL,
+            PRIMARY KEY (meta, path)
+        )
+    """)
+    return conn
+
+def load_partials(conn, meta, entries):
+    """
+    Returns {path: valores} for the entries whose stored contribution to `meta`
+    was computed from the current version of the file (same size and mtime).
+    """
+    stored = {
+        path: (size, mtime_ns, valores)
+        for path, size, mtime_ns, valores in conn.execute(
+            "SELECT path, size, mtime_ns, valores FROM parciales WHERE meta = ?", (meta,)
+        )
+    }
+    partials = {}
+    for entry in entries:
+        file_path = entry['path']
+        if file_path not in stored:
+            continue
+        if 'size' not in entry and not os.path.exists(file_path):
+            continue
+        size, mtime_ns, valores = stored[file_path]
+        fingerprint = entry_fingerprint(entry)
+        if (size, mtime_ns) == (fingerprint['size'], fingerprint['mtime_ns']):
+            partials[file_path] = json.loads(valores)
+    return partials
+
+def store_partials(conn, meta, entry, valores):
+    """Stores the contribution of one REM file to `meta`, replacing older versions."""
+    fingerprint = entry_fingerprint(entry)
+    conn.execute(
+        "INSERT OR REPLACE INTO parciales VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            meta, entry['path'], fingerprint['size'], fingerprint['mtime_ns'],
+            entry.get('code'), entry.get('year'), entry.get('month'),
+            json.dumps(valores),
+        )
+    )
+
+def purge_partials(paths, store_path=PARTIALS_STORE):
+    """Drops the stored contributions (every meta) of REM files that were removed."""
+    if not paths or not store_path or not os.path.exists(store_path):
+        return
+    conn = open_partials(store_path)
+    try:
+        conn.executemany("DELETE FROM parciales WHERE path = ?", [(path,) for path in paths])
+        conn.commit()
+    finally:
+        conn.close()
+
+def pending_entries(meta, entries, store_path=PARTIALS_STORE):
+    """Entries whose contribution to `meta` is missing or outdated in the store."""
+    if not store_path or not os.path.exists(store_path):
+        return list(entries)
+    conn = open_partials(store_path)
+    try:
+        stored = load_partials(conn, meta, entries)
+    finally:
+        conn.close()
+    return [entry for entry in entries if entry['path'] not in stored]
+
+def file_contributions(meta, entries, requests, contributions, context, store_path=PARTIALS_STORE):
+    """
+    Returns {path: valores} with the contribution of every REM file in `entries`
+    to `meta`. contributions(rem, entries) computes them for all the extracted
+    files at once ({path: valores}), so a meta can stack its ranges across
+    files (modules.ranges). With context['incremental'], contributions stored for
+    files unchanged since the last run are reused and only new or changed
+    months are extracted. Every computed contribution is stored, so a full run
+    also prepares the next incremental one. Quarantined files are left out.
+    """
+    conn = open_partials(store_path) if store_path else None
+    try:
+        partials = {}
+        if conn is not None and context.get('incremental'):
+            partials = load_partials(conn, meta, entries)
+            get_logger(meta).info(f"{meta}: {len(partials)} archivos desde agregados parciales")
+        pending = []
+        seen = set(partials)
+        for entry in entries:
+            if entry['path'] not in seen:
+                seen.add(entry['path'])
+                pending.append(entry)
+
+        rem = extract_rem(pending, merge_requests(requests), context['rem'], context['quarantine'])
+        pending = [entry for entry in pending if entry['path'] in rem]
+        computed = contributions(rem, pending)
+        for entry in pending:
+            partials[entry['path']] = computed[entry['path']]
+            if conn is not None:
+                store_partials(conn, meta, entry, partials[entry['path']])
+        if conn is not None:
+            conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
+    return partials
@@ -0,0 +1,199 @@
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from .utils import normalize_path
+from .cache import file_fingerprint
+from .profiling import span, count, peak_rss_mb
+from .logs import get_logger
+from config import PIV_BATCH_SIZE
+
+log = get_logger("piv")
+
+# Columnas del PIV que usan los denominadores de las metas
+PIV_REQUIRED_COLUMNS = ['COD_CENTRO', 'EDAD_EN_FECHA_CORTE', 'ACEPTADO_RECHAZADO', 'GENERO', 'GENERO_NORMALIZADO']
+
+# Histograma precalculado junto al PIV (el prefijo evita que se confunda con un PIV)
+HIST_PREFIX = "HIST_"
+
+def find_piv_files(piv_dir="DATOS/PIV"):
+    """
+    Returns every PIV_*.parquet in piv_dir, sorted by name (oldest cut first).
+    """
+    abs_dir = normalize_path(piv_dir)
+    if not os.path.exists(abs_dir):
+        return []
+    piv_files = sorted(f for f in os.listdir(abs_dir) if f.startswith("PIV_") and f.endswith(".parquet"))
+    return [os.path.join(abs_dir, f) for f in piv_files]
+
+def find_latest_piv(piv_dir="DATOS/PIV"):
+    """
+    Returns the most recent PIV_*.parquet in piv_dir (by name), or None.
+    """
+    piv_files = find_piv_files(piv_dir)
+    return piv_files[-1] if piv_files else None
+
+def validate_piv_schema(piv_file):
+    """
+    Checks the PIV headers from the Parquet footer only (no data is read).
+    Raises ValueError when a required column is missing.
+    """
+    parquet_cols = set(pq.read_schema(piv_file).names)
+    expected_cols = set(PIV_REQUIRED_COLUMNS)
+    if not expected_cols.issubset(parquet_cols):
+        raise ValueError(f"El archivo PIV no es compatible por encabezados. Esperado: {expected_cols}, encontrado: {parquet_cols}")
+
+def iter_accepted_batches(piv_file, columns, batch_size=PIV_BATCH_SIZE):
+    """
+    Streams the ACEPTADO rows of a PIV file as record batches of at most
+    batch_size rows, reading only `columns` (ParquetFile.iter_batches). Each
+    batch can be released once folded, so memory depends on the batch size and
+    not on the size of the PIV.
+    """
+    read_columns = list(columns) + [name for name in ['ACEPTADO_RECHAZADO'] if name not in columns]
+    parquet = pq.ParquetFile(piv_file)
+    count('bytes_read', _column_bytes(piv_file, read_columns))
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=read_columns):
+        count('piv_rows', batch.num_rows)
+        count('piv_batches')
+        yield batch.filter(pc.equal(batch.column('ACEPTADO_RECHAZADO'), 'ACEPTADO'))
+
+def female_mask(batch):
+    """MUJER: GENERO contains MUJER or GENERO_NORMALIZADO contains FEMENINO (case-insensitive)."""
+    genero = pc.utf8_upper(pc.fill_null(batch.column('GENERO').cast(pa.string()), ''))
+    genero_norm = pc.utf8_upper(pc.fill_null(batch.column('GENERO_NORMALIZADO').cast(pa.string()), ''))
+    return pc.or_(pc.match_substring(genero, 'MUJER'), pc.match_substring(genero_norm, 'FEMENINO'))
+
+def fold_counts(total, partial, keys):
+    """
+    Adds a partial histogram (keys + N) to the running total (None at the start).
+    Both stay as small as the number of distinct keys, whatever the rows folded.
+    """
+    if total is not None:
+        partial = pa.concat_tables([total, partial])
+    summed = partial.group_by(keys).aggregate([('N', 'sum')])
+    return summed.rename_columns(['N' if name == 'N_sum' else name for name in summed.column_names])
+
+def count_rows(table, keys):
+    """Histogram (keys + N) of the rows of a table."""
+    hist = table.group_by(keys).aggregate([(keys[0], 'count', pc.CountOptions(mode='all'))])
+    return hist.rename_columns(['N' if name == keys[0] + '_count' else name for name in hist.column_names])
+
+def load_piv_histogram(piv_file, batch_size=PIV_BATCH_SIZE):
+    """
+    Aggregates the ACEPTADO population of a PIV file into counts by
+    (COD_CENTRO, EDAD_EN_FECHA_CORTE, MUJER) using Arrow compute.
+    Only the needed columns are read, batch by batch (iter_accepted_batches):
+    each batch is folded into the running counts and released. Missing ages are
+    counted as -1 and MUJER is true when GENERO contains MUJER or
+    GENERO_NORMALIZADO contains FEMENINO.
+    Returns a pyarrow Table with columns COD_CENTRO, EDAD_EN_FECHA_CORTE, MUJER, N.
+    """
+    validate_piv_schema(piv_file)
+    keys = ['COD_CENTRO', 'EDAD_EN_FECHA_CORTE', 'MUJER']
+    hist = None
+    with span('piv_read'):
+        for batch in iter_accepted_batches(piv_file, PIV_REQUIRED_COLUMNS, batch_size):
+            base = pa.table({
+                'COD_CENTRO': batch.column('COD_CENTRO'),
+                'EDAD_EN_FECHA_CORTE': pc.fill_null(batch.column('EDAD_EN_FECHA_CORTE').cast(pa.int64()), -1),
+                'MUJER': female_mask(batch),
+            })
+            hist = fold_counts(hist, count_rows(base, keys), keys)
+    if hist is None:
+        hist = pa.table({'COD_CENTRO': pa.array([], pa.string()), 'EDAD_EN_FECHA_CORTE': pa.array([], pa.int64()),
+                         'MUJER': pa.array([], pa.bool_()), 'N': pa.array([], pa.int64())})
+    log.info(f"Histograma PIV: {hist.num_rows} grupos, lotes de {batch_size} filas (RSS pico {peak_rss_mb()} MB)")
+    return hist
+
+def _column_bytes(piv_file, columns):
+    # Bytes comprimidos de las columnas leídas (según el pie del Parquet)
+    metadata = pq.ParquetFile(piv_file).metadata
+    total = 0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            if column.path_in_schema in columns:
+                total += column.total_compressed_size
+    return total
+
+def histogram_path(piv_file):
+    """Path of the histogram sidecar of a PIV file (same folder, HIST_ prefix)."""
+    piv_dir, name = os.path.split(piv_file)
+    return os.path.join(piv_dir, HIST_PREFIX + name)
+
+def _piv_key(piv_file):
+    fp = file_fingerprint(piv_file)
+    return f"{fp['size']}:{fp['mtime_ns']}".encode()
+
+def get_piv_histogram(piv_file):
+    """
+    Returns the population histogram of a PIV file (see load_piv_histogram).
+    The histogram is stored as a small Parquet next to the PIV, keyed by the PIV
+    fingerprint (size + mtime) in its schema metadata, so the full PIV is only
+    read again when the file changes.
+    """
+    key = _piv_key(piv_file)
+    sidecar = histogram_path(piv_file)
+    if os.path.exists(sidecar):
+        try:
+            metadata = pq.read_schema(sidecar).metadata or {}
+            if metadata.get(b'piv_fingerprint') == key:
+                count('piv_histogram_hits')
+                return pq.read_table(sidecar)
+        except (OSError, pa.ArrowInvalid) as e:
+            log.warning(f"Histograma PIV ilegible, se recalcula: {e}")
+
+    count('piv_histogram_misses')
+    hist = load_piv_histogram(piv_file)
+    hist = hist.replace_schema_metadata({
+        b'piv_fingerprint': key,
+        b'piv_file': os.path.basename(piv_file).encode(),
+    })
+    try:
+        tmp_path = sidecar + ".tmp"
+        pq.write_table(hist, tmp_path)
+        os.replace(tmp_path, sidecar)
+        log.info(f"Histograma PIV generado: {sidecar}")
+    except OSError as e:
+        log.warning(f"No se pudo guardar el histograma PIV ({e}); se usa en memoria.")
+    return hist
+
+def _age_mask(hist, min_age=None, max_age=None):
+    edad = hist['EDAD_EN_FECHA_CORTE']
+    mask = pc.is_valid(edad) # ages are never null here: all-true starting mask
+    if min_age is not None:
+        mask = pc.and_(mask, pc.greater_equal(edad, min_age))
+    if max_age is not None:
+        mask = pc.and_(mask, pc.less_equal(edad, max_age))
+    return mask
+
+def count_by_center(hist, min_age=None, max_age=None, female_only=False):
+    """
+    Population by center within [min_age, max_age] (inclusive, None = open).
+    Only centers with at least one matching person are returned.
+    Returns {cod_centro: count}.
+    """
+    mask = _age_mask(hist, min_age, max_age)
+    if female_only:
+        mask = pc.and_(mask, hist['MUJER'])
+    sums = hist.filter(mask).group_by('COD_CENTRO').aggregate([('N', 'sum')])
+    return dict(zip(sums['COD_CENTRO'].to_pylist(), sums['N_sum'].to_pylist()))
+
+def weighted_by_center(hist, bands):
+    """
+    Estimated population by center applying prevalence factors by age band.
+    bands: [(min_age, max_age or None, factor), ...]; overlapping bands add up.
+    Every center of the histogram is returned (0.0 when no band applies).
+    Returns {cod_centro: float}.
+    """
+    weight = pa.array([0.0] * hist.num_rows, type=pa.float64())
+    for min_age, max_age, factor in bands:
+        weight = pc.add(weight, pc.if_else(_age_mask(hist, min_age, max_age), factor, 0.0))
+    weighted = pa.table({
+        'COD_CENTRO': hist['COD_CENTRO'],
+        'W': pc.multiply(hist['N'].cast(pa.float64()), weight),
+    })
+    sums = weighted.group_by('COD_CENTRO').aggregate([('W', 'sum')])
+    return dict(zip(sums['COD_CENTRO'].to_pylist(), sums['W_sum'].to_pylist()))
@@ -0,0 +1,247 @@
+import os
+import glob
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+from .ages import age_in_years
+from .profiling import span, count
+from .logs import get_logger
+
+log = get_logger("piv_builder")
+
+# Esquema del PIV (17 columnas, ver DATOS/PIV/mapping_piv_metas.log)
+PIV_SCHEMA = pa.schema([
+    ('RUN', pa.string()),
+    ('DV', pa.string()),
+    ('FECHA_NACIMIENTO', pa.timestamp('us')),
+    ('FECHA_CORTE', pa.timestamp('us')),
+    ('NOMBRE_CENTRO', pa.string()),
+    ('COD_CENTRO', pa.string()),
+    ('ACEPTADO_RECHAZADO', pa.string()),
+    ('GENERO', pa.string()),
+    ('TRAMO', pa.string()),
+    ('source_file', pa.string()),
+    ('anio', pa.int32()),
+    ('mes', pa.int32()),
+    ('ID_PCTE', pa.string()),
+    ('DSM_TCO', pa.string()),
+    ('GENERO_NORMALIZADO', pa.string()),
+    ('EDAD_EN_FECHA_CORTE', pa.int32()),
+    ('GRUPO_ETARIO', pa.string()),
+])
+
+# Columnas de cada Detalle_<centro>.txt (encabezado en la primera línea); DSM_TCO es opcional
+SOURCE_COLUMNS = ['RUN', 'DV', 'FECHA_NACIMIENTO', 'FECHA_CORTE', 'NOMBRE_CENTRO', 'COD_CENTRO',
+                  'ACEPTADO_RECHAZADO', 'GENERO', 'TRAMO']
+OPTIONAL_SOURCE_COLUMNS = ['DSM_TCO']
+DATE_COLUMNS = ['FECHA_NACIMIENTO', 'FECHA_CORTE']
+DATE_FORMATS = [pv.ISO8601, "%d-%m-%Y", "%d/%m/%Y", "%Y/%m/%d", "%d-%m-%Y %H:%M:%S", "%d/%m/%Y %H:%M:%S"]
+DELIMITERS = [';', '|', '\t', ',']
+
+# Columnas de pocos valores distintos: diccionario en el Parquet (RUN e ID_PCTE van sin diccionario)
+DICTIONARY_COLUMNS = ['NOMBRE_CENTRO', 'COD_CENTRO', 'ACEPTADO_RECHAZADO', 'GENERO', 'TRAMO', 'source_file',
+                      'DSM_TCO', 'GENERO_NORMALIZADO', 'GRUPO_ETARIO']
+
+# Grupos etarios del PIV: límites inferiores y etiquetas (edad desconocida = Sin Información)
+AGE_GROUP_LIMITS = [1] + list(range(5, 85, 5))
+AGE_GROUP_LABELS = (["Menos de 1 año", "1 - 4 años"]
+                    + [f"{edad} - {edad + 4} años" for edad in range(5, 80, 5)]
+                    + ["80 y mas años", "Sin Información"])
+
+GENDER_VALUES = {'MUJER': 'FEMENINO', 'FEMENINO': 'FEMENINO', 'F': 'FEMENINO',
+                 'HOMBRE': 'MASCULINO', 'MASCULINO': 'MASCULINO', 'M': 'MASCULINO'}
+
+# Bloque de lectura de cada extracto y tamaño máximo de los grupos de filas del PIV
+BLOCK_SIZE = 16 * 1024 * 1024
+ROW_GROUP_SIZE = 128 * 1024
+
+def sniff_source(source_path):
+    """
+    Delimiter, encoding and normalized header (stripped, upper case) of a
+    Detalle extract, from its first line. The encoding is UTF-8 when the start
+    of the file decodes as UTF-8, otherwise latin-1.
+    """
+    with open(source_path, 'rb') as f:
+        head = f.read(64 * 1024)
+    if head.startswith(b'\xef\xbb\xbf'):
+        encoding = 'utf-8-sig'
+    else:
+        try:
+            head.decode('utf-8')
+            encoding = 'utf8'
+        except UnicodeDecodeError as e:
+            # Un carácter multibyte cortado al final del bloque no cuenta como error
+            encoding = 'utf8' if e.start >= len(head) - 3 else 'latin-1'
+    first_line = head.split(b'\n', 1)[0].decode('utf-8' if encoding != 'latin-1' else 'latin-1', errors='replace')
+    first_line = first_line.lstrip('\ufeff').rstrip('\r')
+    delimiter = max(DELIMITERS, key=first_line.count)
+    header = [name.strip().strip('"').upper() for name in first_line.split(delimiter)]
+    return delimiter, encoding, header
+
+def open_source(source_path, block_size=BLOCK_SIZE):
+    """
+    Streaming reader (pyarrow.csv.open_csv) over a Detalle extract: record
+    batches of about block_size bytes with the SOURCE_COLUMNS as strings and the
+    dates parsed. Raises ValueError when a required column is missing.
+    """
+    delimiter, encoding, header = sniff_source(source_path)
+    missing = [name for name in SOURCE_COLUMNS if name not in header]
+    if missing:
+        raise ValueError(f"{os.path.basename(source_path)}: faltan columnas {missing} (encabezado: {header})")
+    columns = SOURCE_COLUMNS + [name for name in OPTIONAL_SOURCE_COLUMNS if name in header]
+    column_types = {name: pa.string() for name in columns}
+    column_types.update({name: pa.timestamp('us') for name in DATE_COLUMNS})
+    return pv.open_csv(
+        source_path,
+        read_options=pv.ReadOptions(column_names=header, skip_rows=1, encoding=encoding, block_size=block_size),
+        parse_options=pv.ParseOptions(delimiter=delimiter),
+        convert_options=pv.ConvertOptions(
+            include_columns=columns,
+            column_types=column_types,
+            timestamp_parsers=DATE_FORMATS,
+            strings_can_be_null=True,
+        ),
+    )
+
+def _clean(values):
+    return pc.utf8_trim_whitespace(values)
+
+def age_group(age):
+    """GRUPO_ETARIO label of each age (AGE_GROUP_LABELS; missing ages are 'Sin Información')."""
+    ages = pc.fill_null(age, -1).to_numpy(zero_copy_only=False)
+    index = np.where(ages < 0, len(AGE_GROUP_LABELS) - 1, np.digitize(ages, AGE_GROUP_LIMITS))
+    return pa.array(AGE_GROUP_LABELS, pa.string()).take(pa.array(index))
+
+def normalized_gender(gender):
+    """GENERO_NORMALIZADO: FEMENINO / MASCULINO from the GENERO codes (other values are null)."""
+    keys = pa.array(list(GENDER_VALUES), pa.string())
+    values = pa.array(list(GENDER_VALUES.values()), pa.string())
+    return values.take(pc.index_in(pc.utf8_upper(gender), value_set=keys))
+
+def derive_batch(batch, source_file):
+    """PIV rows (PIV_SCHEMA) of one record batch of a Detalle extract, derived column-wise."""
+    n = batch.num_rows
+    run = _clean(batch.column('RUN'))
+    dv = pc.utf8_upper(_clean(batch.column('DV')))
+    gender = _clean(batch.column('GENERO'))
+    birth = batch.column('FECHA_NACIMIENTO')
+    cut = batch.column('FECHA_CORTE')
+    age = age_in_years(birth, cut)
+    names = batch.schema.names
+    return pa.Table.from_arrays([
+        run,
+        dv,
+        birth,
+        cut,
+        _clean(batch.column('NOMBRE_CENTRO')),
+        _clean(batch.column('COD_CENTRO')),
+        pc.utf8_upper(_clean(batch.column('ACEPTADO_RECHAZADO'))),
+        gender,
+        _clean(batch.column('TRAMO')),
+        pa.array([source_file] * n, pa.string()),
+        pc.year(cut).cast(pa.int32()),
+        pc.month(cut).cast(pa.int32()),
+        pc.binary_join_element_wise(run, dv, ''),
+        _clean(batch.column('DSM_TCO')) if 'DSM_TCO' in names else pa.nulls(n, pa.string()),
+        normalized_gender(gender),
+        age,
+        age_group(age),
+    ], schema=PIV_SCHEMA)
+
+def _center_runs(table):
+    # Tramos de filas consecutivas con el mismo COD_CENTRO de una tabla ordenada por centro: [(centro, inicio, largo)]
+    runs = pc.run_end_encode(table.column('COD_CENTRO').combine_chunks())
+    run_ends = runs.run_ends.to_pylist()
+    return [(center, start, end - start) for center, start, end in zip(runs.values.to_pylist(), [0] + run_ends[:-1], run_ends)]
+
+def _spill_source(source_path, spill_path, block_size):
+    # Un extracto completo, bloque a bloque, a un Parquet temporal (la memoria no depende del tamaño del archivo).
+    # Cada bloque se ordena por centro y cada centro va en su propio grupo de filas (se devuelve el centro
+    # de cada grupo), de modo que la escritura final lee cada centro sin recorrer los demás
+    source_file = os.path.basename(source_path)
+    rows = 0
+    row_group_centers = []
+    last_cut = None
+    count('files_opened')
+    count('bytes_read', os.path.getsize(source_path))
+    with span('piv_source'):
+        reader = open_source(source_path, block_size)
+        with pq.ParquetWriter(spill_path, PIV_SCHEMA) as writer:
+            for batch in reader:
+                table = derive_batch(batch, source_file)
+                table = table.take(pc.sort_indices(table, [('COD_CENTRO', 'ascending')]))
+                for center, start, length in _center_runs(table):
+                    writer.write_table(table.slice(start, length), row_group_size=length)
+                    row_group_centers.append(center)
+                rows += table.num_rows
+                batch_cut = pc.max(table.column('FECHA_CORTE')).as_py()
+                if batch_cut is not None and (last_cut is None or batch_cut > last_cut):
+                    last_cut = batch_cut
+    log.debug(f"Extracto {source_file}: {rows} filas")
+    return rows, last_cut, row_group_centers
+
+def find_sources(source_dir, pattern="Detalle_*.txt"):
+    """Detalle extracts of a folder, sorted by name."""
+    return sorted(glob.glob(os.path.join(source_dir, pattern)))
+
+def build_piv(sources, output_dir, output_path=None, workers=4, block_size=BLOCK_SIZE):
+    """
+    Builds the PIV Parquet from FONASA Detalle_<centro>.txt extracts (delimited
+    text with a header line, see SOURCE_COLUMNS):
+    - each extract is streamed in blocks with pyarrow.csv, `workers` extracts
+      at a time, and its derived rows (ID_PCTE, anio, mes, GENERO_NORMALIZADO,
+      EDAD_EN_FECHA_CORTE, GRUPO_ETARIO) are spilled to a temporary Parquet;
+    - every spilled block is sorted by center with one row group per center,
+      so the PIV is then written center by center reading each spilled row
+      group once (one pass over the rows): every row group of the PIV holds a
+      single COD_CENTRO (centers in ascending order), so readers filtering by
+      center skip the others from the row-group statistics; low-cardinality
+      columns are dictionary-encoded.
+    The default output is <output_dir>/PIV_<year>_<month>_DETALLE.parquet (latest
+    FECHA_CORTE). Returns (output path, number of rows).
+    """
+    if not sources:
+        raise ValueError("No hay extractos Detalle_*.txt para construir el PIV")
+    spill_dir = tempfile.mkdtemp(prefix=".piv_", dir=output_dir)
+    try:
+        spill_paths = [os.path.join(spill_dir, f"{i:05d}.parquet") for i in range(len(sources))]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            results = list(pool.map(lambda args: _spill_source(*args, block_size), zip(sources, spill_paths)))
+        rows = sum(n for n, _, _ in results)
+        cuts = [cut for _, cut, _ in results if cut is not None]
+        if output_path is None:
+            cut = max(cuts) if cuts else None
+            suffix = f"{cut.year}_{cut.month:02d}" if cut else "SIN_FECHA"
+            output_path = os.path.join(output_dir, f"PIV_{suffix}_DETALLE.parquet")
+
+        # {COD_CENTRO o None: [(archivo temporal, [grupos de filas])]}
+        groups = {}
+        for path, (_, _, row_group_centers) in zip(spill_paths, results):
+            by_center = {}
+            for i, center in enumerate(row_group_centers):
+                by_center.setdefault(center, []).append(i)
+            for center, row_groups in by_center.items():
+                groups.setdefault(center, []).append((path, row_groups))
+        footers = {path: pq.read_metadata(path) for path in spill_paths}
+        centers = sorted(center for center in groups if center is not None)
+        tmp_path = os.path.join(output_dir, "." + os.path.basename(output_path) + ".tmp")
+        with span('piv_write'):
+            with pq.ParquetWriter(tmp_path, PIV_SCHEMA, compression='zstd',
+                                  use_dictionary=DICTIONARY_COLUMNS, write_statistics=True) as writer:
+                for center in centers + ([None] if None in groups else []):
+                    table = pa.concat_tables([pq.ParquetFile(path, metadata=footers[path]).read_row_groups(row_groups)
+                                              for path, row_groups in groups[center]])
+                    if center is None:
+                        log.warning(f"{table.num_rows} filas sin COD_CENTRO (quedan al final del PIV)")
+                    writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+        os.replace(tmp_path, output_path)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    count('piv_built_rows', rows)
+    log.info(f"PIV construido: {output_path} ({rows} filas, {len(centers)} centros, {len(sources)} extractos)")
+    return output_path, rows
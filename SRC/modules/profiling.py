@@ -0,0 +1,140 @@
+import sys
+import json
+import time
+import pstats
+import cProfile
+import contextlib
+from datetime import datetime
+from .logs import get_logger, flush_logs
+
+try:
+    import resource
+except ImportError:
+    # Windows: sin getrusage, el pico de memoria se toma de psutil si está instalado (si no, None)
+    resource = None
+
+# Mediciones del proceso: {span: [veces, segundos]} y {contador: valor}
+_spans = {}
+_counters = {}
+
+@contextlib.contextmanager
+def span(name):
+    """Times a block under `name` (accumulated: calls and total seconds)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = _spans.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += time.perf_counter() - start
+
+def count(name, n=1):
+    """Adds n to a run counter (files opened, rows iterated, cache hits, ...)."""
+    _counters[name] = _counters.get(name, 0) + n
+
+def take():
+    """Returns and resets the measurements of this process: {'spans', 'counters'}."""
+    global _spans, _counters
+    snapshot = {'spans': _spans, 'counters': _counters}
+    _spans, _counters = {}, {}
+    return snapshot
+
+def merge(snapshot):
+    """Adds the measurements of another process (see profiled_call) to this one."""
+    for name, (calls, seconds) in snapshot['spans'].items():
+        entry = _spans.setdefault(name, [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+    for name, value in snapshot['counters'].items():
+        count(name, value)
+
+def profiled_call(name, func, *args):
+    """
+    Runs func(*args) in a worker process inside span(name) (no span when name is
+    None) and returns (result, measurements of the call) so the parent can merge
+    them. The counters inherited from the parent when the worker was forked are
+    discarded first, and the log records of the call are written before it returns.
+    """
+    take()
+    try:
+        if name is None:
+            result = func(*args)
+        else:
+            with span(name):
+                result = func(*args)
+    finally:
+        flush_logs()
+    return result, take()
+
+def peak_rss_mb():
+    """
+    Peak resident memory (MB) of this process and its finished child processes,
+    or None. This is the high-water mark since the process started.
+    """
+    if resource is None:
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+        except (ImportError, AttributeError):
+            return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux informa KB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def report(**extra):
+    """Profile of the run so far: spans (calls, seconds), counters and peak memory, plus `extra` fields."""
+    return dict(
+        extra,
+        generated=datetime.now().isoformat(timespec='seconds'),
+        peak_rss_mb=peak_rss_mb(),
+        spans={
+            name: {'calls': calls, 'seconds': round(seconds, 4)}
+            for name, (calls, seconds) in sorted(_spans.items(), key=lambda item: -item[1][1])
+        },
+        counters=dict(sorted(_counters.items())),
+    )
+
+def write_profile(profile_path, **extra):
+    """Writes report(**extra) as JSON."""
+    with open(profile_path, 'w', encoding='utf-8') as f:
+        json.dump(report(**extra), f, ensure_ascii=False, indent=2)
+    return profile_path
+
+@contextlib.contextmanager
+def profiler(mode, output_base):
+    """
+    Optional whole-run profiler of this process (METAS_PROFILE):
+    - 'cprofile': writes <output_base>.prof (pstats) and <output_base>.txt
+      (top functions by cumulative time);
+    - 'pyinstrument': writes <output_base>.html (needs pyinstrument installed).
+    Any other value runs without profiler. Worker processes are not profiled.
+    """
+    if mode == 'cprofile':
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            prof.dump_stats(output_base + ".prof")
+            with open(output_base + ".txt", 'w', encoding='utf-8') as f:
+                pstats.Stats(prof, stream=f).sort_stats('cumulative').print_stats(40)
+            get_logger("profiling").info(f"Perfil cProfile: {output_base}.prof")
+    elif mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            get_logger("profiling").warning("METAS_PROFILE=pyinstrument requiere el paquete pyinstrument; se ejecuta sin perfilador.")
+            yield
+            return
+        prof = Profiler()
+        prof.start()
+        try:
+            yield
+        finally:
+            prof.stop()
+            with open(output_base + ".html", 'w', encoding='utf-8') as f:
+                f.write(prof.output_html())
+            get_logger("profiling").info(f"Perfil pyinstrument: {output_base}.html")
+    else:
+        yield
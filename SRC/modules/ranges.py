@@ -0,0 +1,96 @@
+from itertools import chain
+import numpy as np
+from openpyxl.utils.cell import range_boundaries, get_column_letter
+
+def range_coordinates(cell_range):
+    """Coordinates of a rectangular range ('J23:M28'), row by row."""
+    min_col, min_row, max_col, max_row = range_boundaries(cell_range)
+    return [
+        f"{get_column_letter(col)}{row}"
+        for row in range(min_row, max_row + 1)
+        for col in range(min_col, max_col + 1)
+    ]
+
+def range_shape(cell_range):
+    """(rows, cols) of a rectangular range."""
+    min_col, min_row, max_col, max_row = range_boundaries(cell_range)
+    return max_row - min_row + 1, max_col - min_col + 1
+
+def _text_number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return 0.0
+
+def to_array(values, shape=None, numeric_text=False):
+    """
+    float64 NumPy array of cell values: int and float cells as-is, empty,
+    boolean and text cells as 0. Cells are classified by their exact type
+    (a typed mask, no Python callback per cell) and the numbers converted with
+    a single cast. numeric_text=True also reads numbers typed as text ('12').
+    """
+    values = np.fromiter(values, dtype=object)
+    types = np.fromiter(map(type, values), dtype=object, count=len(values))
+    result = np.zeros(len(values))
+    numeric = (types == int) | (types == float)
+    result[numeric] = values[numeric].astype(np.float64)
+    if numeric_text:
+        for i in np.flatnonzero(types == str):
+            result[i] = _text_number(values[i])
+    return result.reshape(shape) if shape is not None else result
+
+def range_array(cells, cell_range):
+    """2-D float64 array (rows x cols) of a range from extracted cells {coord: value}."""
+    return to_array([cells.get(coord) for coord in range_coordinates(cell_range)], range_shape(cell_range))
+
+def _rows_array(selected, first_col, last_col, numeric_text):
+    if last_col is None:
+        last_col = max([len(row) for row in selected] + [first_col]) - 1
+    width = max(last_col - first_col + 1, 0)
+    if not selected:
+        return np.zeros((0, width))
+    sliced = (tuple(row[first_col:last_col + 1]) for row in selected)
+    padded = chain.from_iterable(row + (None,) * (width - len(row)) for row in sliced)
+    return to_array(padded, (len(selected), width), numeric_text)
+
+def row_block(rows, row_numbers, first_col=0, last_col=None, numeric_text=False):
+    """
+    2-D float64 array with the given rows (1-based, as in label_rows) of an
+    extracted sheet, from column index first_col to last_col (0-based,
+    inclusive; None = end of the widest row). Short rows are padded with 0.
+    """
+    return _rows_array([rows[r - 1] for r in row_numbers], first_col, last_col, numeric_text)
+
+def stack_rows(rem, sheet, row_numbers, first_col=0, last_col=None, numeric_text=False):
+    """
+    Stacks label-located rows of one sheet across REM files into a single 2-D
+    float64 array (see row_block). row_numbers is {path: [rows]}; returns the
+    array and, for each of its rows, the position of its file in row_numbers
+    (for sum_by_file).
+    """
+    selected = []
+    owners = []
+    for position, (path, numbers) in enumerate(row_numbers.items()):
+        rows = rem[path][sheet]['rows']
+        selected += [rows[r - 1] for r in numbers]
+        owners += [position] * len(numbers)
+    return _rows_array(selected, first_col, last_col, numeric_text), np.array(owners, dtype=np.intp)
+
+def sum_by_file(values, owners, n_files):
+    """Per-file totals of per-row values of a stack_rows array."""
+    return np.bincount(owners, weights=values, minlength=n_files)
+
+def stack_ranges(rem, entries, sheet, cell_range):
+    """
+    Stacks one range across REM files: (files x rows x cols) float64 array,
+    plus the entries in the same order (files without the sheet are left out).
+    """
+    found = [entry for entry in entries if entry['path'] in rem and sheet in rem[entry['path']]]
+    if not found:
+        return np.zeros((0,) + range_shape(cell_range)), found
+    return np.stack([rem[entry['path']][sheet]['ranges'][cell_range] for entry in found]), found
+
+def as_count(value):
+    """Plain Python number of an array sum: int when integral (REM counts), float otherwise."""
+    value = float(value)
+    return int(value) if value.is_integer() else value
@@ -0,0 +1,122 @@
+import os
+import csv
+import numpy as np
+import pyarrow as pa
+from .utils import normalize_path
+from .ranges import as_count
+from .logs import get_logger
+
+log = get_logger("results")
+
+# Resultado de una meta: una fila por centro e indicador
+RESULT_SCHEMA = pa.schema([
+    ('Centro', pa.string()),
+    ('Meta_ID', pa.string()),
+    ('Indicador', pa.string()),
+    ('Numerador', pa.float64()),
+    ('Denominador', pa.float64()),
+    ('Cumplimiento', pa.float64()),
+    ('Meta_Fijada', pa.float64()),
+    ('Meta_Nacional', pa.float64()),
+])
+
+# Consolidado: columnas de la hoja Consolidado del Excel de rendimiento, en orden
+CONSOLIDATED_SCHEMA = pa.schema([
+    ('Fecha_Corte', pa.string()),
+    ('Meta_ID', pa.string()),
+    ('Nombre_Indicador', pa.string()),
+    ('COD_CENTRO', pa.string()),
+    ('Nombre_Centro', pa.string()),
+    ('Numerador_Actual', pa.float64()),
+    ('Denominador_Actual', pa.float64()),
+    ('Cumplimiento_Actual_%', pa.float64()),
+    ('Meta_Fijada_%', pa.float64()),
+    ('Meta_Nacional_%', pa.float64()),
+    ('Brecha_vs_Fijada_%', pa.float64()),
+    ('Brecha_vs_Nacional_%', pa.float64()),
+    ('Casos_Faltantes_Meta_Fijada', pa.float64()),
+    ('Estado', pa.string()),
+])
+
+def results_table(rows):
+    """Typed Arrow table (RESULT_SCHEMA) of the per-center rows computed by a meta."""
+    return pa.Table.from_pylist(
+        [dict(row, Centro=str(row['Centro'])) for row in rows],
+        schema=RESULT_SCHEMA,
+    )
+
+def concat_results(tables):
+    """Concatenates meta result tables (None entries, metas without result, are skipped)."""
+    tables = [table for table in tables if table is not None]
+    if not tables:
+        return RESULT_SCHEMA.empty_table()
+    return pa.concat_tables(tables)
+
+def center_name_lookup(centers, center_names):
+    """
+    Names of an array of center codes. A code not found is retried without its
+    trailing series letter ('121460A' -> '121460'); otherwise 'Desconocido'.
+    Each distinct code is looked up once.
+    """
+    unique, inverse = np.unique(np.asarray(centers, dtype=object).astype(str), return_inverse=True)
+    names = []
+    for code in unique:
+        name = center_names.get(code, 'Desconocido')
+        if name == 'Desconocido' and code and code[-1].isalpha():
+            name = center_names.get(code[:-1], 'Desconocido')
+        names.append(name)
+    return np.asarray(names, dtype=object)[inverse] if len(unique) else np.asarray([], dtype=object)
+
+def consolidate(results, center_names, cut_date):
+    """
+    Consolidated table (CONSOLIDATED_SCHEMA) of the meta results, computed over
+    whole columns: gaps against the fixed and national goals, cases missing to
+    reach the fixed goal and status (Cumplido / Pendiente).
+    """
+    num = results.column('Numerador').to_numpy(zero_copy_only=False)
+    den = results.column('Denominador').to_numpy(zero_copy_only=False)
+    cump = results.column('Cumplimiento').to_numpy(zero_copy_only=False)
+    fijada = results.column('Meta_Fijada').to_numpy(zero_copy_only=False)
+    nacional = results.column('Meta_Nacional').to_numpy(zero_copy_only=False)
+    centers = results.column('Centro').to_pylist()
+
+    faltantes = np.maximum(0, den * (fijada / 100.0) - num)
+    return pa.Table.from_arrays([
+        pa.array([cut_date] * results.num_rows, pa.string()),
+        results.column('Meta_ID'),
+        results.column('Indicador'),
+        results.column('Centro'),
+        pa.array(center_name_lookup(centers, center_names), pa.string()),
+        pa.array(num),
+        pa.array(den),
+        pa.array(np.round(cump, 2)),
+        pa.array(fijada),
+        pa.array(nacional),
+        pa.array(np.round(fijada - cump, 2)),
+        pa.array(np.round(nacional - cump, 2)),
+        pa.array(np.round(faltantes, 0)),
+        pa.array(np.where(cump >= fijada, 'Cumplido', 'Pendiente'), pa.string()),
+    ], schema=CONSOLIDATED_SCHEMA)
+
+def export_csv(results, meta):
+    """
+    Optional CSV export of a meta result (DATOS/reporte_<meta>_preliminar.csv,
+    RESULT_SCHEMA columns; counts written as integers). Returns the path, or
+    None when the meta has no result or the file cannot be written.
+    """
+    if results is None:
+        return None
+    output_path = os.path.join(normalize_path("DATOS"), f"reporte_{meta}_preliminar.csv")
+    try:
+        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_SCHEMA.names)
+            writer.writeheader()
+            for row in results.to_pylist():
+                row['Numerador'] = as_count(row['Numerador'])
+                row['Denominador'] = as_count(row['Denominador'])
+                writer.writerow(row)
+        log.info(f"Reporte guardado en {output_path}")
+    except OSError as e:
+        log.error(f"Error escribiendo reporte: {e}")
+        return None
+    return output_path
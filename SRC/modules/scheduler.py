@@ -0,0 +1,68 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from .profiling import span, profiled_call, merge
+
+def run_dag(nodes, context, max_workers=1, share=None):
+    """
+    Runs a DAG of run steps against a shared context.
+    nodes: {name: {'func': callable(context), 'deps': [names], 'stage': bool}}
+    Stage nodes (REM listings, PIV histogram, extraction) run in this process in
+    dependency order and fill the context. The other nodes are independent
+    computations: as soon as their dependencies are done they are submitted to a
+    ProcessPoolExecutor with max_workers processes (max_workers <= 1 runs
+    everything here, one after another).
+    share(context), when given, returns the context sent to the worker processes
+    (e.g. modules.shared.ContextPublisher.snapshot, which replaces the large
+    entries by memory-mapped files); it is called when nodes are submitted, so
+    it sees every stage finished so far.
+    Every node is timed as a profiling span under its name (worker measurements
+    are merged back into this process).
+    Yields (name, result) as each node finishes. The first failure stops the run:
+    nodes not yet started are cancelled and the exception is raised.
+    """
+    for name, node in nodes.items():
+        unknown = [dep for dep in node.get('deps', []) if dep not in nodes]
+        if unknown:
+            raise ValueError(f"Nodo {name} depende de nodos inexistentes: {unknown}")
+
+    pending = dict(nodes)
+    running = {}
+    done = set()
+    pool = ProcessPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+    try:
+        while pending or running:
+            ready = [name for name, node in pending.items() if all(dep in done for dep in node.get('deps', []))]
+            if not ready and not running:
+                raise ValueError(f"Dependencias circulares entre: {sorted(pending)}")
+
+            local = []
+            worker_context = None
+            for name in ready:
+                node = pending.pop(name)
+                if pool is None or node.get('stage'):
+                    local.append((name, node))
+                else:
+                    if worker_context is None:
+                        worker_context = share(context) if share is not None else context
+                    running[pool.submit(profiled_call, name, node['func'], worker_context)] = name
+
+            # Las etapas locales corren mientras los procesos ya enviados avanzan
+            if local:
+                name, node = local[0]
+                for other, other_node in local[1:]:
+                    pending[other] = other_node
+                with span(name):
+                    result = node['func'](context)
+                done.add(name)
+                yield name, result
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                result, measurements = future.result()
+                merge(measurements)
+                done.add(name)
+                yield name, result
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,362 @@
+import os
+import shutil
+import tempfile
+import contextlib
+from collections.abc import Mapping, MutableMapping, Sequence
+from itertools import chain
+import numpy as np
+import pyarrow as pa
+from .ranges import range_array
+from .cube import encode_value, decode_value, KIND_INT, KIND_FLOAT
+from .profiling import span, count
+
+# Extracción REM en dos tablas largas por segmento (ruta, hoja y clave van como diccionario):
+# - partes: marcas de archivo y hoja, celdas sueltas, etiquetas, rangos y filas de ancho distinto al de la hoja;
+# - valores: los valores no vacíos de las filas de cada hoja, ordenados por fila y columna; los procesos de
+#   trabajo los leen mapeados en memoria y decodifican solo las filas que consultan (SharedRows).
+REM_PARTS_SCHEMA = pa.schema([
+    ('path', pa.dictionary(pa.int32(), pa.string())),
+    ('sheet', pa.dictionary(pa.int32(), pa.string())),
+    ('part', pa.int8()),
+    ('row', pa.int32()),
+    ('col', pa.int32()),
+    ('key', pa.dictionary(pa.int32(), pa.string())),
+    ('kind', pa.int8()),
+    ('num', pa.float64()),
+    ('text', pa.string()),
+])
+REM_VALUES_SCHEMA = pa.schema([
+    ('sheet', pa.dictionary(pa.int32(), pa.string())),
+    ('row', pa.int32()),
+    ('col', pa.int32()),
+    ('kind', pa.int8()),
+    ('num', pa.float64()),
+    ('text', pa.string()),
+])
+
+# part: qué parte del resultado de extract_workbook guarda la fila
+PART_FILE, PART_SHEET, PART_CELL, PART_WIDTH, PART_LABEL, PART_RANGE = range(6)
+# kind, num y text: el valor codificado como en el cubo REM (cube.encode_value)
+
+def write_shared_table(table, path):
+    """Writes a table as an uncompressed Arrow IPC file, so readers can memory-map it."""
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    count('shared_bytes_written', os.path.getsize(path))
+    return path
+
+def read_shared_table(path):
+    """Memory-maps an Arrow IPC file written by write_shared_table: no copy, no unpickling."""
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+def _encode_values(values):
+    # Valores no vacíos de una hoja -> (kind, num, text); enteros y decimales (el caso común) se
+    # convierten con Arrow con el tipo indicado, sin inferencia ni recorrido en Python
+    values = values.tolist()
+    types = set(map(type, values))
+    if types and types <= {int, float}:
+        try:
+            nums = pa.array(values, pa.float64())
+        except (pa.ArrowInvalid, OverflowError):
+            nums = None
+        if nums is not None:
+            if types == {int}:
+                kinds = np.full(len(values), KIND_INT, np.int8)
+            elif types == {float}:
+                kinds = np.full(len(values), KIND_FLOAT, np.int8)
+            else:
+                kinds = np.where(np.fromiter(map(type, values), dtype=object, count=len(values)) == int, KIND_INT, KIND_FLOAT).astype(np.int8)
+            return pa.array(kinds), nums, pa.nulls(len(values), pa.string())
+    kinds, nums, texts = zip(*map(encode_value, values)) if values else ((), (), ())
+    return pa.array(kinds, pa.int8()), pa.array(nums, pa.float64()), pa.array(texts, pa.string())
+
+def _dictionary_table(columns, schema):
+    return pa.table({name: pa.array(values, schema.field(name).type.value_type).dictionary_encode()
+                     if pa.types.is_dictionary(schema.field(name).type) else values
+                     for name, values in columns.items()}, schema=schema)
+
+def rem_tables(rem, paths):
+    """
+    Long Arrow tables (REM_PARTS_SCHEMA, REM_VALUES_SCHEMA) of the extraction
+    results of `paths` ({path: extract_workbook(...)}), one path after another.
+    Returns (parts, values, {path: (parts start, parts end, values start, values end)}).
+    """
+    columns = {name: [] for name in REM_PARTS_SCHEMA.names}
+
+    def add(path, sheet, part, row=None, col=None, key=None, value=None):
+        kind, num, text = encode_value(value)
+        for name, item in zip(REM_PARTS_SCHEMA.names, (path, sheet, part, row, col, key, kind, num, text)):
+            columns[name].append(item)
+
+    values = []
+    n_values = 0
+    index = {}
+    for path in paths:
+        start, values_start = len(columns['path']), n_values
+        add(path, None, PART_FILE)
+        for sheet, data in rem[path].items():
+            rows = data['rows']
+            # Ancho de fila de la hoja; solo las filas de otro ancho llevan su propia marca
+            width = max((len(row) for row in rows), default=0)
+            add(path, sheet, PART_SHEET, row=len(rows), col=width)
+            for coord, value in data['cells'].items():
+                add(path, sheet, PART_CELL, key=coord, value=value)
+            for row_number, row in enumerate(rows, start=1):
+                if len(row) != width:
+                    add(path, sheet, PART_WIDTH, row=row_number, col=len(row))
+            # Todas las filas como un solo arreglo (las cortas se completan con None) y sus valores no vacíos
+            padded = (row if len(row) == width else tuple(row) + (None,) * (width - len(row)) for row in rows)
+            grid = np.fromiter(chain.from_iterable(padded), dtype=object, count=len(rows) * width)
+            position = np.flatnonzero(grid != None)  # noqa: E711 (comparación elemento a elemento)
+            row_index, col_index = np.divmod(position, width) if width else (position, position)
+            if len(position):
+                kinds, nums, texts = _encode_values(grid[position])
+                values.append(pa.table({
+                    'sheet': pa.DictionaryArray.from_arrays(pa.array(np.zeros(len(row_index), np.int32)), pa.array([sheet], pa.string())),
+                    'row': pa.array(row_index + 1, pa.int32()),
+                    'col': pa.array(col_index, pa.int32()),
+                    'kind': kinds,
+                    'num': nums,
+                    'text': texts,
+                }, schema=REM_VALUES_SCHEMA))
+                n_values += len(row_index)
+            for label, row_numbers in data['labels'].items():
+                # Sin fila: la etiqueta existe aunque no se haya encontrado en la hoja
+                add(path, sheet, PART_LABEL, key=label)
+                for row_number in row_numbers:
+                    add(path, sheet, PART_LABEL, row=row_number, key=label)
+            for cell_range in data.get('ranges', {}):
+                add(path, sheet, PART_RANGE, key=cell_range)
+        index[path] = (start, len(columns['path']), values_start, n_values)
+    parts = _dictionary_table(columns, REM_PARTS_SCHEMA)
+    values = pa.concat_tables(values).unify_dictionaries().combine_chunks() if values else REM_VALUES_SCHEMA.empty_table()
+    return parts, values, index
+
+def _column(table, name):
+    # Columna de un solo bloque: vista sobre el archivo mapeado, sin copia
+    column = table.column(name)
+    return column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+
+class SharedRows(Sequence):
+    """
+    The 'rows' of one extracted sheet read from the memory-mapped values table
+    of rem_tables: a row is located with a binary search on the mapped row
+    column and decoded only when indexed, so a worker never holds a Python
+    copy of the sheet. Rows are tuples of the sheet width (or their own width
+    when it differs), like extract_workbook's.
+    """
+
+    def __init__(self, values, n_rows, width, widths):
+        self.values = values
+        self.row_index = _column(values, 'row').to_numpy()
+        self.n_rows = n_rows
+        self.width = width
+        self.widths = widths
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.n_rows))]
+        if index < 0:
+            index += self.n_rows
+        if not 0 <= index < self.n_rows:
+            raise IndexError("fila fuera de la hoja")
+        row = index + 1
+        start, stop = np.searchsorted(self.row_index, [row, row + 1])
+        cells = [None] * self.widths.get(row, self.width)
+        if stop > start:
+            part = self.values.slice(start, stop - start).to_pydict()
+            for col, kind, num, text in zip(part['col'], part['kind'], part['num'], part['text']):
+                cells[col] = decode_value(kind, num, text)
+        return tuple(cells)
+
+def _sheet_spans(values):
+    # {hoja: (inicio, fin)} de los valores de un archivo (cada hoja es un tramo contiguo)
+    if not values.num_rows:
+        return {}
+    sheet_column = _column(values, 'sheet')
+    codes = sheet_column.indices.to_numpy()
+    names = sheet_column.dictionary.to_pylist()
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1))
+    stops = np.append(starts[1:], len(codes))
+    return {names[codes[start]]: (int(start), int(stop)) for start, stop in zip(starts, stops)}
+
+def rem_from_tables(parts, values):
+    """
+    Extraction result of one file (extract_workbook shape) from its rows of the
+    rem_tables: cells, labels and ranges are decoded (a few values per sheet)
+    and 'rows' are SharedRows over the values table, decoded on access.
+    """
+    sheets = {}
+    widths = {}
+    columns = parts.to_pydict()
+    for sheet, part, row, col, key, kind, num, text in zip(columns['sheet'], columns['part'], columns['row'], columns['col'],
+                                                           columns['key'], columns['kind'], columns['num'], columns['text']):
+        if part == PART_FILE:
+            continue
+        if part == PART_SHEET:
+            sheets[sheet] = {'cells': {}, 'rows': (row, col), 'labels': {}, 'ranges': {}}
+            widths[sheet] = {}
+        elif part == PART_CELL:
+            sheets[sheet]['cells'][key] = decode_value(kind, num, text)
+        elif part == PART_WIDTH:
+            widths[sheet][row] = col
+        elif part == PART_LABEL:
+            rows = sheets[sheet]['labels'].setdefault(key, [])
+            if row is not None:
+                rows.append(row)
+        elif part == PART_RANGE:
+            sheets[sheet]['ranges'][key] = None
+
+    spans = _sheet_spans(values)
+    for sheet, data in sheets.items():
+        n_rows, width = data['rows']
+        start, stop = spans.get(sheet, (0, 0))
+        data['rows'] = SharedRows(values.slice(start, stop - start), n_rows, width, widths[sheet])
+        data['ranges'] = {cell_range: range_array(data['cells'], cell_range) for cell_range in data['ranges']}
+    return sheets
+
+class SharedRem(MutableMapping):
+    """
+    The run's REM extraction ({path: extract_workbook(...)}) as seen by a
+    worker process: backed by memory-mapped rem_tables segments; a file is
+    opened (rem_from_tables) when a meta reads it and its rows stay in the
+    mapped files. Pickling sends the segment paths and their row index, not
+    the data. Files added by the worker (extract_rem on a file the main
+    process did not extract) stay local to it.
+    """
+
+    def __init__(self, segments):
+        self.segments = list(segments)
+        self._reset()
+
+    def _reset(self):
+        self._tables = {}
+        self._files = {}
+        self._local = {}
+        self._index = {}
+        for parts_path, values_path, index in self.segments:
+            for path, rows in index.items():
+                self._index[path] = (parts_path, values_path, rows)
+
+    def __getstate__(self):
+        return {'segments': self.segments}
+
+    def __setstate__(self, state):
+        self.segments = state['segments']
+        self._reset()
+
+    def __getitem__(self, path):
+        if path in self._local:
+            return self._local[path]
+        if path not in self._files:
+            parts_path, values_path, (start, stop, values_start, values_stop) = self._index[path]
+            for segment in (parts_path, values_path):
+                if segment not in self._tables:
+                    self._tables[segment] = read_shared_table(segment)
+            self._files[path] = rem_from_tables(self._tables[parts_path].slice(start, stop - start),
+                                                self._tables[values_path].slice(values_start, values_stop - values_start))
+        return self._files[path]
+
+    def __setitem__(self, path, value):
+        self._local[path] = value
+
+    def __delitem__(self, path):
+        del self._local[path]
+
+    def __contains__(self, path):
+        return path in self._local or path in self._index
+
+    def __iter__(self):
+        yield from self._index
+        yield from (path for path in self._local if path not in self._index)
+
+    def __len__(self):
+        return len(self._index) + sum(1 for path in self._local if path not in self._index)
+
+class SharedMapping(Mapping):
+    """A {key: value} string dict published as a two-column Arrow IPC file, read on first use."""
+
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._data = None
+
+    def _dict(self):
+        if self._data is None:
+            table = read_shared_table(self.path)
+            self._data = dict(zip(table.column('key').to_pylist(), table.column('value').to_pylist()))
+        return self._data
+
+    def __getitem__(self, key):
+        return self._dict()[key]
+
+    def __iter__(self):
+        return iter(self._dict())
+
+    def __len__(self):
+        return len(self._dict())
+
+class ContextPublisher:
+    """
+    Publishes the shared run context for worker processes as Arrow IPC files
+    in a temporary directory: the PIV histogram, the center names and the REM
+    extraction (one segment per batch of newly extracted files). snapshot()
+    returns the context to send to a worker, where those entries are replaced
+    by references to the files, which the worker memory-maps.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = tempfile.mkdtemp(prefix="metas_ctx_", dir=directory)
+        self.segments = []
+        self.published = set()
+        self.piv_hist_file = None
+        self.center_names = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def snapshot(self, context):
+        with span('publicar_contexto'):
+            nuevos = [path for path in context['rem'] if path not in self.published]
+            if nuevos:
+                parts, values, index = rem_tables(context['rem'], nuevos)
+                name = f"rem_{len(self.segments):03d}"
+                self.segments.append((write_shared_table(parts, self._path(name + "_partes.arrow")),
+                                      write_shared_table(values, self._path(name + "_valores.arrow")), index))
+                self.published.update(nuevos)
+            if self.piv_hist_file is None and context.get('piv_hist') is not None:
+                self.piv_hist_file = write_shared_table(context['piv_hist'], self._path("piv_hist.arrow"))
+            if self.center_names is None:
+                names = context['center_names']
+                table = pa.table({'key': pa.array(list(names), pa.string()), 'value': pa.array(list(names.values()), pa.string())})
+                self.center_names = SharedMapping(write_shared_table(table, self._path("centros.arrow")))
+        shared = dict(context)
+        shared.update(
+            rem=SharedRem(self.segments),
+            piv_hist=None,
+            piv_hist_file=self.piv_hist_file,
+            center_names=self.center_names,
+        )
+        return shared
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+@contextlib.contextmanager
+def shared_context(directory=None):
+    """ContextPublisher whose files are removed on exit (after the worker pool has shut down)."""
+    publisher = ContextPublisher(directory)
+    try:
+        yield publisher
+    finally:
+        publisher.close()
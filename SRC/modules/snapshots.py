@@ -0,0 +1,147 @@
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from .piv import female_mask, fold_counts, count_rows, HIST_PREFIX
+from .profiling import span, count
+from .logs import get_logger
+from config import PIV_BATCH_SIZE
+
+log = get_logger("snapshots")
+
+# Columnas leídas de cada corte PIV, con tipos fijos: los PIV de distintos meses no siempre coinciden
+# (p. ej. anio int64 en un PIV antiguo, int32 en uno construido con piv_builder)
+SNAPSHOT_SCHEMA = pa.schema([
+    ('anio', pa.int32()),
+    ('mes', pa.int32()),
+    ('COD_CENTRO', pa.string()),
+    ('ID_PCTE', pa.string()),
+    ('EDAD_EN_FECHA_CORTE', pa.int64()),
+    ('ACEPTADO_RECHAZADO', pa.string()),
+    ('GENERO', pa.string()),
+    ('GENERO_NORMALIZADO', pa.string()),
+])
+SNAPSHOT_KEYS = ['anio', 'mes']
+MEMBER_KEYS = ['COD_CENTRO', 'ID_PCTE']
+
+# Altas y bajas por centro entre dos cortes consecutivos
+DRIFT_SCHEMA = pa.schema([
+    ('Corte_Anterior', pa.string()),
+    ('Corte', pa.string()),
+    ('COD_CENTRO', pa.string()),
+    ('Poblacion_Anterior', pa.int64()),
+    ('Poblacion', pa.int64()),
+    ('Altas', pa.int64()),
+    ('Bajas', pa.int64()),
+    ('Variacion', pa.int64()),
+])
+
+def cut_label(anio, mes):
+    """Label of a FONASA cut: '2025-09'."""
+    return f"{anio}-{mes:02d}"
+
+def snapshot_dataset(sources):
+    """
+    One Arrow dataset over several PIV cuts: PIV files and/or folders (a folder
+    contributes every Parquet below it, e.g. one subfolder per cut; hidden
+    files and HIST_ sidecars are skipped). The cut of each row comes from its
+    anio / mes columns, not from the file name.
+    """
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            files.extend(ds.dataset(source, format='parquet', ignore_prefixes=['.', '_', HIST_PREFIX]).files)
+        else:
+            files.append(source)
+    if not files:
+        raise ValueError("No hay archivos PIV para analizar por corte")
+    return ds.dataset(sorted(set(files)), format='parquet', schema=SNAPSHOT_SCHEMA)
+
+def scan_snapshots(sources, batch_size=PIV_BATCH_SIZE):
+    """
+    Reads several PIV cuts in a single pass over an Arrow dataset
+    (snapshot_dataset), batch by batch, keeping the ACEPTADO population only.
+    Returns (hist, members):
+    - hist: counts by (anio, mes, COD_CENTRO, EDAD_EN_FECHA_CORTE, MUJER), the
+      piv.load_piv_histogram histogram of every cut (see snapshot_histogram);
+    - members: distinct (anio, mes, COD_CENTRO, ID_PCTE) with a known ID_PCTE,
+      for population_drift.
+    """
+    hist_keys = SNAPSHOT_KEYS + ['COD_CENTRO', 'EDAD_EN_FECHA_CORTE', 'MUJER']
+    member_keys = SNAPSHOT_KEYS + MEMBER_KEYS
+    dataset = snapshot_dataset(sources)
+    hist = None
+    members = []
+    with span('piv_read'):
+        for batch in dataset.to_batches(filter=pc.field('ACEPTADO_RECHAZADO') == 'ACEPTADO', batch_size=batch_size):
+            count('piv_rows', batch.num_rows)
+            count('piv_batches')
+            base = pa.table({
+                'anio': batch.column('anio'),
+                'mes': batch.column('mes'),
+                'COD_CENTRO': batch.column('COD_CENTRO'),
+                'EDAD_EN_FECHA_CORTE': pc.fill_null(batch.column('EDAD_EN_FECHA_CORTE'), -1),
+                'MUJER': female_mask(batch),
+            })
+            hist = fold_counts(hist, count_rows(base, hist_keys), hist_keys)
+            # Sin ID_PCTE no se puede seguir a la persona entre cortes: cuenta en el histograma, no en altas y bajas
+            identified = batch.filter(pc.is_valid(batch.column('ID_PCTE'))).select(member_keys)
+            members.append(pa.Table.from_batches([identified]).group_by(member_keys).aggregate([]))
+    if hist is None:
+        raise ValueError("Los cortes PIV no tienen población ACEPTADO")
+    members = pa.concat_tables(members).group_by(member_keys).aggregate([])
+    log.info(f"Cortes PIV leídos: {', '.join(cut_label(a, m) for a, m in snapshot_cuts(hist))} "
+             f"({len(dataset.files)} archivos)")
+    return hist, members
+
+def snapshot_cuts(table):
+    """Sorted (anio, mes) cuts present in a snapshot table."""
+    cuts = table.group_by(SNAPSHOT_KEYS).aggregate([])
+    return sorted(zip(cuts.column('anio').to_pylist(), cuts.column('mes').to_pylist()))
+
+def _cut_filter(table, anio, mes):
+    return table.filter(pc.and_(pc.equal(table.column('anio'), anio), pc.equal(table.column('mes'), mes)))
+
+def snapshot_histogram(hist, anio, mes):
+    """Histogram of one cut, shaped like piv.load_piv_histogram (piv.count_by_center etc. apply)."""
+    return _cut_filter(hist, anio, mes).drop_columns(SNAPSHOT_KEYS)
+
+def _center_counts(table, name):
+    counts = table.group_by('COD_CENTRO').aggregate([('ID_PCTE', 'count')])
+    return counts.rename_columns([name if column == 'ID_PCTE_count' else column for column in counts.column_names])
+
+def population_drift(members):
+    """
+    Altas and bajas by center between consecutive cuts, matching people by
+    ID_PCTE with Arrow hash joins (left anti joins on COD_CENTRO, ID_PCTE): an
+    alta is enrolled at the center in the cut and not in the previous one, a
+    baja the other way round, so a transfer is a baja at one center and an alta
+    at the other. Returns a DRIFT_SCHEMA table sorted by cut and center.
+    """
+    cuts = snapshot_cuts(members)
+    tables = []
+    for previous, current in zip(cuts, cuts[1:]):
+        before = _cut_filter(members, *previous).select(MEMBER_KEYS)
+        after = _cut_filter(members, *current).select(MEMBER_KEYS)
+        with span('drift_join'):
+            altas = after.join(before, keys=MEMBER_KEYS, join_type='left anti')
+            bajas = before.join(after, keys=MEMBER_KEYS, join_type='left anti')
+        drift = _center_counts(before, 'Poblacion_Anterior')
+        for table, name in [(after, 'Poblacion'), (altas, 'Altas'), (bajas, 'Bajas')]:
+            drift = drift.join(_center_counts(table, name), keys='COD_CENTRO', join_type='full outer')
+        n = drift.num_rows
+        poblacion_anterior = pc.fill_null(drift.column('Poblacion_Anterior'), 0)
+        poblacion = pc.fill_null(drift.column('Poblacion'), 0)
+        tables.append(pa.Table.from_arrays([
+            pa.array([cut_label(*previous)] * n, pa.string()),
+            pa.array([cut_label(*current)] * n, pa.string()),
+            drift.column('COD_CENTRO'),
+            poblacion_anterior,
+            poblacion,
+            pc.fill_null(drift.column('Altas'), 0),
+            pc.fill_null(drift.column('Bajas'), 0),
+            pc.subtract(poblacion, poblacion_anterior),
+        ], schema=DRIFT_SCHEMA))
+    if not tables:
+        return DRIFT_SCHEMA.empty_table()
+    return pa.concat_tables(tables).sort_by([('Corte', 'ascending'), ('COD_CENTRO', 'ascending')])
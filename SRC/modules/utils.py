@@ -1,8 +1,6 @@
 import os
-import sys
 import csv
-import logging
-from datetime import datetime
+from .logs import get_logger
 
 def get_project_root():
     """Returns the root directory of the project."""
@@ -17,35 +15,6 @@ def normalize_path(path):
         path = os.path.join(get_project_root(), path)
     return os.path.normpath(path)
 
-def setup_audit_logger():
-    """Configures and returns the audit logger."""
-    log_dir = normalize_path("LOG")
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-        
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-    log_file = os.path.join(log_dir, f"MET_SANIT_{timestamp}.LOG")
-    
-    # Create a custom logger
-    logger = logging.getLogger("audit_logger")
-    logger.setLevel(logging.INFO)
-    
-    # handlers
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
-    console_handler = logging.StreamHandler(sys.stdout)
-    
-    # format
-    formatter = logging.Formatter('[%(asctime)s] [%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-    
-    # Avoid adding handlers multiple times if function is called repeatedly
-    if not logger.handlers:
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
-        
-    return logger
-
 def load_center_names():
     """Carga los nombres de los centros desde DOC/COD_CENTROS_SALUD.CSV"""
     mapping_names = {}
@@ -62,5 +31,5 @@ def load_center_names():
                     if code[-1].isalpha():
                         mapping_names[code[:-1]] = name
         except Exception as e:
-            print(f"Error cargando nombres de centros: {e}")
+            get_logger("centros").error(f"Error cargando nombres de centros: {e}")
     return mapping_names
@@ -0,0 +1,232 @@
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import contextlib
+from datetime import datetime
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+
+DATOS_DEFECTO = os.path.join(current_dir, "datos_sinteticos")
+BASELINE_DEFECTO = os.path.join(current_dir, "baseline.json")
+RESULTADOS_DIR = os.path.join(current_dir, "resultados")
+
+# Una etapa es regresión si tarda más que la línea base en esta proporción y en al menos MIN_SEGUNDOS
+TOLERANCIA_DEFECTO = 0.25
+MIN_SEGUNDOS = 0.05
+
+class Cronometro:
+    """
+    Mide cada etapa con la salida de los cálculos silenciada: segundos, pico de memoria (RSS)
+    acumulado del proceso al terminar y cuánto subió ese pico durante la etapa (0 si la etapa
+    usó menos memoria que alguna anterior: el sistema solo informa el máximo desde el inicio)
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.etapas = {}
+
+    @contextlib.contextmanager
+    def etapa(self, nombre):
+        from modules.profiling import peak_rss_mb
+        pico_inicio = peak_rss_mb()
+        with open(os.devnull, 'w', encoding='utf-8') as devnull:
+            salida = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(devnull)
+            inicio = time.perf_counter()
+            with salida:
+                yield
+            segundos = time.perf_counter() - inicio
+        pico = peak_rss_mb()
+        aumento = round(pico - pico_inicio, 1) if pico is not None else None
+        self.etapas[nombre] = {'segundos': round(segundos, 4), 'rss_pico_acumulado_mb': pico, 'rss_aumento_pico_mb': aumento}
+        print(f"  {nombre:<24} {segundos:9.3f} s   RSS pico acumulado {pico} MB (+{aumento} MB)")
+
+def limpiar_cache(datos_dir):
+    """Ejecución en frío: borra caché de extracción, cubo REM e histograma PIV de los datos de prueba"""
+    for carpeta in [os.path.join(datos_dir, "DATOS", "CACHE"), os.path.join(datos_dir, "DATOS", "CUBO_REM")]:
+        if os.path.exists(carpeta):
+            shutil.rmtree(carpeta)
+    piv_dir = os.path.join(datos_dir, "DATOS", "PIV")
+    if os.path.exists(piv_dir):
+        for nombre in os.listdir(piv_dir):
+            if nombre.startswith("HIST_"):
+                os.remove(os.path.join(piv_dir, nombre))
+
+def ejecutar(cronometro):
+    """
+    Recorre las etapas del consolidado con las funciones de main_consolidado:
+    escaneo, PIV, cubo, extracción por meta (cada meta por separado, con su
+    propio plan), extracción compartida por serie, cálculo de cada meta y
+    consolidación. Devuelve el escenario medido (archivos y filas PIV).
+    """
+    # Se importan aquí: config lee METAS_BASE_DIR al importarse
+    import pyarrow.parquet as pq
+    from modules.context import new_run_context, context_rem_files
+    from modules.piv import find_latest_piv
+    from modules.extraction import merge_requests, extract_rem
+    from modules.results import concat_results, consolidate
+    import main_consolidado as mc
+    from config import DIR_SERIE_A_ACTUAL, DIR_SERIE_A_ANTERIOR, DIR_SERIE_P_ACTUAL
+
+    with cronometro.etapa('escaneo'):
+        context = new_run_context(find_latest_piv())
+        mc.escanear_rem(context)
+    with cronometro.etapa('piv'):
+        mc.preparar_piv(context)
+    with cronometro.etapa('cubo'):
+        mc.construir_cubo(context)
+
+    mapping_a = context_rem_files(context, DIR_SERIE_A_ACTUAL) + context_rem_files(context, DIR_SERIE_A_ANTERIOR)
+    mapping_p = context_rem_files(context, DIR_SERIE_P_ACTUAL)
+    for meta, modulo in zip(mc.METAS, [mc.meta_1_dsm, mc.meta_2_pap, mc.meta_3_bucal, mc.meta_4_dm2,
+                                       mc.meta_5_hta, mc.meta_6_lactancia, mc.meta_7_resp]):
+        if modulo in mc.METAS_SERIE_A:
+            archivos = list({entry['path']: entry for entry in modulo.seleccionar_archivos(mapping_a)}.values())
+        else:
+            archivos = mapping_p
+        with cronometro.etapa(f'extraccion_{meta}'):
+            extract_rem(archivos, merge_requests(modulo.REM_REQUESTS), {}, [])
+
+    with cronometro.etapa('rem_serie_a'):
+        mc.extraer_serie_a(context)
+    with cronometro.etapa('rem_serie_p'):
+        mc.extraer_serie_p(context)
+
+    reportes = {}
+    for meta, (calcular, _) in mc.METAS.items():
+        with cronometro.etapa(f'calculo_{meta}'):
+            reportes[meta] = calcular(context)
+
+    with cronometro.etapa('consolidacion'):
+        resultados = concat_results([reportes[meta] for meta in mc.METAS])
+        consolidado = consolidate(resultados, context['center_names'], datetime.now().strftime("%Y-%m-%d"))
+        mc.exportar_consolidado(consolidado, context['quarantine'])
+    mc.guardar_manifiesto(context)
+
+    return {
+        'libros_rem': len(mapping_a) + len(mapping_p),
+        'centros': len({entry['code'] for entry in mapping_a + mapping_p}),
+        'filas_piv': pq.ParquetFile(context['piv_file']).metadata.num_rows,
+        'filas_consolidado': consolidado.num_rows,
+    }
+
+def comparar(resultado, baseline, tolerancia):
+    """Compara las etapas contra la línea base; devuelve la lista de regresiones [(etapa, base, actual)]"""
+    if baseline['escenario'] != resultado['escenario']:
+        print(f"ADVERTENCIA: escenario distinto al de la línea base ({baseline['escenario']}); la comparación es orientativa.")
+    regresiones = []
+    print(f"\n{'Etapa':<24} {'Base (s)':>10} {'Actual (s)':>11} {'Cambio':>8}")
+    for nombre, actual in resultado['etapas'].items():
+        base = baseline['etapas'].get(nombre)
+        if base is None:
+            print(f"{nombre:<24} {'-':>10} {actual['segundos']:11.3f}")
+            continue
+        cambio = (actual['segundos'] / base['segundos'] - 1) if base['segundos'] > 0 else 0
+        marca = ''
+        if actual['segundos'] > base['segundos'] * (1 + tolerancia) and actual['segundos'] - base['segundos'] >= MIN_SEGUNDOS:
+            regresiones.append((nombre, base['segundos'], actual['segundos']))
+            marca = '  <- REGRESIÓN'
+        print(f"{nombre:<24} {base['segundos']:10.3f} {actual['segundos']:11.3f} {cambio:+7.0%}{marca}")
+    return regresiones
+
+def main(args):
+    datos_dir = os.path.abspath(args.datos)
+    if args.regenerar or not os.path.exists(os.path.join(datos_dir, "DATOS", "ENTRADA")):
+        from generar_datos import generar, MARCA_SINTETICOS
+        print(f"=== Generando datos sintéticos en {datos_dir} ===")
+        if args.regenerar and os.path.exists(datos_dir):
+            # Nunca se borra una carpeta que no haya creado el generador (p. ej. la base real)
+            if not os.path.exists(os.path.join(datos_dir, MARCA_SINTETICOS)):
+                print(f"ERROR: {datos_dir} no es una carpeta de datos sintéticos; no se regenera.")
+                return 2
+            shutil.rmtree(datos_dir)
+        generar(datos_dir, args.centros, args.meses, args.meses_anterior, args.filas_piv, args.semilla,
+                args.hojas_relleno, args.filas_relleno)
+    if not args.conservar_cache:
+        limpiar_cache(datos_dir)
+
+    print(f"=== Benchmark ({'caché conservada' if args.conservar_cache else 'en frío'}) sobre {datos_dir} ===")
+    cronometro = Cronometro(args.verbose)
+    inicio = time.perf_counter()
+    escenario = ejecutar(cronometro)
+    total = time.perf_counter() - inicio
+    from modules.profiling import report, peak_rss_mb
+    from config import PIV_BATCH_SIZE
+
+    resultado = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'escenario': dict(escenario, cache='conservada' if args.conservar_cache else 'fria'),
+        'entorno': {
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'motor_rem': os.environ.get("METAS_REM_ENGINE", "openpyxl"),
+            'cubo': os.environ.get("METAS_CUBE", "1") != "0",
+            'lote_piv': PIV_BATCH_SIZE,
+        },
+        'total_segundos': round(total, 4),
+        'rss_pico_mb': peak_rss_mb(),
+        'etapas': cronometro.etapas,
+        # Archivos abiertos, hojas y filas leídas, bytes y aciertos de caché (modules.profiling)
+        'contadores': report()['counters'],
+    }
+    print(f"Total: {total:.3f} s, RSS pico {resultado['rss_pico_mb']} MB, escenario {resultado['escenario']}")
+
+    os.makedirs(RESULTADOS_DIR, exist_ok=True)
+    ruta = os.path.join(RESULTADOS_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"Resultado guardado en {ruta}")
+
+    if args.guardar_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"Línea base actualizada: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("Sin línea base para comparar (usar --guardar-baseline para crearla).")
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regresiones = comparar(resultado, baseline, args.tolerancia)
+    if regresiones:
+        print(f"\n{len(regresiones)} etapas más lentas que la línea base (tolerancia {args.tolerancia:.0%}).")
+        return 1
+    print("\nSin regresiones respecto de la línea base.")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de las etapas del consolidado sobre datos REM/PIV sintéticos")
+    parser.add_argument("--datos", default=DATOS_DEFECTO, help="Carpeta de datos sintéticos (se genera si no existe)")
+    parser.add_argument("--regenerar", action="store_true", help="Vuelve a generar los datos sintéticos")
+    parser.add_argument("--centros", type=int, default=10, help="Centros al generar los datos")
+    parser.add_argument("--meses", type=int, default=6, help="Meses del año actual al generar los datos")
+    parser.add_argument("--meses-anterior", type=int, default=3, help="Meses del año anterior al generar los datos")
+    parser.add_argument("--filas-piv", type=int, default=100_000, help="Filas del PIV al generar los datos")
+    parser.add_argument("--hojas-relleno", type=int, default=4, help="Hojas adicionales por libro REM")
+    parser.add_argument("--filas-relleno", type=int, default=100, help="Filas numéricas por hoja de relleno")
+    parser.add_argument("--semilla", type=int, default=2026, help="Semilla del generador aleatorio")
+    parser.add_argument("--conservar-cache", action="store_true",
+                        help="No borra caché, cubo ni histograma PIV (mide una ejecución en caliente)")
+    parser.add_argument("--baseline", default=BASELINE_DEFECTO, help="Archivo JSON de la línea base")
+    parser.add_argument("--guardar-baseline", action="store_true", help="Guarda este resultado como línea base")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_DEFECTO,
+                        help="Aumento de tiempo por etapa aceptado antes de marcar regresión (0.25 = 25%%)")
+    parser.add_argument("--lote-piv", type=int, default=None,
+                        help="Filas por lote al recorrer el PIV (METAS_PIV_BATCH_SIZE; por defecto el de config)")
+    parser.add_argument("--verbose", action="store_true", help="Muestra la salida de cada etapa")
+    args = parser.parse_args()
+
+    # Las rutas de config se resuelven al importar: la base debe apuntar a los datos sintéticos antes
+    os.environ["METAS_BASE_DIR"] = os.path.abspath(args.datos)
+    if args.lote_piv:
+        os.environ["METAS_PIV_BATCH_SIZE"] = str(args.lote_piv)
+    if not args.verbose:
+        # El registro por consola se escribe en segundo plano: sin --verbose solo advertencias y errores
+        os.environ.setdefault("METAS_CONSOLE_LEVEL", "WARNING")
+    sys.path.append(os.path.join(project_root, 'SRC'))
+    sys.exit(main(args))
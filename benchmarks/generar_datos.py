@@ -0,0 +1,292 @@
+import sys
+import os
+import csv
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+import openpyxl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Add project root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(os.path.join(project_root, 'SRC'))
+
+from config import AGNO_ACTUAL, AGNO_ANTERIOR
+from modules.ages import age_in_years
+from modules.piv_builder import age_group
+
+# Carpeta por defecto de los datos sintéticos (ignorada por git)
+DESTINO_DEFECTO = os.path.join(current_dir, "datos_sinteticos")
+# Marca que identifica una carpeta creada por este generador (solo esas se pueden regenerar)
+MARCA_SINTETICOS = ".datos_sinteticos"
+
+MESES = ['ENE', 'FEB', 'MAR', 'ABR', 'MAY', 'JUN', 'JUL', 'AGO', 'SEP', 'OCT', 'NOV', 'DIC']
+NOMBRES_MES = ['ENERO', 'FEBRERO', 'MARZO', 'ABRIL', 'MAYO', 'JUNIO', 'JULIO', 'AGOSTO',
+               'SEPTIEMBRE', 'OCTUBRE', 'NOVIEMBRE', 'DICIEMBRE']
+
+# Esquema real del PIV (17 columnas, ver DATOS/PIV/mapping_piv_metas.log)
+PIV_SCHEMA = pa.schema([
+    ('RUN', pa.string()),
+    ('DV', pa.string()),
+    ('FECHA_NACIMIENTO', pa.timestamp('us')),
+    ('FECHA_CORTE', pa.timestamp('us')),
+    ('NOMBRE_CENTRO', pa.string()),
+    ('COD_CENTRO', pa.string()),
+    ('ACEPTADO_RECHAZADO', pa.string()),
+    ('GENERO', pa.string()),
+    ('TRAMO', pa.string()),
+    ('source_file', pa.string()),
+    ('anio', pa.int32()),
+    ('mes', pa.int32()),
+    ('ID_PCTE', pa.string()),
+    ('DSM_TCO', pa.string()),
+    ('GENERO_NORMALIZADO', pa.string()),
+    ('EDAD_EN_FECHA_CORTE', pa.int32()),
+    ('GRUPO_ETARIO', pa.string()),
+])
+# Filas del PIV generadas por lote (acota la memoria del generador)
+LOTE_PIV = 500_000
+
+# Tramos etarios de la Sección A de P12 (filas 11 a 19)
+TRAMOS_P12 = ["Menor de 25 años", "25 a 29 años", "30 a 34 años", "35 a 39 años", "40 a 44 años",
+              "45 a 49 años", "50 a 54 años", "55 a 59 años", "60 a 64 años"]
+
+def centros_sinteticos(n_centros):
+    """Códigos y nombres de los centros sintéticos: [(código de 6 dígitos, nombre)]"""
+    return [(f"{900001 + i}", f"CENTRO SINTETICO {i + 1:03d}") for i in range(n_centros)]
+
+def escribir_centros(destino, centros):
+    """DOC/COD_CENTROS_SALUD.CSV con los centros sintéticos (mismo formato que el real)"""
+    doc_dir = os.path.join(destino, "DOC")
+    os.makedirs(doc_dir, exist_ok=True)
+    with open(os.path.join(doc_dir, "COD_CENTROS_SALUD.CSV"), 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['COD_CENTRO', 'NOMBRE', 'TIPO_CENTRO'])
+        for codigo, nombre in centros:
+            writer.writerow([f"{codigo}A", nombre, 'CESFAM'])
+
+def encabezado(hoja, titulo, codigo, nombre, agno, mes):
+    """Filas de identificación del encabezado REM (1 a 6)"""
+    return {
+        1: ['SERVICIO DE SALUD SINTETICO'],
+        2: ['COMUNA: COMUNA SINTETICA (09999)'],
+        3: [f'ESTABLECIMIENTO/ESTRATEGIA: {nombre} ({codigo})'],
+        4: [f'MES: {NOMBRES_MES[mes - 1]} ({mes:02d})'],
+        5: [f'AÑO: {agno}'],
+        6: [f'REM-{hoja}. {titulo}'],
+    }
+
+def fila(etiquetas, valores, desde):
+    """Fila con etiquetas en las primeras columnas y los valores desde el índice `desde` (0 = columna A)"""
+    celdas = list(etiquetas) + [None] * max(0, desde - len(etiquetas))
+    return celdas + [int(v) for v in valores]
+
+def hoja_a03(rng, filas, ancho):
+    """A03: DSM (J23:M28), lactancia (H61:H63) y PAUTA CERO con su fila TOTAL (columnas 5 a 24)"""
+    filas[8] = ['SECCIÓN A: APLICACIÓN DE INSTRUMENTO Y RESULTADO EN EL NIÑO (A)']
+    filas[20] = fila(['Aplicación test de Desarrollo Psicomotor'], rng.integers(0, 40, 11), 2)
+    evaluaciones = [
+        (21, 'Primera Evaluación', 'Normal'), (22, None, 'Normal con Rezago'), (23, None, 'Riesgo'),
+        (24, None, 'Retraso'), (25, 'Reevaluación', 'Normal (desde normal con rezago)'),
+        (26, None, 'Normal (desde riesgo)'), (27, None, 'Normal (desde retraso)'),
+        (28, None, 'Normal Rezago (desde riesgo)'),
+    ]
+    for r, seccion, resultado in evaluaciones:
+        filas[r] = fila([seccion, resultado], rng.integers(0, 25, 11), 2)
+    filas[60] = ['SECCIÓN B: LACTANCIA MATERNA']
+    for r, etiqueta in [(61, 'Lactancia Materna exclusiva (LME)'),
+                        (62, 'Lactancia Materna más Formula Láctea (LM/FL)'),
+                        (63, 'Formula Láctea (FL)')]:
+        filas[r] = fila([etiqueta], rng.integers(0, 30, 6), 2)
+    filas[67] = fila(['Total de niños y niñas controlados'], rng.integers(0, 90, 6), 2)
+    # Fila TOTAL anterior a la sección (no debe tomarse para la meta 3A)
+    filas[97] = fila(['TOTAL'], rng.integers(0, 200, ancho - 2), 2)
+    filas[203] = ['PAUTA CERO', 'TOTAL', None, None, None, 'RANGO ETARIO Y SEXO']
+    for i, tramo in enumerate(["Menor de 1 año", "1 año", "2 años", "3 a 9 años"]):
+        filas[204 + i] = fila([None, tramo], rng.integers(0, 15, 20), 5)
+    filas[208] = fila(['TOTAL'], rng.integers(0, 60, 22), 3)
+    filas[222] = fila(['TOTAL'], rng.integers(0, 200, ancho - 2), 2)
+
+def hoja_a09(rng, filas, ancho):
+    """A09: atenciones odontológicas, con la fila de operatoria de alta complejidad (S48:T48)"""
+    filas[8] = ['SECCIÓN A: ATENCIONES ODONTOLÓGICAS']
+    for r in range(10, 48):
+        filas[r] = fila([f'Actividad odontológica {r - 9}'], rng.integers(0, 50, ancho - 3), 3)
+    filas[48] = fila(['Ingreso a tratamiento Operatoria  de alta complejidad'], rng.integers(0, 20, 20), 3)
+
+def hoja_p3(rng, filas, ancho):
+    """P3: población en control respiratorio (asma controlado y EPOC con control adecuado)"""
+    filas[8] = ['SECCIÓN A: EXISTENCIA DE POBLACIÓN EN CONTROL']
+    for r, etiqueta in [(15, 'Asma Bronquial Leve'), (16, 'Asma Bronquial Moderado'),
+                        (18, 'Enfermedad Pulmonar Obstructiva Crónica (EPOC) Tipo A')]:
+        filas[r] = fila([etiqueta], rng.integers(0, 20, ancho - 2), 2)
+    filas[64] = ['SECCIÓN C: NIVEL DE CONTROL']
+    edades = rng.integers(0, 12, ancho - 5)
+    filas[65] = fila(['Asma Bronquial Controlado', None, int(edades.sum()), 0, 0], edades, 5)
+    filas[69] = fila(['Enfermedad Pulmonar Obstructiva Crónica (EPOC) Logra Control Adecuado'],
+                     rng.integers(0, 10, 3), 2) + [None] * 16 + [int(v) for v in rng.integers(0, 10, ancho - 21)]
+
+def hoja_p4(rng, filas, ancho):
+    """P4: programa cardiovascular (DM2 en la Sección A, compensación y pie diabético en la columna C)"""
+    filas[8] = ['SECCIÓN A: PROGRAMA SALUD CARDIOVASCULAR (PSCV)']
+    filas[12] = fila(['NUMERO DE PERSONAS EN PSCV'], rng.integers(100, 900, 3), 2)
+    for r, etiqueta in [(16, 'Hipertensión Arterial'), (17, 'Diabetes Mellitus tipo 2 '), (18, 'Dislipidemia')]:
+        filas[r] = fila([etiqueta], rng.integers(50, 600, 3), 2)
+    filas[26] = ['SECCIÓN B: METAS DE COMPENSACIÓN']
+    compensacion = [
+        (28, 'Personas Bajo Control por Hipertensión ', 'PA < 140/90 mmHg '),
+        (29, None, 'PA < 150/90 mmHg '),
+        (30, 'Personas Bajo Control por Diabetes Mellitus ', 'HbA1C<7% '),
+        (31, None, 'HbA1C<8%'),
+        (32, None, 'HbA1C<7% - PA < 140/90mmHg y Colesterol LDL < 70 mg/dl'),
+    ]
+    for r, grupo, etiqueta in compensacion:
+        filas[r] = fila([grupo, etiqueta], rng.integers(10, 300, 3), 2)
+    filas[60] = ['SECCIÓN C: EVALUACIÓN DEL PIE DIABÉTICO']
+    filas[61] = fila(['Con *evaluación vigente del pie según pauta de estimación del riesgo', 'Riesgo bajo'],
+                     rng.integers(10, 200, 3), 2)
+    for r, riesgo in [(62, 'Riesgo moderado'), (63, 'Riesgo alto'), (64, 'Riesgo máximo')]:
+        filas[r] = fila([None, riesgo], rng.integers(0, 60, 3), 2)
+
+def hoja_p12(rng, filas, ancho):
+    """P12: PAP vigente por tramo etario (B11:C19)"""
+    filas[9] = ['SECCIÓN A1: PROGRAMA DE CÁNCER DE CUELLO UTERINO: POBLACIÓN CON PAP VIGENTE']
+    filas[10] = ['GRUPOS DE EDAD', 'TOTAL', 'PAP VIGENTE']
+    for i, tramo in enumerate(TRAMOS_P12):
+        filas[11 + i] = fila([tramo], rng.integers(0, 150, 2), 1)
+
+# Hojas que leen las metas: (constructor, ancho, título)
+HOJAS_A = {
+    'A03': (hoja_a03, 96, 'APLICACIÓN Y RESULTADOS DE ESCALAS DE EVALUACIÓN'),
+    'A09': (hoja_a09, 40, 'ATENCIÓN DE SALUD ODONTOLÓGICA'),
+}
+HOJAS_P = {
+    'P3': (hoja_p3, 101, 'POBLACIÓN EN CONTROL PROGRAMA RESPIRATORIO'),
+    'P4': (hoja_p4, 30, 'POBLACIÓN EN CONTROL PROGRAMA SALUD CARDIOVASCULAR'),
+    'P12': (hoja_p12, 20, 'PROGRAMA DE LA MUJER'),
+}
+
+def escribir_libro(ruta, hojas, codigo, nombre, agno, mes, rng, hojas_relleno, filas_relleno):
+    """
+    Escribe un libro REM sintético (.xlsm, modo write_only): las hojas que leen
+    las metas con sus etiquetas y coordenadas reales, más `hojas_relleno` hojas
+    de `filas_relleno` filas numéricas para acercarse al tamaño de un REM real.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    relleno = [f"{'A' if 'A03' in hojas else 'P'}{90 + i:02d}" for i in range(hojas_relleno)]
+    for hoja in list(hojas) + relleno:
+        ws = wb.create_sheet(hoja)
+        if hoja in hojas:
+            construir, ancho, titulo = hojas[hoja]
+            filas = encabezado(hoja, titulo, codigo, nombre, agno, mes)
+            construir(rng, filas, ancho)
+        else:
+            filas = encabezado(hoja, 'HOJA DE RELLENO', codigo, nombre, agno, mes)
+            for r in range(10, 10 + filas_relleno):
+                filas[r] = fila([f'Prestación {r - 9}'], rng.integers(0, 100, 30), 2)
+        for r in range(1, max(filas) + 1):
+            ws.append(filas.get(r, []))
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    wb.save(ruta)
+
+def escribir_rem(destino, centros, meses, meses_anterior, rng, hojas_relleno, filas_relleno):
+    """
+    Libros REM sintéticos con la estructura de carpetas que reconoce el escaneo:
+    Serie A del año actual (meses 1..meses) y de los últimos `meses_anterior`
+    meses del año anterior, y un corte Serie P (junio del año actual) por centro.
+    Devuelve el número de libros escritos.
+    """
+    entrada = os.path.join(destino, "DATOS", "ENTRADA")
+    libros = []
+    for codigo, nombre in centros:
+        for mes in range(1, meses + 1):
+            carpeta = os.path.join(entrada, "REM_ANO_ACTUAL", "SERIE_A", str(AGNO_ACTUAL), MESES[mes - 1])
+            libros.append((os.path.join(carpeta, f"{codigo}A.xlsm"), HOJAS_A, codigo, nombre, AGNO_ACTUAL, mes))
+        for mes in range(13 - meses_anterior, 13):
+            carpeta = os.path.join(entrada, "REM_ANO_PASADO", "SERIE_A", str(AGNO_ANTERIOR), f"{MESES[mes - 1]}_{AGNO_ANTERIOR}")
+            libros.append((os.path.join(carpeta, f"{codigo}A.xlsm"), HOJAS_A, codigo, nombre, AGNO_ANTERIOR, mes))
+        carpeta = os.path.join(entrada, "REM_ANO_ACTUAL", "SERIE_P", str(AGNO_ACTUAL), "JUN")
+        libros.append((os.path.join(carpeta, f"{codigo}P.xlsm"), HOJAS_P, codigo, nombre, AGNO_ACTUAL, 6))
+    for i, (ruta, hojas, codigo, nombre, agno, mes) in enumerate(libros, start=1):
+        escribir_libro(ruta, hojas, codigo, nombre, agno, mes, rng, hojas_relleno, filas_relleno)
+        if i % 50 == 0 or i == len(libros):
+            print(f"Libros REM generados: {i}/{len(libros)}")
+    return len(libros)
+
+def lote_piv(rng, inicio, n, centros, fecha_corte):
+    """Un lote de n filas del PIV sintético como pyarrow Table (columnas en el orden real)"""
+    codigos = np.array([codigo for codigo, _ in centros])
+    nombres = np.array([nombre for _, nombre in centros])
+    centro = rng.integers(0, len(centros), n)
+    # Pirámide aproximada: menos personas en las edades mayores. Se sortea la fecha de nacimiento y la edad
+    # y el grupo etario se calculan desde ella como en el PIV construido (piv_builder.derive_batch)
+    dias = np.minimum(rng.exponential(32 * 365.25, n), 105 * 365.25).astype(np.int64)
+    corte = np.datetime64(fecha_corte, 'us')
+    nacimiento = pa.array((corte - dias.astype('timedelta64[D]')).astype('datetime64[us]'))
+    edad = age_in_years(nacimiento, fecha_corte)
+    mujer = rng.random(n) < 0.52
+    run = np.char.mod('%d', np.arange(inicio, inicio + n) + 5_000_000)
+    dv = np.array(list('0123456789K'))[rng.integers(0, 11, n)]
+    return pa.table({
+        'RUN': run,
+        'DV': dv,
+        'FECHA_NACIMIENTO': nacimiento,
+        'FECHA_CORTE': pa.array(np.full(n, corte)),
+        'NOMBRE_CENTRO': nombres[centro],
+        'COD_CENTRO': codigos[centro],
+        'ACEPTADO_RECHAZADO': np.where(rng.random(n) < 0.97, 'ACEPTADO', 'RECHAZADO'),
+        'GENERO': np.where(mujer, 'MUJER', 'HOMBRE'),
+        'TRAMO': np.array(list('ABCD'))[rng.integers(0, 4, n)],
+        'source_file': np.char.add(np.char.add('Detalle_', codigos[centro]), '.txt'),
+        'anio': np.full(n, fecha_corte.year, dtype=np.int32),
+        'mes': np.full(n, fecha_corte.month, dtype=np.int32),
+        'ID_PCTE': np.char.add(run, dv),
+        'DSM_TCO': np.where(rng.random(n) < 0.9, 'SI', 'NO'),
+        'GENERO_NORMALIZADO': np.where(mujer, 'FEMENINO', 'MASCULINO'),
+        'EDAD_EN_FECHA_CORTE': edad,
+        'GRUPO_ETARIO': age_group(edad),
+    }, schema=PIV_SCHEMA)
+
+def escribir_piv(destino, centros, n_filas, rng, agno, mes):
+    """PIV sintético en DATOS/PIV/PIV_<año>_<mes>_SINTETICO.parquet, escrito por lotes"""
+    piv_dir = os.path.join(destino, "DATOS", "PIV")
+    os.makedirs(piv_dir, exist_ok=True)
+    ruta = os.path.join(piv_dir, f"PIV_{agno}_{mes:02d}_SINTETICO.parquet")
+    siguiente = datetime(agno + (mes == 12), mes % 12 + 1, 1)
+    fecha_corte = siguiente - timedelta(days=1)
+    with pq.ParquetWriter(ruta, PIV_SCHEMA, compression='snappy') as writer:
+        for inicio in range(0, n_filas, LOTE_PIV):
+            writer.write_table(lote_piv(rng, inicio, min(LOTE_PIV, n_filas - inicio), centros, fecha_corte))
+    print(f"PIV sintético: {ruta} ({n_filas} filas)")
+    return ruta
+
+def generar(destino, n_centros, meses, meses_anterior, filas_piv, semilla, hojas_relleno, filas_relleno):
+    """Genera el árbol completo (DOC, DATOS/ENTRADA, DATOS/PIV) bajo `destino`, apto como METAS_BASE_DIR"""
+    rng = np.random.default_rng(semilla)
+    centros = centros_sinteticos(n_centros)
+    os.makedirs(destino, exist_ok=True)
+    open(os.path.join(destino, MARCA_SINTETICOS), 'w').close()
+    escribir_centros(destino, centros)
+    libros = escribir_rem(destino, centros, meses, meses_anterior, rng, hojas_relleno, filas_relleno)
+    escribir_piv(destino, centros, filas_piv, rng, AGNO_ACTUAL, meses)
+    return {'centros': n_centros, 'meses': meses, 'meses_anterior': meses_anterior,
+            'libros_rem': libros, 'filas_piv': filas_piv, 'semilla': semilla}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera datos REM/PIV sintéticos para los benchmarks")
+    parser.add_argument("--destino", default=DESTINO_DEFECTO, help="Carpeta base de los datos generados")
+    parser.add_argument("--centros", type=int, default=10, help="Número de centros")
+    parser.add_argument("--meses", type=int, default=6, help="Meses del año actual (Serie A, 1 a 12)")
+    parser.add_argument("--meses-anterior", type=int, default=3, help="Últimos meses del año anterior (Serie A)")
+    parser.add_argument("--filas-piv", type=int, default=100_000, help="Filas del PIV (1e5 a 1e7)")
+    parser.add_argument("--hojas-relleno", type=int, default=4, help="Hojas adicionales por libro REM")
+    parser.add_argument("--filas-relleno", type=int, default=100, help="Filas numéricas por hoja de relleno")
+    parser.add_argument("--semilla", type=int, default=2026, help="Semilla del generador aleatorio")
+    args = parser.parse_args()
+    if not 1 <= args.meses <= 12:
+        sys.exit("ERROR: --meses debe estar entre 1 y 12")
+    resumen = generar(args.destino, args.centros, args.meses, args.meses_anterior, args.filas_piv,
+                      args.semilla, args.hojas_relleno, args.filas_relleno)
+    print(f"Datos sintéticos en {args.destino}: {resumen}")